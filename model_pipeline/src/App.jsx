@@ -72,12 +72,18 @@ const App = () => {
     }
   }, [transcript]);
 
+  const resumeListening = () => {
+    resetTranscript();
+    setAwaitingInput(true);
+    SpeechRecognition.startListening({ continuous: true });
+  };
+
   const fetchResponse = async (message) => {
     try {
       const recentMemory = getMemory();
 
       
-      const res = await fetch("https://speakingbot-backend-761810913823.us-central1.run.app/chat", {
+      const res = await fetch("https://speakingbot-backend-761810913823.us-central1.run.app/chat/stream", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -89,23 +95,71 @@ const App = () => {
         }),
       });
 
-      const data = await res.json();
-      const botReply = data.response;
+      if (!res.ok || !res.body) {
+        throw new Error(`Backend returned ${res.status}`);
+      }
 
-      setProductContext(data.product_context || "");
-      setConversationLog((prev) => [...prev, { role: 'bot', text: botReply }]);
-      setCurrentBotResponse(botReply);
+      // Speak each sentence as soon as the backend sends it, instead of
+      // waiting for the whole answer to be generated.
+      let spokenCount = 0;
+      let finishedCount = 0;
+      let streamDone = false;
+      const onSentenceEnd = () => {
+        finishedCount += 1;
+        if (streamDone && finishedCount === spokenCount) {
+          setIsSpeaking(false);
+          resumeListening();
+        }
+      };
 
-      if (!muted) {
-        speak(botReply, () => {
-          resetTranscript();
-          setAwaitingInput(true);
-          SpeechRecognition.startListening({ continuous: true });
-        });
-      } else {
-        resetTranscript();
-        setAwaitingInput(true);
-        SpeechRecognition.startListening({ continuous: true });
+      let partialReply = "";
+      const handleEvent = (event, payload) => {
+        if (event === "token") {
+          partialReply += payload.text;
+          setCurrentBotResponse(partialReply);
+        } else if (event === "sentence" && !muted) {
+          spokenCount += 1;
+          speakQueued(payload.text, onSentenceEnd);
+        } else if (event === "done") {
+          const botReply = payload.response;
+          setProductContext(payload.product_context || "");
+          setConversationLog((prev) => [...prev, { role: 'bot', text: botReply }]);
+          setCurrentBotResponse(botReply);
+          streamDone = true;
+          if (finishedCount === spokenCount) {
+            setIsSpeaking(false);
+            resumeListening();
+          }
+        } else if (event === "error") {
+          throw new Error(payload.error);
+        }
+      };
+
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+          const block = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+
+          let event = "message";
+          let data = "";
+          for (const line of block.split("\n")) {
+            if (line.startsWith("event: ")) event = line.slice(7);
+            else if (line.startsWith("data: ")) data += line.slice(6);
+          }
+          if (data) handleEvent(event, JSON.parse(data));
+        }
+      }
+
+      if (!streamDone) {
+        throw new Error("Stream ended before the answer was complete");
       }
     } catch (error) {
       console.error("Error contacting backend:", error);
@@ -113,17 +167,12 @@ const App = () => {
       // Fallback in case the backend is not responding
       const fallbackResponse = "I'm sorry, I couldn't connect to the server. Please try again later.";
       setCurrentBotResponse(fallbackResponse);
+      speechSynthesis.cancel();
       
       if (!muted) {
-        speak(fallbackResponse, () => {
-          resetTranscript();
-          setAwaitingInput(true);
-          SpeechRecognition.startListening({ continuous: true });
-        });
+        speak(fallbackResponse, resumeListening);
       } else {
-        resetTranscript();
-        setAwaitingInput(true);
-        SpeechRecognition.startListening({ continuous: true });
+        resumeListening();
       }
     }
   };
@@ -160,6 +209,19 @@ const App = () => {
     speechSynthesis.speak(utterance);
   };
 
+  // Queue a sentence behind anything already being spoken.
+  const speakQueued = (text, onEndCallback = () => {}) => {
+    setIsSpeaking(true);
+
+    const utterance = new SpeechSynthesisUtterance(text);
+    utterance.rate = 1;
+    utterance.pitch = 1;
+    utterance.onend = onEndCallback;
+
+    SpeechRecognition.stopListening();
+    speechSynthesis.speak(utterance);
+  };
+
   const toggleMute = () => {
     setMuted(!muted);
     if (speechSynthesis.speaking) {
@@ -0,0 +1,259 @@
+"""
+In-process admission control for the chat endpoints.
+
+- TokenBucketLimiter: per-client token buckets (RATE_LIMIT_PER_MINUTE,
+  RATE_LIMIT_BURST), answered with 429 + Retry-After.
+- AdmissionController / AsyncAdmissionController: at most
+  ADMISSION_MAX_IN_FLIGHT chat requests per worker, plus a short wait queue.
+  Under gunicorn a request only reaches the app once one of the worker's
+  GUNICORN_THREADS threads picks it up, so the limit has to stay below the
+  thread count: by default half the threads run requests and the other half
+  queue (or are shed from) the wait queue. A single-thread worker has no
+  thread to queue on, so the limit is off there (logged at startup).
+  A request is shed with 503 + Retry-After right away when the queue is full
+  or when its expected wait (queue position x average service time) exceeds
+  ADMISSION_MAX_QUEUE_WAIT, instead of waiting for an answer the user has
+  stopped waiting for.
+
+Everything is per worker and needs no external service.
+"""
+import asyncio
+import contextlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+GUNICORN_THREADS = int(os.getenv("GUNICORN_THREADS", 1))
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", GUNICORN_THREADS // 2))  # 0 = no limit
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", GUNICORN_THREADS - ADMISSION_MAX_IN_FLIGHT))
+# The ASGI server has no thread pool to stay inside of
+ASYNC_ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", 16))
+ASYNC_ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 16))
+ADMISSION_MAX_QUEUE_WAIT = float(os.getenv("ADMISSION_MAX_QUEUE_WAIT", 3))
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", 30))  # 0 = no rate limit
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", 10))
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", 10000))
+# Position of the client address in X-Forwarded-For, counted from the right:
+# the entries left of it are whatever the client sent. App Engine appends
+# "<client>, <load balancer>", so the client is second to last. 0 = ignore the header.
+FORWARDED_FOR_CLIENT_HOP = int(os.getenv("FORWARDED_FOR_CLIENT_HOP", 2))
+# Service time assumed before any request has finished
+INITIAL_SERVICE_SECONDS = 2.0
+SERVICE_TIME_ALPHA = 0.2
+
+RATE_LIMITED_MESSAGE = "Too many requests, please slow down."
+ADMISSION_COUNTERS = ("admitted", "queued", "shed_queue_full", "shed_queue_wait", "shed_timeout")
+RATE_LIMITER_COUNTERS = ("allowed", "limited")
+
+
+class Rejected(Exception):
+    """The request was not admitted. status is 429 (rate limit) or 503 (shed)."""
+
+    def __init__(self, status, reason, retry_after):
+        super().__init__(f"{reason} (retry after {retry_after:.1f}s)")
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def retry_after_header(self):
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def client_id(forwarded_for, remote_addr, hop=FORWARDED_FOR_CLIENT_HOP):
+    """
+    Rate limit key: the client address our load balancer recorded hop
+    entries from the right of X-Forwarded-For, else the peer address.
+    """
+    entries = [e.strip() for e in (forwarded_for or "").split(",") if e.strip()]
+    if hop > 0 and len(entries) >= hop:
+        return entries[-hop]
+    return remote_addr or "unknown"
+
+
+class TokenBucketLimiter:
+    """Per-client token buckets. The least recently seen clients are forgotten past max_clients."""
+
+    def __init__(self, rate_per_minute=RATE_LIMIT_PER_MINUTE, burst=RATE_LIMIT_BURST, max_clients=RATE_LIMIT_MAX_CLIENTS):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # client -> (tokens, updated_at)
+        self._lock = threading.Lock()
+        self._counters = {name: 0 for name in RATE_LIMITER_COUNTERS}
+
+    def check(self, client):
+        """Take one token for client, or raise Rejected(429)."""
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[client] = (tokens, now)
+            self._buckets.move_to_end(client)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            self._counters["allowed" if allowed else "limited"] += 1
+        if not allowed:
+            raise Rejected(429, "rate_limited", (1 - tokens) / self.rate)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["clients"] = len(self._buckets)
+        return stats
+
+
+class _Admission:
+    """Bookkeeping shared by the thread and asyncio controllers. Callers hold the lock."""
+
+    def __init__(self, max_in_flight, max_queue, max_queue_wait):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_queue_wait = max_queue_wait
+        self.in_flight = 0
+        self.waiting = 0
+        self.service_time = INITIAL_SERVICE_SECONDS
+        self._counters = {name: 0 for name in ADMISSION_COUNTERS}
+
+    def _has_room(self):
+        return self.max_in_flight <= 0 or self.in_flight < self.max_in_flight
+
+    def _expected_wait(self, position):
+        return (position + 1) * self.service_time / max(1, self.max_in_flight)
+
+    def _admit_or_shed(self):
+        """True if admitted now, False if the caller should queue. Raises Rejected to shed."""
+        if self._has_room() and self.waiting == 0:
+            self.in_flight += 1
+            self._counters["admitted"] += 1
+            return True
+        expected = self._expected_wait(self.waiting)
+        if self.waiting >= self.max_queue:
+            self._counters["shed_queue_full"] += 1
+            raise Rejected(503, "queue_full", expected)
+        if expected > self.max_queue_wait:
+            self._counters["shed_queue_wait"] += 1
+            raise Rejected(503, "queue_wait", expected)
+        self.waiting += 1
+        self._counters["queued"] += 1
+        return False
+
+    def _finish(self, started):
+        self.in_flight -= 1
+        elapsed = time.monotonic() - started
+        self.service_time += SERVICE_TIME_ALPHA * (elapsed - self.service_time)
+
+    def _shed_timeout(self):
+        self._counters["shed_timeout"] += 1
+        return Rejected(503, "queue_timeout", self._expected_wait(self.waiting))
+
+    def _stats(self):
+        stats = dict(self._counters)
+        stats["in_flight"] = self.in_flight
+        stats["waiting"] = self.waiting
+        stats["service_seconds"] = round(self.service_time, 3)
+        return stats
+
+
+class AdmissionController(_Admission):
+    """
+    Bounded in-flight limit with a short wait queue, for threaded servers.
+    With threads (the server's threads per worker) given, a limit that
+    would never leave a thread free to queue a request is refused.
+    """
+
+    def __init__(self, max_in_flight=ADMISSION_MAX_IN_FLIGHT, max_queue=ADMISSION_MAX_QUEUE,
+                 max_queue_wait=ADMISSION_MAX_QUEUE_WAIT, threads=None):
+        if threads is not None and max_in_flight >= threads:
+            raise ValueError(
+                f"ADMISSION_MAX_IN_FLIGHT ({max_in_flight}) must be below GUNICORN_THREADS ({threads}), "
+                "otherwise excess requests wait inside gunicorn and are never queued or shed"
+            )
+        if threads is not None and max_in_flight <= 0:
+            # The default with GUNICORN_THREADS=1: its one request runs, the rest wait in gunicorn's backlog
+            print(f"Admission control is off (ADMISSION_MAX_IN_FLIGHT=0, GUNICORN_THREADS={threads}): "
+                  "excess requests wait inside gunicorn and are never queued or shed; "
+                  "run at least 2 threads per worker to turn it on")
+        super().__init__(max_in_flight, max_queue, max_queue_wait)
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Wait for a slot. Returns the admission time for release(); raises Rejected(503)."""
+        with self._cond:
+            if not self._admit_or_shed():
+                give_up_at = time.monotonic() + self.max_queue_wait
+                try:
+                    while not self._has_room():
+                        remaining = give_up_at - time.monotonic()
+                        if remaining <= 0:
+                            raise self._shed_timeout()
+                        self._cond.wait(remaining)
+                    self.in_flight += 1
+                    self._counters["admitted"] += 1
+                finally:
+                    self.waiting -= 1
+        return time.monotonic()
+
+    def release(self, started):
+        with self._cond:
+            self._finish(started)
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def slot(self):
+        started = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(started)
+
+    def stats(self):
+        with self._cond:
+            return self._stats()
+
+
+class AsyncAdmissionController(_Admission):
+    """AdmissionController for one asyncio event loop (the ASGI server)."""
+
+    def __init__(self, max_in_flight=ASYNC_ADMISSION_MAX_IN_FLIGHT, max_queue=ASYNC_ADMISSION_MAX_QUEUE,
+                 max_queue_wait=ADMISSION_MAX_QUEUE_WAIT):
+        super().__init__(max_in_flight, max_queue, max_queue_wait)
+        self._cond = None  # created on first use, inside the running loop
+
+    async def acquire(self):
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        async with self._cond:
+            if not self._admit_or_shed():
+                try:
+                    await asyncio.wait_for(self._cond.wait_for(self._has_room), self.max_queue_wait)
+                except asyncio.TimeoutError:
+                    raise self._shed_timeout() from None
+                finally:
+                    self.waiting -= 1
+                self.in_flight += 1
+                self._counters["admitted"] += 1
+        return time.monotonic()
+
+    async def release(self, started):
+        async with self._cond:
+            self._finish(started)
+            self._cond.notify()
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        started = await self.acquire()
+        try:
+            yield
+        finally:
+            await self.release(started)
+
+    def stats(self):
+        # Plain reads, only ever written on the event loop thread
+        return self._stats()
@@ -0,0 +1,119 @@
+"""
+Answer cache for the RAG assistant.
+
+Two tiers in front of the LLM call:
+- exact: keyed by normalized question + index version
+- semantic: reuses an answer when a new query embedding is within a cosine
+  radius of an earlier query that retrieved the same top chunk
+
+Everything is dropped as soon as the index version changes.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from embedding_cache import normalize_query
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 512))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 6 * 3600))
+# Maximum cosine distance (1 - cosine similarity) for a semantic hit, 0 disables the tier
+ANSWER_CACHE_SEMANTIC_RADIUS = float(os.getenv("ANSWER_CACHE_SEMANTIC_RADIUS", 0.05))
+ANSWER_CACHE_PER_CHUNK = int(os.getenv("ANSWER_CACHE_PER_CHUNK", 16))
+
+
+class AnswerCache:
+    def __init__(self, max_entries=ANSWER_CACHE_SIZE, ttl_seconds=ANSWER_CACHE_TTL,
+                 semantic_radius=ANSWER_CACHE_SEMANTIC_RADIUS, per_chunk=ANSWER_CACHE_PER_CHUNK):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.semantic_radius = semantic_radius
+        self.per_chunk = per_chunk
+
+        self.version = None
+        self._exact = OrderedDict()     # normalized question -> (expires_at, result)
+        self._semantic = OrderedDict()  # top chunk asin -> [(expires_at, query_vector, result)]
+        self._lock = threading.Lock()
+        self._counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "invalidations": 0}
+
+    def _sync_version(self, version):
+        # Called with the lock held
+        if version != self.version:
+            if self.version is not None:
+                self._counters["invalidations"] += 1
+            self._exact.clear()
+            self._semantic.clear()
+            self.version = version
+
+    def lookup(self, question, version):
+        """Exact tier lookup. Returns the cached result dict or None."""
+        key = normalize_query(question)
+        with self._lock:
+            self._sync_version(version)
+            entry = self._exact.get(key)
+            if entry is not None:
+                expires_at, result = entry
+                if expires_at > time.monotonic():
+                    self._exact.move_to_end(key)
+                    self._counters["exact_hits"] += 1
+                    return result
+                del self._exact[key]
+        return None
+
+    def lookup_similar(self, query_vector, top_asin, version):
+        """
+        Semantic tier lookup. query_vector must be L2-normalized.
+        Counts a miss when nothing is found, since it is the last tier.
+        """
+        with self._lock:
+            self._sync_version(version)
+            entries = self._semantic.get(top_asin) if top_asin and self.semantic_radius > 0 else None
+            if entries:
+                now = time.monotonic()
+                entries[:] = [entry for entry in entries if entry[0] > now]
+                if entries:
+                    vectors = np.vstack([entry[1] for entry in entries])
+                    distances = 1.0 - vectors @ np.asarray(query_vector, dtype="float32").reshape(-1)
+                    best = int(np.argmin(distances))
+                    if distances[best] <= self.semantic_radius:
+                        self._semantic.move_to_end(top_asin)
+                        self._counters["semantic_hits"] += 1
+                        return entries[best][2]
+            self._counters["misses"] += 1
+        return None
+
+    def store(self, question, query_vector, top_asin, version, result):
+        expires_at = time.monotonic() + self.ttl_seconds
+        key = normalize_query(question)
+        with self._lock:
+            self._sync_version(version)
+
+            self._exact[key] = (expires_at, result)
+            self._exact.move_to_end(key)
+            while len(self._exact) > self.max_entries:
+                self._exact.popitem(last=False)
+
+            if top_asin and query_vector is not None:
+                entries = self._semantic.setdefault(top_asin, [])
+                entries.append((expires_at, np.asarray(query_vector, dtype="float32").reshape(-1), result))
+                del entries[:-self.per_chunk]
+                self._semantic.move_to_end(top_asin)
+                while len(self._semantic) > self.max_entries:
+                    self._semantic.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._exact.clear()
+            self._semantic.clear()
+            self.version = None
+            for name in self._counters:
+                self._counters[name] = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["exact_size"] = len(self._exact)
+            stats["semantic_size"] = sum(len(entries) for entries in self._semantic.values())
+        return stats
@@ -1,78 +1,323 @@
 # ======= Updated app.py (Always RAG-based, no memory) =======
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-import openai
-from openai import OpenAI
 import os
-import json
+import time
 from dotenv import load_dotenv
-from rag_helper import fetch_top_k_chunks
+from rag_helper import fetch_top_k_chunks, get_query_embedding, current_index, index_holder
+from answer_cache import AnswerCache
+from single_flight import SingleFlight
+from context_packer import CONTEXT_TOP_K
+from openai_client import shared_client, deadline, remaining_time, UpstreamUnavailable
+from admission import (
+    AdmissionController, TokenBucketLimiter, Rejected, client_id,
+    RATE_LIMITED_MESSAGE, ADMISSION_COUNTERS, RATE_LIMITER_COUNTERS, GUNICORN_THREADS
+)
+from chat_service import (
+    CHAT_MODEL, CHAT_REQUEST_BUDGET_SECONDS, BUSY_MESSAGE, ANSWER_CACHE_COUNTERS, SINGLE_FLIGHT_COUNTERS,
+    build_prompt_with_rag, build_messages, pack_retrieved, build_result, coalesce_key,
+    split_sentences, sse_event, replay_events, start_background_tasks
+)
+import warmup
+import metrics
 
-# Load API Key
+# Load API Key (read by the shared OpenAI client)
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI()
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # unset = admin endpoints disabled
 
 app = Flask(__name__)
 CORS(app, origins="*")
 
-def build_prompt_with_rag(user_question, context_memory):
-    context = context_memory or "[No product context available]"
+answer_cache = AnswerCache()
+# Identical questions asked at the same time share one embedding + LLM call
+single_flight = SingleFlight()
+metrics.stats_collector.register("answer_cache", answer_cache.stats, counters=ANSWER_CACHE_COUNTERS)
+metrics.stats_collector.register("single_flight", single_flight.stats, counters=SINGLE_FLIGHT_COUNTERS)
+# Per-client rate limits and a bounded number of chat requests in flight per worker
+rate_limiter = TokenBucketLimiter()
+# Raises at startup if the in-flight limit leaves no gunicorn thread free to queue
+admission = AdmissionController(threads=GUNICORN_THREADS)
+metrics.stats_collector.register("rate_limiter", rate_limiter.stats, counters=RATE_LIMITER_COUNTERS)
+metrics.stats_collector.register("admission", admission.stats, counters=ADMISSION_COUNTERS)
+
+
+@app.after_request
+def add_index_version(response):
+    # Every response says which index served it; /chat bodies also carry it
+    loaded = index_holder.loaded()
+    if loaded is not None:
+        response.headers["X-Index-Version"] = loaded.version
+    return response
+
+
+def retrieve_context(user_question, snapshot):
+    """
+    Returns (query_vector, top_asin, context_memory) for the question.
+    context_memory packs the top chunks into CONTEXT_TOKEN_BUDGET tokens.
+    """
+    with metrics.stage("embed"):
+        query_vector = get_query_embedding(user_question)
+    top_chunks = fetch_top_k_chunks(user_question, k=CONTEXT_TOP_K, query_vector=query_vector, snapshot=snapshot)
+    top_asin, context_memory = pack_retrieved(top_chunks)
+    return query_vector, top_asin, context_memory
+
+
+def upstream_unavailable(e):
+    print("Upstream unavailable:", e)
+    response = jsonify({"error": BUSY_MESSAGE})
+    response.status_code = 503
+    if e.retry_after:
+        response.headers["Retry-After"] = str(int(e.retry_after) + 1)
+    return response
 
-    prompt = (
-        "You are a helpful assistant. Use the product context below to answer the user's question naturally.\n\n"
-        f"=== Product Context ===\n{context}\n\n"
-        f"=== User Question ===\n{user_question}\n\n"
-        "If a relevant product is found, respond with its details\n"
-        "If nothing relevant is found in databases, say so and end with:\nSorry, I do not have any information about this product.\n"
-        "Keep the answers precise and to the point"
-    )
-    return prompt
+
+def admit():
+    """Rate limit, then wait for an admission slot. Returns the slot for admission.release()."""
+    rate_limiter.check(client_id(request.headers.get("X-Forwarded-For"), request.remote_addr))
+    with metrics.stage("admission_wait"):
+        return admission.acquire()
+
+
+def rejected(e, endpoint):
+    print("Request rejected:", e)
+    metrics.count_request(endpoint, "rate_limited" if e.status == 429 else "shed")
+    response = jsonify({"error": RATE_LIMITED_MESSAGE if e.status == 429 else BUSY_MESSAGE})
+    response.status_code = e.status
+    response.headers["Retry-After"] = e.retry_after_header()
+    return response
 
 
 @app.route("/chat", methods=["POST"])
 def chat():
+    with metrics.stage("total"):
+        try:
+            started = admit()
+        except Rejected as e:
+            return rejected(e, "chat")
+        try:
+            return answer_chat()
+        finally:
+            admission.release(started)
+
+
+def answer_question(user_question, snapshot):
+    """Retrieve, check the semantic cache, then ask the LLM. Returns the /chat result dict."""
+    version = snapshot.version
+    query_vector, top_asin, context_memory = retrieve_context(user_question, snapshot)
+
+    cached = answer_cache.lookup_similar(query_vector, top_asin, version)
+    if cached:
+        metrics.count_request("chat", "semantic_cache_hit")
+        return cached
+
+    with metrics.stage("prompt_build"):
+        prompt = build_prompt_with_rag(user_question, context_memory)
+        messages = build_messages(prompt)
+
+    with metrics.stage("llm"):
+        response = shared_client.chat_completion(
+            model=CHAT_MODEL,
+            messages=messages
+        )
+    metrics.record_llm_usage(response.usage)
+
+    result = build_result(response.choices[0].message.content, context_memory, version)
+    answer_cache.store(user_question, query_vector, top_asin, version, result)
+    metrics.count_request("chat", "answered")
+    return result
+
+
+def answer_chat():
     try:
         data = request.get_json()
         user_question = data.get("message", "")
 
         if not user_question:
+            metrics.count_request("chat", "bad_request")
             return jsonify({"error": "No message provided"}), 400
 
-        top_chunks = fetch_top_k_chunks(user_question, k=3)
-        top_chunk = top_chunks[0] if top_chunks else None
-        context_memory = top_chunk['chunk_text'] if top_chunk else ""
-
-        prompt = build_prompt_with_rag(user_question, context_memory)
-
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": prompt}
-            ]
-        )
+        with deadline(CHAT_REQUEST_BUDGET_SECONDS):
+            # Pin one index version for the whole request, even if a reload lands meanwhile
+            snapshot = current_index()
+            version = snapshot.version
+            cached = answer_cache.lookup(user_question, version)
+            if cached:
+                metrics.count_request("chat", "exact_cache_hit")
+                return jsonify(cached)
 
-        answer = response.choices[0].message.content.strip()
+            result, shared = single_flight.do(
+                coalesce_key(user_question, version),
+                lambda: answer_question(user_question, snapshot),
+                timeout=remaining_time()
+            )
 
-        # Extract product name from last line
-        product_line = next(
-            (line for line in answer.splitlines() if line.startswith("Product: ")),
-            "Product: NOT FOUND"
-        )
-        product_name = product_line.replace("Product: ", "").strip()
+        if shared:
+            metrics.count_request("chat", "coalesced")
+            # Only the exact tier: a follower has no query vector of its own
+            answer_cache.store(user_question, None, None, version, result)
+        return jsonify(result)
 
-        return jsonify({
-            "response": answer,
-            "product_name": product_name,
-            "product_context": context_memory
-        })
+    except UpstreamUnavailable as e:
+        metrics.count_request("chat", "upstream_unavailable")
+        return upstream_unavailable(e)
 
     except Exception as e:
         print("Error:", e)
+        metrics.count_request("chat", "error")
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """
+    Server-sent events version of /chat.
+    Emits `token` events as the LLM generates, `sentence` events as soon as a
+    sentence is complete (for speech synthesis), and a final `done` event with
+    the same fields /chat returns.
+    """
+    data = request.get_json(silent=True) or {}
+    user_question = data.get("message", "")
+
+    if not user_question:
+        metrics.count_request("chat_stream", "bad_request")
+        return jsonify({"error": "No message provided"}), 400
+
+    try:
+        started = admit()
+    except Rejected as e:
+        return rejected(e, "chat_stream")
+
+    def generate():
+        # Timed here rather than around the view: the view returns before streaming starts
+        with metrics.stage("total"):
+            try:
+                with deadline(CHAT_REQUEST_BUDGET_SECONDS):
+                    yield from generate_answer()
+            except UpstreamUnavailable as e:
+                print("Upstream unavailable:", e)
+                metrics.count_request("chat_stream", "upstream_unavailable")
+                yield sse_event("error", {"error": BUSY_MESSAGE})
+            except Exception as e:
+                print("Error:", e)
+                metrics.count_request("chat_stream", "error")
+                yield sse_event("error", {"error": str(e)})
+
+    def generate_answer():
+        snapshot = current_index()
+        version = snapshot.version
+        cached = answer_cache.lookup(user_question, version)
+        if cached:
+            metrics.count_request("chat_stream", "exact_cache_hit")
+            yield from replay_events(cached)
+            return
+
+        query_vector, top_asin, context_memory = retrieve_context(user_question, snapshot)
+
+        cached = answer_cache.lookup_similar(query_vector, top_asin, version)
+        if cached:
+            metrics.count_request("chat_stream", "semantic_cache_hit")
+            yield from replay_events(cached)
+            return
+
+        with metrics.stage("prompt_build"):
+            prompt = build_prompt_with_rag(user_question, context_memory)
+            messages = build_messages(prompt)
+
+        llm_started = time.perf_counter()
+        stream = shared_client.chat_completion(
+            model=CHAT_MODEL,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+
+        answer = ""
+        buffer = ""
+        for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                # Sent in a final chunk with no choices
+                metrics.record_llm_usage(chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+
+            if not answer:
+                metrics.observe_stage("llm_first_token", time.perf_counter() - llm_started)
+            answer += delta
+            yield sse_event("token", {"text": delta})
+
+            sentences, buffer = split_sentences(buffer + delta)
+            for sentence in sentences:
+                yield sse_event("sentence", {"text": sentence})
+
+        metrics.observe_stage("llm", time.perf_counter() - llm_started)
+
+        sentences, _ = split_sentences(buffer, final=True)
+        for sentence in sentences:
+            yield sse_event("sentence", {"text": sentence})
+
+        result = build_result(answer, context_memory, version)
+        answer_cache.store(user_question, query_vector, top_asin, version, result)
+        metrics.count_request("chat_stream", "answered")
+        yield sse_event("done", result)
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    # The slot is held until the stream ends, also when the client goes away first
+    response.call_on_close(lambda: admission.release(started))
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Prometheus scrape endpoint."""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """Liveness: the process is up and serving HTTP."""
+    return jsonify({"status": "ok"})
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    """Readiness: warmup finished, with index version and memory footprint."""
+    body = warmup.readiness(index_holder)
+    return jsonify(body), 200 if body["ready"] else 503
+
+
+@app.route("/admin/reload-index", methods=["POST"])
+def reload_index():
+    """
+    Stage, validate and swap in the index from INDEX_SOURCE in the background.
+    Only reloads the worker that handles the call; other workers pick the new
+    version up through INDEX_POLL_SECONDS polling.
+    """
+    if not ADMIN_TOKEN or request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+        return jsonify({"error": "Forbidden"}), 403
+    if not index_holder.source:
+        return jsonify({"error": "No index source configured (set INDEX_SOURCE)"}), 400
+
+    if request.args.get("wait") == "true":
+        try:
+            new_version = index_holder.reload()
+        except Exception as e:
+            print("Index reload failed:", e)
+            return jsonify({"error": str(e), "index_version": current_index().version}), 500
+        return jsonify({"index_version": new_version.version, "rows": new_version.index.ntotal})
+
+    index_holder.reload_in_background()
+    return jsonify({"status": "reloading", "index_version": current_index().version}), 202
+
+
 if __name__ == "__main__":
+    start_background_tasks()
     port = int(os.environ.get("PORT", 5000))  # default to 8080
     app.run(host="0.0.0.0", port=port)
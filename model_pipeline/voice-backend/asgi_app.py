@@ -0,0 +1,377 @@
+"""
+ASGI entry point for the voice backend.
+
+Serves the same /chat, /chat/stream, /healthz, /readyz, /metrics and
+/admin/reload-index contract as app.py, with the same JSON bodies and SSE
+events. OpenAI calls are awaited on the event loop (AsyncOpenAI), so one
+worker holds many conversations that are waiting on the LLM without a
+thread each. Index loading, FAISS search and metadata reads are CPU and
+disk work and run in a bounded thread pool (ASGI_SEARCH_THREADS).
+
+Run with:
+    uvicorn asgi_app:app --host 0.0.0.0 --port $PORT --workers 4
+"""
+import asyncio
+import contextlib
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from rag_helper import fetch_top_k_chunks, get_query_embedding_async, current_index, index_holder
+from answer_cache import AnswerCache
+from single_flight import AsyncSingleFlight
+from context_packer import CONTEXT_TOP_K
+from openai_client import async_client, deadline, remaining_time, UpstreamUnavailable
+from admission import (
+    AsyncAdmissionController, TokenBucketLimiter, Rejected, client_id,
+    RATE_LIMITED_MESSAGE, ADMISSION_COUNTERS, RATE_LIMITER_COUNTERS
+)
+from chat_service import (
+    CHAT_MODEL, CHAT_REQUEST_BUDGET_SECONDS, BUSY_MESSAGE, ANSWER_CACHE_COUNTERS, SINGLE_FLIGHT_COUNTERS,
+    build_prompt_with_rag, build_messages, pack_retrieved, build_result, coalesce_key,
+    split_sentences, sse_event, replay_events, start_background_tasks
+)
+import warmup
+import metrics
+
+# Load API Key (read by the shared OpenAI client)
+load_dotenv()
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # unset = admin endpoints disabled
+
+ASGI_SEARCH_THREADS = int(os.getenv("ASGI_SEARCH_THREADS", 4))
+search_pool = ThreadPoolExecutor(max_workers=ASGI_SEARCH_THREADS, thread_name_prefix="faiss")
+
+answer_cache = AnswerCache()
+single_flight = AsyncSingleFlight()
+metrics.stats_collector.register("answer_cache", answer_cache.stats, counters=ANSWER_CACHE_COUNTERS)
+metrics.stats_collector.register("single_flight", single_flight.stats, counters=SINGLE_FLIGHT_COUNTERS)
+rate_limiter = TokenBucketLimiter()
+admission = AsyncAdmissionController()
+metrics.stats_collector.register("rate_limiter", rate_limiter.stats, counters=RATE_LIMITER_COUNTERS)
+metrics.stats_collector.register("admission", admission.stats, counters=ADMISSION_COUNTERS)
+metrics.stats_collector.register(
+    "openai", async_client.stats, counters=("calls", "retries", "failures", "short_circuited", "deadline_exceeded")
+)
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run fn in the search pool so the event loop keeps serving other requests."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(search_pool, functools.partial(fn, *args, **kwargs))
+
+
+def upstream_unavailable(e):
+    print("Upstream unavailable:", e)
+    headers = {"Retry-After": str(int(e.retry_after) + 1)} if e.retry_after else None
+    return JSONResponse({"error": BUSY_MESSAGE}, status_code=503, headers=headers)
+
+
+async def admit(request):
+    """Rate limit, then wait for an admission slot. Returns the slot for admission.release()."""
+    rate_limiter.check(client_id(request.headers.get("x-forwarded-for"), request.client.host if request.client else None))
+    with metrics.stage("admission_wait"):
+        return await admission.acquire()
+
+
+def rejected(e, endpoint):
+    print("Request rejected:", e)
+    metrics.count_request(endpoint, "rate_limited" if e.status == 429 else "shed")
+    return JSONResponse(
+        {"error": RATE_LIMITED_MESSAGE if e.status == 429 else BUSY_MESSAGE},
+        status_code=e.status,
+        headers={"Retry-After": e.retry_after_header()}
+    )
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """StreamingResponse that gives its admission slot back however the stream ends."""
+
+    def __init__(self, *args, started, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.started = started
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await admission.release(self.started)
+
+
+async def read_question(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        return ""
+    return data.get("message", "") if isinstance(data, dict) else ""
+
+
+async def retrieve_context(user_question, snapshot):
+    """Returns (query_vector, top_asin, context_memory) for the question."""
+    with metrics.stage("embed"):
+        query_vector = await get_query_embedding_async(user_question)
+    top_chunks = await run_blocking(
+        fetch_top_k_chunks, user_question, k=CONTEXT_TOP_K, query_vector=query_vector, snapshot=snapshot
+    )
+    top_asin, context_memory = pack_retrieved(top_chunks)
+    return query_vector, top_asin, context_memory
+
+
+async def answer_question(user_question, snapshot):
+    """Retrieve, check the semantic cache, then ask the LLM. Returns the /chat result dict."""
+    version = snapshot.version
+    query_vector, top_asin, context_memory = await retrieve_context(user_question, snapshot)
+
+    cached = answer_cache.lookup_similar(query_vector, top_asin, version)
+    if cached:
+        metrics.count_request("chat", "semantic_cache_hit")
+        return cached
+
+    with metrics.stage("prompt_build"):
+        prompt = build_prompt_with_rag(user_question, context_memory)
+        messages = build_messages(prompt)
+
+    with metrics.stage("llm"):
+        response = await async_client.chat_completion(
+            model=CHAT_MODEL,
+            messages=messages
+        )
+    metrics.record_llm_usage(response.usage)
+
+    result = build_result(response.choices[0].message.content, context_memory, version)
+    answer_cache.store(user_question, query_vector, top_asin, version, result)
+    metrics.count_request("chat", "answered")
+    return result
+
+
+async def chat(request):
+    with metrics.stage("total"):
+        try:
+            started = await admit(request)
+        except Rejected as e:
+            return rejected(e, "chat")
+        try:
+            return await answer_chat(request)
+        finally:
+            await admission.release(started)
+
+
+async def answer_chat(request):
+    user_question = await read_question(request)
+    if not user_question:
+        metrics.count_request("chat", "bad_request")
+        return JSONResponse({"error": "No message provided"}, status_code=400)
+
+    try:
+        with deadline(CHAT_REQUEST_BUDGET_SECONDS):
+            # Pin one index version for the whole request, even if a reload lands meanwhile
+            snapshot = await run_blocking(current_index)
+            version = snapshot.version
+            cached = answer_cache.lookup(user_question, version)
+            if cached:
+                metrics.count_request("chat", "exact_cache_hit")
+                return JSONResponse(cached)
+
+            result, shared = await single_flight.do(
+                coalesce_key(user_question, version),
+                lambda: answer_question(user_question, snapshot),
+                timeout=remaining_time()
+            )
+
+        if shared:
+            metrics.count_request("chat", "coalesced")
+            answer_cache.store(user_question, None, None, version, result)
+        return JSONResponse(result)
+
+    except UpstreamUnavailable as e:
+        metrics.count_request("chat", "upstream_unavailable")
+        return upstream_unavailable(e)
+
+    except Exception as e:
+        print("Error:", e)
+        metrics.count_request("chat", "error")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def chat_stream(request):
+    """Server-sent events version of /chat, with the same events as app.py's /chat/stream."""
+    user_question = await read_question(request)
+    if not user_question:
+        metrics.count_request("chat_stream", "bad_request")
+        return JSONResponse({"error": "No message provided"}, status_code=400)
+
+    try:
+        started = await admit(request)
+    except Rejected as e:
+        return rejected(e, "chat_stream")
+
+    async def generate():
+        with metrics.stage("total"):
+            try:
+                with deadline(CHAT_REQUEST_BUDGET_SECONDS):
+                    async for event in generate_answer():
+                        yield event
+            except UpstreamUnavailable as e:
+                print("Upstream unavailable:", e)
+                metrics.count_request("chat_stream", "upstream_unavailable")
+                yield sse_event("error", {"error": BUSY_MESSAGE})
+            except Exception as e:
+                print("Error:", e)
+                metrics.count_request("chat_stream", "error")
+                yield sse_event("error", {"error": str(e)})
+
+    async def generate_answer():
+        snapshot = await run_blocking(current_index)
+        version = snapshot.version
+        cached = answer_cache.lookup(user_question, version)
+        if cached:
+            metrics.count_request("chat_stream", "exact_cache_hit")
+            for event in replay_events(cached):
+                yield event
+            return
+
+        query_vector, top_asin, context_memory = await retrieve_context(user_question, snapshot)
+
+        cached = answer_cache.lookup_similar(query_vector, top_asin, version)
+        if cached:
+            metrics.count_request("chat_stream", "semantic_cache_hit")
+            for event in replay_events(cached):
+                yield event
+            return
+
+        with metrics.stage("prompt_build"):
+            prompt = build_prompt_with_rag(user_question, context_memory)
+            messages = build_messages(prompt)
+
+        llm_started = time.perf_counter()
+        stream = await async_client.chat_completion(
+            model=CHAT_MODEL,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+
+        answer = ""
+        buffer = ""
+        async for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                # Sent in a final chunk with no choices
+                metrics.record_llm_usage(chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+
+            if not answer:
+                metrics.observe_stage("llm_first_token", time.perf_counter() - llm_started)
+            answer += delta
+            yield sse_event("token", {"text": delta})
+
+            sentences, buffer = split_sentences(buffer + delta)
+            for sentence in sentences:
+                yield sse_event("sentence", {"text": sentence})
+
+        metrics.observe_stage("llm", time.perf_counter() - llm_started)
+
+        sentences, _ = split_sentences(buffer, final=True)
+        for sentence in sentences:
+            yield sse_event("sentence", {"text": sentence})
+
+        result = build_result(answer, context_memory, version)
+        answer_cache.store(user_question, query_vector, top_asin, version, result)
+        metrics.count_request("chat_stream", "answered")
+        yield sse_event("done", result)
+
+    return AdmittedStreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        started=started
+    )
+
+
+async def prometheus_metrics(request):
+    """Prometheus scrape endpoint."""
+    body, content_type = metrics.render()
+    return Response(body, headers={"Content-Type": content_type})
+
+
+async def healthz(request):
+    """Liveness: the process is up and serving HTTP."""
+    return JSONResponse({"status": "ok"})
+
+
+async def readyz(request):
+    """Readiness: warmup finished, with index version and memory footprint."""
+    body = warmup.readiness(index_holder)
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+
+async def reload_index(request):
+    """
+    Stage, validate and swap in the index from INDEX_SOURCE in the background.
+    Only reloads the worker that handles the call, like app.py.
+    """
+    if not ADMIN_TOKEN or request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+    if not index_holder.source:
+        return JSONResponse({"error": "No index source configured (set INDEX_SOURCE)"}, status_code=400)
+
+    index_holder.reload_in_background()
+    loaded = index_holder.loaded()
+    return JSONResponse({"status": "reloading", "index_version": loaded.version if loaded else None}, status_code=202)
+
+
+class IndexVersionHeader:
+    """Adds X-Index-Version to every response, like app.py's after_request hook."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_version(message):
+            if message["type"] == "http.response.start":
+                loaded = index_holder.loaded()
+                if loaded is not None:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-index-version", loaded.version.encode("latin-1")))
+                    message["headers"] = headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_version)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    start_background_tasks()
+    yield
+    search_pool.shutdown(wait=False)
+
+
+app = Starlette(
+    routes=[
+        Route("/chat", chat, methods=["POST"]),
+        Route("/chat/stream", chat_stream, methods=["POST"]),
+        Route("/metrics", prometheus_metrics, methods=["GET"]),
+        Route("/healthz", healthz, methods=["GET"]),
+        Route("/readyz", readyz, methods=["GET"]),
+        Route("/admin/reload-index", reload_index, methods=["POST"])
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+        Middleware(IndexVersionHeader)
+    ],
+    lifespan=lifespan
+)
@@ -0,0 +1,349 @@
+"""
+Structured product attributes and filtered search.
+
+The builder stores price, rating and categories of every row as typed
+columns plus precomputed bitmaps (one bit per FAISS row, little-endian bit
+order as faiss.IDSelectorBitmap reads them):
+
+- price, rating            float32[N], NaN when unknown
+- price_bucket_bits        uint8[len(PRICE_EDGES) - 1, ceil(N / 8)]
+- rating_bucket_bits       uint8[len(RATING_EDGES) - 1, ceil(N / 8)]
+- category_bits            uint8[C, ceil(N / 8)], names in the header
+
+parse_constraints() turns "cheap photo editor under $20" or "top-rated
+antivirus" into Constraints, and AttributeIndex.select() combines whole
+bucket bitmaps (refining only the bucket a bound falls into against the
+column) into a Selection that restricts the FAISS search to matching rows.
+"""
+from array import array
+import math
+import os
+import re
+
+import faiss
+import numpy as np
+
+from flat_arrays import write_arrays, read_arrays
+from lexical_index import tokenize
+
+ATTRIBUTES_FILE = "attributes.bin"
+MAGIC = b"ATTRIDX1"
+
+ATTRIBUTE_FILTERS = os.getenv("ATTRIBUTE_FILTERS", "true").lower() == "true"
+# "cheap", "budget" and "affordable" mean at most this price
+CHEAP_PRICE = float(os.getenv("CHEAP_PRICE", 20))
+TOP_RATED_MIN_RATING = float(os.getenv("TOP_RATED_MIN_RATING", 4.5))
+HIGHLY_RATED_MIN_RATING = float(os.getenv("HIGHLY_RATED_MIN_RATING", 4.0))
+# Categories on more than this share of the catalog ("Software") do not filter anything useful
+MAX_CATEGORY_SHARE = float(os.getenv("MAX_CATEGORY_SHARE", 0.5))
+
+# Bucket i holds values in [edges[i], edges[i + 1])
+PRICE_EDGES = (0.0, 10.0, 20.0, 50.0, 100.0, 200.0, math.inf)
+RATING_EDGES = (0.0, 3.0, 4.0, 4.5, math.inf)
+
+NUMBER = r"(\d+(?:\.\d{1,2})?)"
+PRICE = r"(\$\s*)?" + NUMBER + r"(\s*(?:dollars|usd|bucks)\b)?"
+CURRENCY_FREE_FOLLOWERS = {"", "and", "or", "but", "with", "for", "that", "which", "please", "in", "on"}
+
+BETWEEN_PRICE = re.compile(r"\bbetween\s+" + PRICE + r"\s*(?:and|to|-)\s*" + PRICE)
+MAX_PRICE = re.compile(r"(?:\b(?:under|below|less than|cheaper than|at most|up to|no more than|max(?:imum)?)|<)\s*" + PRICE)
+MIN_PRICE = re.compile(r"(?:\b(?:over|above|more than|at least|min(?:imum)?)|>)\s*" + PRICE)
+CHEAP_WORDS = re.compile(r"\b(?:cheap|cheapest|budget|affordable|inexpensive|low[- ]cost)\b")
+
+MIN_RATING = re.compile(
+    r"(?:\b(?:at least|rated|rating(?: of)?|over|above|minimum(?: of)?)\s+)?"
+    r"(\d(?:\.\d)?)\s*(?:\+\s*)?(?:stars?|star rating)(?:\s+(?:and up|or (?:more|higher|better|above)))?"
+)
+RATED_AT_LEAST = re.compile(
+    r"\brat(?:ed|ing)\s+(?:of\s+)?(?:at least\s+|above\s+|over\s+)?(\d(?:\.\d)?)\b"
+    r"(?:\s*(?:\+|and up|or (?:more|higher|better|above)))?"
+)
+TOP_RATED = re.compile(r"\b(?:top|best|highest)[- ]rated\b")
+HIGHLY_RATED = re.compile(r"\b(?:highly|well)[- ]rated\b")
+
+GENERIC_CATEGORY_WORDS = {"software", "digital", "other", "products", "general", "accessories"}
+
+
+def parse_price(value):
+    """First number in a price field ("$19.99", "from 9.99", 19.99), or None."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    match = re.search(r"\d+(?:\.\d+)?", str(value or "").replace(",", ""))
+    return float(match.group()) if match else None
+
+
+def extract_attributes(entry):
+    """Typed price, rating and categories of a catalog entry."""
+    rating = entry.get("average_rating")
+    try:
+        rating = float(rating) if rating not in (None, "") else None
+    except (TypeError, ValueError):
+        rating = None
+
+    categories = entry.get("categories") or []
+    if isinstance(categories, str):
+        categories = [categories]
+    if entry.get("main_category"):
+        categories = [entry["main_category"]] + list(categories)
+
+    return {
+        "price": parse_price(entry.get("price")),
+        "rating": rating,
+        "categories": list(dict.fromkeys(c.strip() for c in categories if isinstance(c, str) and c.strip()))
+    }
+
+
+def _bits(mask):
+    return np.packbits(mask, bitorder="little")
+
+
+def _bucket_bits(column, edges):
+    return np.vstack([_bits((column >= low) & (column < high)) for low, high in zip(edges, edges[1:])])
+
+
+class AttributeIndexWriter:
+    """
+    Builds the attribute index from rows added in blocks (row ids continue
+    from one add() to the next). Only the typed columns and the row ids of
+    each category are kept until close() writes the bitmaps.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.n_rows = 0
+        self._price = []
+        self._rating = []
+        self._rows_by_category = {}
+
+    def add(self, attributes):
+        self._price.append(np.array(
+            [a["price"] if a.get("price") is not None else np.nan for a in attributes], dtype="float32"
+        ))
+        self._rating.append(np.array(
+            [a["rating"] if a.get("rating") is not None else np.nan for a in attributes], dtype="float32"
+        ))
+        for row_id, a in enumerate(attributes, self.n_rows):
+            for category in a.get("categories", []):
+                self._rows_by_category.setdefault(category, array("I")).append(row_id)
+        self.n_rows += len(attributes)
+
+    def close(self):
+        """Write the index. Returns the number of categories."""
+        n = self.n_rows
+        price = np.concatenate(self._price) if self._price else np.zeros(0, dtype="float32")
+        rating = np.concatenate(self._rating) if self._rating else np.zeros(0, dtype="float32")
+        rows_by_category = self._rows_by_category
+        categories = sorted(rows_by_category)
+        category_bits = np.zeros((len(categories), (n + 7) // 8), dtype="uint8")
+        for i, category in enumerate(categories):
+            mask = np.zeros(n, dtype=bool)
+            mask[np.frombuffer(rows_by_category[category], dtype="uint32")] = True
+            category_bits[i] = _bits(mask)
+
+        arrays = {
+            "price": price,
+            "rating": rating,
+            "price_bucket_bits": _bucket_bits(price, PRICE_EDGES),
+            "rating_bucket_bits": _bucket_bits(rating, RATING_EDGES),
+            "category_bits": category_bits
+        }
+        write_arrays(self.path, MAGIC, arrays, {
+            "n_rows": n,
+            "categories": categories,
+            "category_sizes": [len(rows_by_category[c]) for c in categories],
+            "price_edges": [str(e) for e in PRICE_EDGES],
+            "rating_edges": [str(e) for e in RATING_EDGES]
+        })
+        return len(categories)
+
+    def abort(self):
+        """Drop the rows added so far, and a file close() left half-written."""
+        self._price, self._rating, self._rows_by_category = [], [], {}
+        if os.path.exists(f"{self.path}.tmp"):
+            os.remove(f"{self.path}.tmp")
+
+
+def build_attribute_index(path, attributes):
+    """Write the attribute columns and bitmaps for attributes (list position = FAISS row id)."""
+    writer = AttributeIndexWriter(path)
+    writer.add(attributes)
+    return writer.close()
+
+
+class Constraints:
+    """Attribute constraints parsed from a question. Bounds are inclusive."""
+
+    def __init__(self, min_price=None, max_price=None, min_rating=None, categories=(), remainder=""):
+        self.min_price = min_price
+        self.max_price = max_price
+        self.min_rating = min_rating
+        self.categories = tuple(categories)
+        # The question without the constraint phrases, for the lexical path
+        self.remainder = remainder
+
+    def __bool__(self):
+        return any(v is not None for v in (self.min_price, self.max_price, self.min_rating)) or bool(self.categories)
+
+    def __repr__(self):
+        parts = [f"{k}={v!r}" for k, v in vars(self).items() if k != "remainder" and v not in (None, ())]
+        return f"Constraints({', '.join(parts)})"
+
+
+def _price_value(match, first_group, text):
+    """The price in a PRICE match, or None when a bare number names something else ("under 5 devices")."""
+    dollar, number, currency = match.group(first_group, first_group + 1, first_group + 2)
+    if not dollar and not currency:
+        follower = re.match(r"\s*([a-z%]*)", text[match.end():]).group(1)
+        if follower not in CURRENCY_FREE_FOLLOWERS:
+            return None
+    return float(number)
+
+
+def parse_constraints(query, categories=()):
+    """
+    Rule-based constraints in the question. categories are the category names
+    that may be matched, by their full name or by one of their distinctive
+    words ("antivirus" for "Antivirus & Security", "photo" for "Photography").
+    """
+    text = query.lower()
+    found = {}
+    spans = []
+
+    # Ratings first: "at least 4 stars" is not a price
+    for pattern, value in ((TOP_RATED, TOP_RATED_MIN_RATING), (HIGHLY_RATED, HIGHLY_RATED_MIN_RATING)):
+        match = pattern.search(text)
+        if match and "min_rating" not in found:
+            found["min_rating"] = value
+            spans.append(match.span())
+    for pattern in (MIN_RATING, RATED_AT_LEAST):
+        match = pattern.search(text)
+        if match and "min_rating" not in found:
+            found["min_rating"] = float(match.group(1))
+            spans.append(match.span())
+
+    masked = text
+    for start, end in spans:
+        masked = masked[:start] + " " * (end - start) + masked[end:]
+
+    match = BETWEEN_PRICE.search(masked)
+    if match:
+        low, high = _price_value(match, 1, masked), _price_value(match, 4, masked)
+        if low is not None and high is not None:
+            found["min_price"], found["max_price"] = min(low, high), max(low, high)
+            spans.append(match.span())
+    for key, pattern in (("max_price", MAX_PRICE), ("min_price", MIN_PRICE)):
+        if key in found:
+            continue
+        for match in pattern.finditer(masked):
+            value = _price_value(match, 1, masked)
+            if value is not None:
+                found[key] = value
+                spans.append(match.span())
+                break
+    match = CHEAP_WORDS.search(masked)
+    if match:
+        found.setdefault("max_price", CHEAP_PRICE)
+        spans.append(match.span())
+
+    query_tokens = tokenize(text)
+    joined = f" {' '.join(query_tokens)} "
+    matched = []
+    for name in categories:
+        tokens = tokenize(name.replace("&", " "))
+        if not tokens:
+            continue
+        distinctive = [t for t in tokens if t not in GENERIC_CATEGORY_WORDS and len(t) >= 4]
+        if f" {' '.join(tokens)} " in joined or any(
+            t == q or (len(q) >= 5 and t.startswith(q)) for t in distinctive for q in query_tokens
+        ):
+            matched.append(name)
+
+    remainder = text
+    for start, end in sorted(spans, reverse=True):
+        remainder = remainder[:start] + " " + remainder[end:]
+    return Constraints(categories=matched, remainder=" ".join(remainder.split()), **found)
+
+
+class Selection:
+    """Rows matching some Constraints, as a bitmap FAISS can search within."""
+
+    def __init__(self, bits, n_rows):
+        self.bits = np.ascontiguousarray(bits, dtype="uint8")
+        self.n_rows = n_rows
+        self.count = int(np.unpackbits(self.bits, bitorder="little", count=n_rows).sum())
+        # The selector reads self.bits through a raw pointer: keep both on this object.
+        # Its size is in bytes; ids past the bitmap are never members
+        self.selector = faiss.IDSelectorBitmap(len(self.bits), faiss.swig_ptr(self.bits))
+        self.params = faiss.SearchParameters(sel=self.selector)
+
+    def contains(self, ids):
+        """Boolean mask: which of the row ids are selected."""
+        ids = np.asarray(ids, dtype="int64")
+        return ((self.bits[ids >> 3] >> (ids & 7)) & 1).astype(bool)
+
+
+class AttributeIndex:
+    """Read-only attribute columns and bitmaps over a memory-mapped file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.params, arrays = read_arrays(path, MAGIC)
+        self.n_rows = self.params["n_rows"]
+        self.price = arrays["price"]
+        self.rating = arrays["rating"]
+        self.price_bucket_bits = arrays["price_bucket_bits"]
+        self.rating_bucket_bits = arrays["rating_bucket_bits"]
+        self.category_bits = arrays["category_bits"]
+        self.category_rows = {name: i for i, name in enumerate(self.params["categories"])}
+        self.filterable_categories = [
+            name for name, size in zip(self.params["categories"], self.params["category_sizes"])
+            if size <= MAX_CATEGORY_SHARE * self.n_rows
+        ]
+
+    def __len__(self):
+        return self.n_rows
+
+    def parse(self, query):
+        return parse_constraints(query, self.filterable_categories)
+
+    def _range_bits(self, column, bucket_bits, edges, low, high):
+        low = -math.inf if low is None else low
+        high = math.inf if high is None else high
+        bits = np.zeros(bucket_bits.shape[1], dtype="uint8")
+        for i, (start, end) in enumerate(zip(edges, edges[1:])):
+            if end <= low or start > high:
+                continue
+            if start >= low and end <= high:
+                bits |= bucket_bits[i]
+            else:
+                # A bound falls inside this bucket: check its rows against the column
+                in_bucket = np.unpackbits(bucket_bits[i], bitorder="little", count=self.n_rows).astype(bool)
+                bits |= _bits(in_bucket & (column >= low) & (column <= high))
+        return bits
+
+    def select(self, constraints):
+        """The Selection for constraints, or None when they do not constrain anything."""
+        if not constraints:
+            return None
+        bits = np.full((self.n_rows + 7) // 8, 0xFF, dtype="uint8")
+        if constraints.min_price is not None or constraints.max_price is not None:
+            bits &= self._range_bits(self.price, self.price_bucket_bits, PRICE_EDGES,
+                                     constraints.min_price, constraints.max_price)
+        if constraints.min_rating is not None:
+            bits &= self._range_bits(self.rating, self.rating_bucket_bits, RATING_EDGES, constraints.min_rating, None)
+        if constraints.categories:
+            any_category = np.zeros_like(bits)
+            for name in constraints.categories:
+                any_category |= self.category_bits[self.category_rows[name]]
+            bits &= any_category
+        # Clear the padding bits past the last row
+        if self.n_rows % 8:
+            bits[-1] &= (1 << (self.n_rows % 8)) - 1
+        return Selection(bits, self.n_rows)
+
+
+def open_attribute_index(path):
+    """The AttributeIndex at path, or None if this index version has none."""
+    if not os.path.exists(path):
+        return None
+    return AttributeIndex(path)
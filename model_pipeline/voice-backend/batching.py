@@ -0,0 +1,98 @@
+"""
+Micro-batching for concurrent requests within one worker.
+
+The first caller to arrive opens a batch and becomes its leader. Callers that
+arrive within the batch window join it. The leader then runs a single batched
+call and hands every caller its own result. No background thread is needed,
+so it is safe to create before gunicorn forks.
+"""
+import os
+import threading
+from collections import Counter
+
+RAG_BATCH_WINDOW_MS = float(os.getenv("RAG_BATCH_WINDOW_MS", 0))  # 0 disables batching
+RAG_BATCH_MAX_SIZE = int(os.getenv("RAG_BATCH_MAX_SIZE", 32))
+
+
+class _Batch:
+    def __init__(self):
+        self.items = []
+        self.results = None
+        self.error = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    def __init__(self, batch_fn, window_ms=RAG_BATCH_WINDOW_MS, max_batch_size=RAG_BATCH_MAX_SIZE, name="batch"):
+        """
+        batch_fn takes a list of items and returns a list of results in the same order.
+        """
+        self.batch_fn = batch_fn
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.name = name
+
+        self._open = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+
+    def submit(self, item):
+        """Run item through batch_fn, batched with any concurrent callers."""
+        if self.window <= 0 or self.max_batch_size <= 1:
+            self._record(1)
+            return self.batch_fn([item])[0]
+
+        with self._lock:
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = _Batch()
+            position = len(batch.items)
+            batch.items.append(item)
+            if len(batch.items) >= self.max_batch_size:
+                self._open = None
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._open is batch:
+                    self._open = None
+            self._run(batch)
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[position]
+
+    def _run(self, batch):
+        try:
+            self._record(len(batch.items))
+            results = self.batch_fn(batch.items)
+            if len(results) != len(batch.items):
+                raise RuntimeError(f"{self.name}: batch_fn returned {len(results)} results for {len(batch.items)} items")
+            batch.results = results
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.done.set()
+
+    def _record(self, size):
+        with self._stats_lock:
+            self._batch_sizes[size] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            sizes = dict(self._batch_sizes)
+        batches = sum(sizes.values())
+        items = sum(size * count for size, count in sizes.items())
+        return {
+            "batches": batches,
+            "items": items,
+            "mean_batch_size": items / batches if batches else 0.0,
+            "max_batch_size": max(sizes) if sizes else 0,
+            "batch_sizes": sizes
+        }
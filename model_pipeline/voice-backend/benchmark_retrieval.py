@@ -0,0 +1,274 @@
+"""
+Retrieval microbenchmarks for the FAISS search behind fetch_top_k_chunks.
+
+Builds synthetic indexes (clustered unit vectors at the embedding dimension,
+so ANN indexes behave as on real embeddings rather than on uniform noise) and,
+for every size, index type and search setting, measures:
+
+- single-query latency: one search_batch() call per query, as a request
+  that is not micro-batched
+- batched latency and throughput: search_batch() over --batch-size queries,
+  as the MicroBatcher sends them
+- recall@k against exact search (IndexFlatL2)
+- memory: the serialized index size, which is what a worker maps or loads
+- build (train + add) time
+
+Index types: flat, ivf (IVF-Flat), hnsw (HNSW-Flat), ivfpq (IVF-PQ) and
+ivfpq_refine (IVF-PQ whose shortlist is re-scored against the full vectors).
+Results are written as JSON; --baseline prints the change against an
+earlier run's file.
+
+    python benchmark_retrieval.py --sizes 1000,100000,1000000 --output retrieval_benchmark.json
+    python benchmark_retrieval.py --sizes 100000 --types ivf,hnsw --baseline retrieval_benchmark.json
+
+A 1M x 1536 index is about 6 GB of vectors per index type, plus the data
+itself, so run the largest size on a machine with enough memory.
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from index_holder import IndexVersion
+from index_tuning import HNSW_EF_CONSTRUCTION, latency_ms, recall_at_k
+from lexical_index import HYBRID_VECTOR_CANDIDATES
+from rag_helper import search_batch
+
+# text-embedding-3-small, the default EMBEDDER
+DEFAULT_DIM = 1536
+DEFAULT_SIZES = [1000, 100000, 1000000]
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq", "ivfpq_refine")
+HNSW_M = 32
+# ivfpq_refine re-scores REFINE_K_FACTOR * k PQ candidates exactly
+REFINE_K_FACTOR = 4
+# Search settings swept for each type (clipped to what the index supports)
+NPROBES = [1, 4, 16, 64]
+EF_SEARCHES = [16, 32, 64, 128]
+POINTS_PER_CLUSTER = 100
+MAX_TRAIN_SIZE = 100000
+GENERATE_CHUNK = 100000
+
+
+def synthetic_vectors(n, dim, centers, rng, spread):
+    """n unit vectors scattered around random cluster centers."""
+    out = np.empty((n, dim), dtype="float32")
+    for start in range(0, n, GENERATE_CHUNK):
+        stop = min(n, start + GENERATE_CHUNK)
+        chunk = centers[rng.integers(0, len(centers), stop - start)]
+        chunk = chunk + spread * rng.standard_normal((stop - start, dim), dtype="float32")
+        out[start:stop] = chunk / np.linalg.norm(chunk, axis=1, keepdims=True)
+    return out
+
+
+def ivf_lists(n):
+    """About 4 * sqrt(n) lists, with at least 39 training points each."""
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+
+def pq_layout(n, dim):
+    """(sub-quantizers, bits): 16-dim sub-vectors, fewer bits when n is too small to train 256 centroids."""
+    m = max(1, dim // 16)
+    while dim % m:
+        m -= 1
+    nbits = max(1, min(8, int(math.log2(max(2, n // 39)))))
+    return m, nbits
+
+
+def factory_string(index_type, n, dim):
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "ivf":
+        return f"IVF{ivf_lists(n)},Flat"
+    if index_type == "hnsw":
+        return f"HNSW{HNSW_M}"
+    if index_type in ("ivfpq", "ivfpq_refine"):
+        m, nbits = pq_layout(n, dim)
+        return f"IVF{ivf_lists(n)},PQ{m}x{nbits}" + (",RFlat" if index_type == "ivfpq_refine" else "")
+    raise ValueError(f"Unknown index type {index_type!r} (use {', '.join(INDEX_TYPES)})")
+
+
+def search_settings(index_type, index):
+    """[(name, value)] search parameters to sweep; [(None, None)] for exact search."""
+    if index_type in ("ivf", "ivfpq", "ivfpq_refine"):
+        nlist = faiss.extract_index_ivf(index).nlist
+        return [("nprobe", p) for p in NPROBES if p <= nlist] or [("nprobe", nlist)]
+    if index_type == "hnsw":
+        return [("efSearch", ef) for ef in EF_SEARCHES]
+    return [(None, None)]
+
+
+def build_index(index_type, vectors, rng, train_size=MAX_TRAIN_SIZE):
+    n, dim = vectors.shape
+    index = faiss.index_factory(dim, factory_string(index_type, n, dim), faiss.METRIC_L2)
+    if index_type == "hnsw":
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    elif index_type == "ivfpq_refine":
+        faiss.downcast_index(index).k_factor = REFINE_K_FACTOR
+    started = time.perf_counter()
+    if not index.is_trained:
+        sample = vectors if n <= train_size else vectors[np.sort(rng.choice(n, train_size, replace=False))]
+        index.train(sample)
+    index.add(vectors)
+    return index, time.perf_counter() - started
+
+
+def index_size_mb(index, work_dir):
+    """Serialized size: what a worker loads (or maps, for flat indexes)."""
+    fd, path = tempfile.mkstemp(suffix=".index", dir=work_dir)
+    os.close(fd)
+    try:
+        faiss.write_index(index, path)
+        return os.path.getsize(path) / (1024 * 1024)
+    finally:
+        os.remove(path)
+
+
+def time_single(snapshot, queries, k):
+    """Per-query latencies and the top-k rows of one search per query."""
+    seconds, rows = [], []
+    for q in queries:
+        started = time.perf_counter()
+        (_, I), = search_batch([(snapshot, q[None, :], k)])
+        seconds.append(time.perf_counter() - started)
+        rows.append(I[0])
+    return np.array(seconds), np.vstack(rows)
+
+
+def time_batched(snapshot, queries, k, batch_size):
+    seconds = []
+    for start in range(0, len(queries), batch_size):
+        batch = [(snapshot, q[None, :], k) for q in queries[start:start + batch_size]]
+        started = time.perf_counter()
+        search_batch(batch)
+        seconds.append(time.perf_counter() - started)
+    return np.array(seconds)
+
+
+def benchmark_size(n, args, rng):
+    print(f"Generating {n} x {args.dim} vectors ({n * args.dim * 4 / 1024 ** 2:.0f} MB)")
+    centers = rng.standard_normal((max(1, n // POINTS_PER_CLUSTER), args.dim), dtype="float32")
+    vectors = synthetic_vectors(n, args.dim, centers, rng, args.spread)
+    queries = synthetic_vectors(args.queries, args.dim, centers, rng, args.spread)
+    k = min(args.k, n)
+
+    results = []
+    exact = None
+    # Exact search first: it is the ground truth for the others' recall
+    for index_type in sorted(args.types, key=lambda t: t != "flat"):
+        index, build_seconds = build_index(index_type, vectors, rng)
+        if exact is None:
+            exact = index.search(queries, k)[1] if index_type == "flat" else faiss.knn(queries, vectors, k)[1]
+        size_mb = index_size_mb(index, args.work_dir)
+        snapshot = IndexVersion(index, [], f"bench-{index_type}-{n}", args.work_dir)
+        for param, value in search_settings(index_type, index):
+            if param is not None:
+                faiss.ParameterSpace().set_index_parameter(index, param, value)
+            single, found = time_single(snapshot, queries[:args.single_queries], k)
+            result = {
+                "size": n,
+                "index": index_type,
+                "factory": factory_string(index_type, n, args.dim),
+                "params": {param: value} if param else {},
+                "build_seconds": round(build_seconds, 3),
+                "index_mb": round(size_mb, 2),
+                "bytes_per_vector": round(size_mb * 1024 * 1024 / n, 1),
+                "recall_at_k": round(recall_at_k(found, exact[:len(found)]), 4),
+                "single": {"latency_ms": latency_ms(single), "qps": round(len(single) / single.sum(), 1)},
+                "batched": {}
+            }
+            for batch_size in args.batch_size:
+                batched = time_batched(snapshot, queries, k, batch_size)
+                result["batched"][str(batch_size)] = {
+                    "latency_ms": latency_ms(batched),
+                    "qps": round(len(queries) / batched.sum(), 1)
+                }
+            results.append(result)
+            print(
+                f"{n:>8} {index_type:<12} {str(result['params'] or ''):<18} recall@{k}={result['recall_at_k']:.3f}  "
+                f"single p50={result['single']['latency_ms']['p50']:.3f}ms  "
+                + "  ".join(f"b{b}={r['qps']:.0f}qps" for b, r in result["batched"].items())
+                + f"  {size_mb:.1f}MB  build={build_seconds:.1f}s"
+            )
+        del index, snapshot
+    return results
+
+
+def compare(results, baseline_path):
+    """Print latency and recall changes against the matching rows of an earlier run."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    def key(r):
+        return r["size"], r["index"], json.dumps(r["params"], sort_keys=True)
+
+    before = {key(r): r for r in baseline.get("results", [])}
+    print(f"\nCompared with {baseline_path} ({baseline.get('created_at')}):")
+    for result in results:
+        old = before.get(key(result))
+        if old is None:
+            continue
+        ratio = result["single"]["latency_ms"]["p50"] / max(old["single"]["latency_ms"]["p50"], 1e-9)
+        print(
+            f"{result['size']:>8} {result['index']:<12} {str(result['params'] or ''):<18} "
+            f"single p50 x{ratio:.2f}  recall {result['recall_at_k'] - old['recall_at_k']:+.4f}  "
+            f"size {result['index_mb'] - old['index_mb']:+.1f}MB"
+        )
+
+
+def run(args):
+    if args.threads:
+        faiss.omp_set_num_threads(args.threads)
+    rng = np.random.default_rng(args.seed)
+    report = {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "faiss_version": faiss.__version__,
+        "machine": {"platform": platform.platform(), "cpus": os.cpu_count(), "omp_threads": faiss.omp_get_max_threads()},
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "work_dir")},
+        "results": []
+    }
+    for n in args.sizes:
+        report["results"].extend(benchmark_size(n, args, rng))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to {args.output}")
+    if args.baseline:
+        compare(report["results"], args.baseline)
+    return report
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FAISS index types for retrieval")
+    parser.add_argument("--sizes", type=int_list, default=DEFAULT_SIZES)
+    parser.add_argument("--types", type=lambda v: [t for t in v.split(",") if t], default=list(INDEX_TYPES))
+    parser.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    parser.add_argument("--k", type=int, default=HYBRID_VECTOR_CANDIDATES, help="neighbours per query")
+    parser.add_argument("--queries", type=int, default=1000, help="queries per setting (batched runs use all)")
+    parser.add_argument("--single-queries", type=int, default=200, help="queries timed one at a time")
+    parser.add_argument("--batch-size", type=int_list, default=[8, 32])
+    parser.add_argument("--threads", type=int, default=None, help="FAISS OpenMP threads (default: FAISS's)")
+    parser.add_argument("--spread", type=float, default=0.5, help="noise around cluster centers, per dimension")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", default=tempfile.gettempdir(), help="where index sizes are measured")
+    parser.add_argument("--output", default=f"retrieval_benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    parser.add_argument("--baseline", help="earlier results file to compare with")
+    args = parser.parse_args()
+    for index_type in args.types:
+        factory_string(index_type, 1, args.dim)  # fail on unknown types before any work
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,18 +5,18 @@ import os
 import json
 import faiss
 import numpy as np
-import openai
 from dotenv import load_dotenv
+from embedders import get_embedder
+from index_holder import check_embedder, read_manifest
 from tqdm import tqdm
 from collections import defaultdict
 import pandas as pd
 
-# Load env and API key
+# Load env and API key (read by the shared OpenAI client)
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
 
 # Constants
-EMBED_MODEL = "text-embedding-3-small"
+embedder = get_embedder()
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 INDEX_PATH = os.path.join(BASE_DIR, "faiss_index.index")
 METADATA_PATH = os.path.join(BASE_DIR, "index_metadata.json")
@@ -29,15 +29,12 @@ MAX_RATING_BIAS = 0.2  # Maximum allowable bias in rating distribution
 
 def get_query_embedding(text):
     """Get embedding for a query text"""
-    response = openai.embeddings.create(
-        input=[text],
-        model=EMBED_MODEL
-    )
-    return np.array(response.data[0].embedding, dtype="float32")
+    return embedder.embed([text])[0]
 
 def detect_bias():
     """Detect potential biases in the RAG model"""
     # Load FAISS index and metadata
+    check_embedder(read_manifest(BASE_DIR), embedder.name)
     faiss_index = faiss.read_index(INDEX_PATH)
     
     with open(METADATA_PATH, "r", encoding="utf-8") as f:
@@ -1,13 +1,27 @@
 # ======= Updated build-faiss-index.py (FAISS builder with product logging) =======
-import json
+import argparse
+import datetime
 import os
+import shutil
+import tempfile
 import faiss
 import numpy as np
-from tqdm import tqdm
 from dotenv import load_dotenv
-import openai
-from sklearn.preprocessing import normalize
+from embedders import get_embedder
+from bulk_embedding import build_embedder, combine_stats, embed_corpus, rate_limiter_for, BUILD_EMBED_CONCURRENCY
+from build_embedding_cache import BuildEmbeddingCache, BUILD_EMBED_CACHE_DIR
+from catalog_stream import ReviewStore, blocks, iter_catalog, iter_jsonl, BUILD_CATALOG_LIMIT, BUILD_STREAM_BLOCK_ROWS
 from google.cloud import storage
+from metadata_store import MetadataJsonWriter, MetadataStoreWriter
+from index_holder import (
+    INDEX_FILE, METADATA_FILE, METADATA_STORE_FILE, IndexHolder, load_index_version, publish_artifacts, write_manifest
+)
+from incremental_index import (
+    apply_diff, compact, diff_catalog, id_mapped_index, is_tombstone, needs_compaction, flat_vectors, tombstone_count
+)
+from index_tuning import FLAT, build_ann_index, select_ann_index
+from lexical_index import LEXICAL_FILE, LexicalIndexWriter
+from attribute_index import ATTRIBUTES_FILE, AttributeIndexWriter
 
 def download_from_gcs(bucket_name, source_blob_name, destination_file_name):
     client = storage.Client()
@@ -16,20 +30,23 @@ def download_from_gcs(bucket_name, source_blob_name, destination_file_name):
     blob.download_to_filename(destination_file_name)
     print(f"Downloaded {source_blob_name} to {destination_file_name}")
 
-# Load OpenAI API key
+# Load OpenAI API key (read by the shared OpenAI client)
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
 
 # Constants
-EMBED_MODEL = "text-embedding-3-small"
+# EMBEDDER picks the backend (openai:<model> or local:<model>); the manifest records it
+embedder = get_embedder()
 #META_PATH = "data/meta_software.json"
 #REVIEWS_PATH = "data/software.json"
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-OUTPUT_INDEX = os.path.join(BASE_DIR, "faiss_index.index")
-OUTPUT_METADATA = os.path.join(BASE_DIR, "index_metadata.json")
+# Artifacts are written to a build directory next to BASE_DIR, then published into it together
+BUILD_DIR_PREFIX = ".build-"
+# Temporary: the reviews looked up while the catalog is streamed
+OUTPUT_REVIEW_STORE = os.path.join(BASE_DIR, "tmp_reviews.db")
 
 
-def load_data():
+def download_data():
+    """Local paths of the metadata and reviews JSONL files, downloaded from GCS."""
     bucket_name = "speaking-chatbot-data"
     meta_blob = "software_metadata_preprocessed.jsonl"
     reviews_blob = "software_reviews_preprocessed.jsonl"
@@ -41,134 +58,253 @@ def load_data():
     download_from_gcs(bucket_name, meta_blob, local_meta)
     download_from_gcs(bucket_name, reviews_blob, local_reviews)
 
-    # Read .jsonl files
-    def read_jsonl(filepath):
-        with open(filepath, "r", encoding="utf-8") as f:
-            return [json.loads(line.strip()) for line in f if line.strip()]
+    return local_meta, local_reviews
+
+
+def token_counts_of(entries):
+    # The section counts computed for the context packer size the embedding batches
+    return [sum(entry["token_counts"].values()) for entry in entries]
+
+
+class BuildEmbedding:
+    """One embedding client, rate limiter and on-disk cache shared by every block of a build."""
+
+    def __init__(self):
+        # Token-sized batches, several in flight, paced by an adaptive rate limiter.
+        # Chunks whose text an earlier build embedded come from the on-disk cache.
+        # Rows come back L2-normalized, and their width is the index dimension.
+        self.embedder = build_embedder(embedder, BUILD_EMBED_CONCURRENCY)
+        self.limiter = rate_limiter_for(self.embedder)
+        self.cache = BuildEmbeddingCache(BUILD_EMBED_CACHE_DIR) if BUILD_EMBED_CACHE_DIR else None
+        self.runs = []
+
+    def embed(self, entries, show_progress=True):
+        """Embeddings of the entries' chunk texts, in order."""
+        vectors, stats = embed_corpus(
+            self.embedder, [entry["chunk_text"] for entry in entries], token_counts_of(entries),
+            limiter=self.limiter, cache=self.cache, show_progress=show_progress
+        )
+        self.runs.append(stats)
+        return vectors
+
+    def close(self, prune_cache=False):
+        """
+        Close the cache and return the throughput stats of all blocks. With
+        prune_cache, cached vectors of chunks this build did not look up are
+        dropped: pass it only once every chunk of the catalog was embedded.
+        """
+        if self.cache is not None:
+            if prune_cache:
+                self.cache.prune()
+            self.cache.close()
+        if not self.runs:
+            return {"chunks": 0, "embedded": 0}
+        stats = combine_stats(self.runs)
+        if self.cache is not None:
+            print(f"Embedding cache: {stats['cache_hits']} of {stats['chunks']} chunks cached "
+                  f"({stats['cache_hit_rate']:.1%} hit rate) in {BUILD_EMBED_CACHE_DIR}")
+        print(
+            f"Embedded {stats['embedded']} chunks ({stats['tokens']} tokens) with {embedder.name} in "
+            f"{stats['batches']} batches, {stats['seconds']:.1f}s: {stats['chunks_per_second']} chunks/s, "
+            f"{stats['tokens_per_second']} tokens/s, {stats['rate_limited']} rate limited, {stats['errors']} errors"
+        )
+        return stats
+
+
+class ArtifactWriter:
+    """The metadata, BM25 and attribute artifacts in directory, written a block of rows at a time."""
+
+    def __init__(self, directory):
+        print(f"Writing metadata, BM25 index and attribute index to {directory}")
+        self.metadata_json = MetadataJsonWriter(os.path.join(directory, METADATA_FILE))
+        self.metadata_store = MetadataStoreWriter(os.path.join(directory, METADATA_STORE_FILE))
+        self.lexical = LexicalIndexWriter(os.path.join(directory, LEXICAL_FILE))
+        self.attributes = AttributeIndexWriter(os.path.join(directory, ATTRIBUTES_FILE))
+        self.rows = 0
+        self.tombstones = 0
+
+    def add(self, entries):
+        self.metadata_json.add(entries)
+        self.metadata_store.add(entries)
+        # Tombstone rows have no text and no attributes, so they never match
+        self.lexical.add([entry["chunk_text"] for entry in entries])
+        self.attributes.add([entry.get("attributes", {}) for entry in entries])
+        self.rows += len(entries)
+        self.tombstones += sum(1 for entry in entries if is_tombstone(entry))
+
+    def close(self):
+        self.metadata_json.close()
+        self.metadata_store.close()
+        terms, postings = self.lexical.close()
+        print(f"BM25 index: {terms} terms, {postings} postings")
+        categories = self.attributes.close()
+        print(f"Attribute index: {categories} categories")
+
+    def abort(self):
+        self.metadata_json.abort()
+        self.metadata_store.abort()
+        self.lexical.abort()
+        self.attributes.abort()
+
+
+def stream_faiss_index(entries, writer, prune_cache=False):
+    """
+    Embed, index and write out entries BUILD_STREAM_BLOCK_ROWS at a time
+    (FAISS id = row id), so only one block of chunk texts is held at once.
+    With prune_cache, the embedding cache keeps only the entries' chunks
+    once all of them are indexed. Returns the index and the embedding stats.
+    """
+    embedding = BuildEmbedding()
+    index = None
+    completed = False
+    try:
+        for block in blocks(entries, BUILD_STREAM_BLOCK_ROWS):
+            vectors = embedding.embed(block, show_progress=False)
+            ids = np.arange(writer.rows, writer.rows + len(block), dtype="int64")
+            if index is None:
+                index = id_mapped_index(vectors, ids)
+            else:
+                index.add_with_ids(vectors, ids)
+            writer.add(block)
+            print(f"Indexed {writer.rows} products")
+        completed = True
+    finally:
+        stats = embedding.close(prune_cache=prune_cache and completed)
+    if index is None:
+        raise ValueError("the catalog has no products to index")
+    return index, stats
+
+
+def ann_index(index, config=None):
+    """
+    The index to ship, over the vectors of the exact index built so far:
+    the one select_ann_index() picks and checks for them, or config
+    (incremental updates keep the deployed one). Returns (index, config,
+    measurements).
+    """
+    measurements = []
+    if config is None:
+        print(f"Tuning the ANN index for {index.ntotal} vectors...")
+        index, config, measurements = select_ann_index(index)
+    elif config["type"] != "flat":
+        # A view of the exact index's storage, which the ANN index copies once
+        ids, vectors = flat_vectors(index)
+        ann = build_ann_index(vectors, ids, config)
+        del vectors
+        index = ann
+    print(f"Index: {config['factory']} {config['params']}"
+          + (f", recall@k {config['recall_at_k']}, p95 {config['latency_ms']['p95']}ms" if "recall_at_k" in config else ""))
+    return index, config, measurements
+
+
+def update_faiss_index(previous_source, metadata, force_compact=False):
+    """
+    Apply the catalog changes between the deployed artifacts in
+    previous_source (a directory or gs://bucket/prefix/) and metadata.
+    Only new products and products whose chunk text changed are embedded.
+    Returns (index, metadata, embedding stats, update info).
+    """
+    holder = IndexHolder(embedder_name=embedder.name)
+    staged, _ = holder.stage(previous_source)
+    # Not memory-mapped: the index is modified in place
+    previous = load_index_version(staged, mmap=False, embedder_name=embedder.name)
+    previous_metadata = list(previous.metadata)
+    shutil.rmtree(staged, ignore_errors=True)
+
+    diff = diff_catalog(previous_metadata, metadata)
+    print(f"Changes since index {previous.version}: {diff.summary()}")
+    to_embed = diff.to_embed()
+    embedding = BuildEmbedding()
+    try:
+        vectors = embedding.embed(to_embed) if to_embed else np.zeros((0, previous.index.d), dtype="float32")
+    finally:
+        stats = embedding.close()
+    index, metadata = apply_diff(previous.index, previous_metadata, diff, vectors)
+
+    compacted_at = previous.manifest.get("compacted_at")
+    if force_compact or needs_compaction(metadata, compacted_at):
+        print(f"Compacting {tombstone_count(metadata)} tombstone rows")
+        index, metadata = compact(index, metadata)
+        compacted_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    # ANN indexes were flattened to apply the diff: rebuild them as deployed
+    index, ann, _ = ann_index(index, previous.manifest.get("ann", FLAT))
+    info = {"previous_version": previous.version, "changes": diff.summary(), "compacted_at": compacted_at, "ann": ann}
+    return index, metadata, stats, info
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the FAISS index and the artifacts served with it")
+    parser.add_argument("--incremental", action="store_true",
+                        help="update the deployed index in --previous instead of rebuilding it")
+    parser.add_argument("--previous", default=BASE_DIR, help="deployed artifacts: a directory or gs://bucket/prefix/")
+    parser.add_argument("--compact", action="store_true", help="with --incremental, drop tombstone rows now")
+    parser.add_argument("--limit", type=int, default=BUILD_CATALOG_LIMIT,
+                        help="index only the first N catalog products (default: all)")
+    return parser.parse_args()
+
+
+def build_artifacts(args, meta_path, reviews_path, build_dir):
+    """
+    Build the index and write the other artifacts to build_dir. Returns
+    (index, writer, embedding stats, manifest fields).
+    """
+    reviews = ReviewStore(OUTPUT_REVIEW_STORE)
+    try:
+        print(f"Loading reviews from {reviews_path}...")
+        print(f"Kept {reviews.load(iter_jsonl(reviews_path))} verified reviews")
+        entries = iter_catalog(iter_jsonl(meta_path), reviews, args.limit)
+
+        writer = ArtifactWriter(build_dir)
+        try:
+            if args.incremental:
+                # Matching products by ASIN needs the whole catalog at once
+                index, metadata, embedding_stats, update = update_faiss_index(
+                    args.previous, list(entries), args.compact
+                )
+                writer.add(metadata)
+            else:
+                # A --limit build sees only part of the catalog: keep the rest of the cache
+                index, embedding_stats = stream_faiss_index(entries, writer, prune_cache=not args.limit)
+                index, ann, measurements = ann_index(index)
+                update = {
+                    "compacted_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    "ann": ann,
+                    "ann_candidates": measurements
+                }
+        except BaseException:
+            writer.abort()
+            raise
+        writer.close()
+    finally:
+        reviews.close()
+    return index, writer, embedding_stats, update
 
-    meta = read_jsonl(local_meta)
-    reviews = read_jsonl(local_reviews)
-
-    return meta, reviews
-
-
-def clean_text(text):
-    if isinstance(text, list):
-        text = " ".join(text)
-    elif not isinstance(text, str):
-        text = str(text)
-    return text.replace("\n", " ").replace("\r", " ").strip()
-
-
-def group_reviews_by_asin(reviews):
-    grouped = {}
-    for r in reviews:
-        asin = r.get("parent_asin")
-        if not asin:
-            continue
-        if asin not in grouped:
-            grouped[asin] = []
-        if r.get("verified_purchase") and r.get("text"):
-            grouped[asin].append(r["text"])
-    return grouped
-
-
-def build_chunks(meta, review_groups):
-    chunks = []
-    metadata = []
-
-    for entry in meta:
-        asin = entry.get("parent_asin")
-        if not asin:
-            continue
-
-        title = entry.get("title", "")
-        description = entry.get("description", "")
-        features = entry.get("features", [])
-        categories = entry.get("categories", [])
-        details = entry.get("details", {})
-        rating = entry.get("average_rating", "")
-        price = entry.get("price", "")
-
-        features_str = ", ".join(features) if isinstance(features, list) else features
-        categories_str = ", ".join(categories) if isinstance(categories, list) else categories
-        details_str = "\n".join([f"{k}: {v}" for k, v in details.items()]) if isinstance(details, dict) else str(details)
-
-        reviews = review_groups.get(asin, [])
-        reviews_str = "\n".join(reviews[:5])
-
-        full_text = f"""Title: {clean_text(title)}
-Rating: {rating}
-Price: {price}
-Categories: {categories_str}
-Features: {features_str}
-Description: {clean_text(description)}
-Details:
-{details_str}
-
-Top Reviews:
-{reviews_str}
-"""
-
-        chunks.append(full_text)
-        metadata.append({
-            "parent_asin": asin,
-            "title": title,
-            "chunk_text": full_text
-        })
-
-    return chunks, metadata
-
-
-def get_embedding(text):
-    response = openai.embeddings.create(
-        input=[text],
-        model=EMBED_MODEL
-    )
-    return np.array(response.data[0].embedding, dtype="float32")
-
-
-def build_faiss_index(text_chunks):
-    dim = len(get_embedding("test"))
-    index = faiss.IndexFlatL2(dim)
-    vectors = []
-
-    print("Embedding and indexing documents...")
-    for i, text in enumerate(tqdm(text_chunks)):
-        emb = get_embedding(text)
-        vectors.append(emb)
-
-    vectors_np = np.array(vectors, dtype="float32")
-    vectors_np = normalize(vectors_np, axis=1)
-    index.add(vectors_np)
-    return index
-
-
-SUBSET_SIZE = 500
 
 def main():
-    meta, reviews = load_data()
-    meta_subset = meta[:SUBSET_SIZE]
-    
-    for i, item in enumerate(meta_subset):
-        print(f"{i+1} {item.get('title', 'Untitled Product')}")
-
-    selected_asins = {entry["parent_asin"] for entry in meta_subset if "parent_asin" in entry}
-    filtered_reviews = [r for r in reviews if r.get("parent_asin") in selected_asins]
-
-    review_groups = group_reviews_by_asin(filtered_reviews)
-    text_chunks, metadata = build_chunks(meta_subset, review_groups)
-    index = build_faiss_index(text_chunks)
-
-    print(f"\nSaving FAISS index to: {OUTPUT_INDEX}")
-    faiss.write_index(index, OUTPUT_INDEX)
-
-    print(f"Saving metadata to: {OUTPUT_METADATA}")
-    with open(OUTPUT_METADATA, "w", encoding="utf-8") as f:
-        json.dump(metadata, f, indent=2)
+    args = parse_args()
+    meta_path, reviews_path = download_data()
+
+    # Nothing in BASE_DIR changes until every artifact is written and checksummed
+    build_dir = tempfile.mkdtemp(dir=BASE_DIR, prefix=BUILD_DIR_PREFIX)
+    try:
+        index, writer, embedding_stats, update = build_artifacts(args, meta_path, reviews_path, build_dir)
+
+        print(f"\nSaving FAISS index to: {build_dir}")
+        faiss.write_index(index, os.path.join(build_dir, INDEX_FILE))
+
+        manifest = write_manifest(
+            build_dir, writer.rows, embedder=embedder.name, embedding_dim=index.d, embedding_stats=embedding_stats,
+            live_rows=index.ntotal, tombstones=writer.tombstones, **update
+        )
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+    publish_artifacts(build_dir, BASE_DIR)
+    print(f"Published index version {manifest['version']} to {BASE_DIR} "
+          f"({index.ntotal} products, {manifest['tombstones']} tombstones)")
 
     print("Index build complete.")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,207 @@
+"""
+Content-addressed embedding cache for index builds.
+
+Vectors are stored under sha256(embedder name, chunk text), so a rebuild
+after a data refresh only embeds the chunks whose text changed. Layout of
+BUILD_EMBED_CACHE_DIR:
+- shard-<id>.npy   (rows, dim) arrays, BUILD_EMBED_CACHE_DTYPE, read memory-mapped
+- index.db         SQLite: key -> (shard, row)
+
+Shards are written whole and only then registered in index.db, so a build
+that dies part way leaves at most an unreferenced file behind.
+
+The cache remembers which keys a build looked up. After a complete build,
+prune() forgets every other key and deletes what no longer holds a live
+row: empty shards are removed, and shards less than PRUNE_REWRITE_BELOW
+live are rewritten with only their live rows. Files that index.db does
+not know about are deleted too. The cache therefore stays about the size
+of the current catalog.
+"""
+import hashlib
+import os
+import secrets
+import sqlite3
+import time
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BUILD_EMBED_CACHE_DIR = os.getenv("BUILD_EMBED_CACHE_DIR", os.path.join(BASE_DIR, "embedding_cache"))  # "" = off
+# float16 halves the cache, but a rebuild from it is no longer bit-identical to a fresh one
+BUILD_EMBED_CACHE_DTYPE = os.getenv("BUILD_EMBED_CACHE_DTYPE", "float32")
+BUILD_EMBED_CACHE_SHARD_ROWS = int(os.getenv("BUILD_EMBED_CACHE_SHARD_ROWS", 50000))
+
+INDEX_DB = "index.db"
+# Shards with a smaller share of live rows are rewritten by prune()
+PRUNE_REWRITE_BELOW = 0.5
+# Stay under SQLite's default limit on query parameters
+LOOKUP_CHUNK = 900
+
+
+def cache_key(model, text):
+    return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).digest()
+
+
+class BuildEmbeddingCache:
+    """Used by one build process at a time."""
+
+    def __init__(self, directory, dtype=BUILD_EMBED_CACHE_DTYPE, shard_rows=BUILD_EMBED_CACHE_SHARD_ROWS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dtype = np.dtype(dtype)
+        self.shard_rows = shard_rows
+        self._conn = sqlite3.connect(os.path.join(directory, INDEX_DB))
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS shards (shard INTEGER PRIMARY KEY, file TEXT NOT NULL, "
+            "rows INTEGER NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors (key BLOB PRIMARY KEY, shard INTEGER NOT NULL, row INTEGER NOT NULL) "
+            "WITHOUT ROWID"
+        )
+        # Keys this build looked up or stored; only these survive prune()
+        self._conn.execute("CREATE TEMP TABLE used (key BLOB PRIMARY KEY) WITHOUT ROWID")
+        self._conn.commit()
+        self._shards = {}  # shard id -> memory-mapped array
+        self._pending_keys = []
+        self._pending_vectors = []
+        self._counters = {"hits": 0, "misses": 0, "stored": 0}
+
+    def _shard(self, shard):
+        if shard not in self._shards:
+            (name,) = self._conn.execute("SELECT file FROM shards WHERE shard = ?", (shard,)).fetchone()
+            self._shards[shard] = np.load(os.path.join(self.directory, name), mmap_mode="r")
+        return self._shards[shard]
+
+    def get_many(self, keys):
+        """
+        (vectors, found): a float32 (len(keys), dim) array with the cached
+        rows filled in, or None if nothing was cached, and a boolean mask of
+        the keys that were.
+        """
+        locations = {}
+        unique = list(dict.fromkeys(keys))
+        self._mark_used(unique)
+        for start in range(0, len(unique), LOOKUP_CHUNK):
+            chunk = unique[start:start + LOOKUP_CHUNK]
+            rows = self._conn.execute(
+                f"SELECT key, shard, row FROM vectors WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            )
+            locations.update((key, (shard, row)) for key, shard, row in rows)
+
+        found = np.array([key in locations for key in keys], dtype=bool)
+        self._counters["hits"] += int(found.sum())
+        self._counters["misses"] += int(len(keys) - found.sum())
+        if not found.any():
+            return None, found
+
+        by_shard = {}
+        for position, key in enumerate(keys):
+            if key in locations:
+                shard, row = locations[key]
+                by_shard.setdefault(shard, ([], []))
+                by_shard[shard][0].append(position)
+                by_shard[shard][1].append(row)
+
+        vectors = None
+        for shard, (positions, rows) in by_shard.items():
+            data = self._shard(shard)
+            if vectors is None:
+                vectors = np.zeros((len(keys), data.shape[1]), dtype="float32")
+            vectors[positions] = data[rows]
+        return vectors, found
+
+    def _mark_used(self, keys):
+        with self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO temp.used (key) VALUES (?)", ((key,) for key in keys))
+
+    def add(self, keys, vectors):
+        """Queue vectors for storage. They are written by flush(), or once a shard's worth is queued."""
+        self._mark_used(keys)
+        self._pending_keys.extend(keys)
+        self._pending_vectors.append(np.asarray(vectors))
+        if len(self._pending_keys) >= self.shard_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._pending_keys:
+            return
+        keys = self._pending_keys
+        vectors = np.vstack(self._pending_vectors).astype(self.dtype)
+        self._pending_keys, self._pending_vectors = [], []
+        for start in range(0, len(keys), self.shard_rows):
+            self._write_shard(keys[start:start + self.shard_rows], vectors[start:start + self.shard_rows])
+        self._counters["stored"] += len(keys)
+
+    def _write_shard(self, keys, vectors):
+        name = f"shard-{time.strftime('%Y%m%dT%H%M%S')}-{secrets.token_hex(4)}.npy"
+        path = os.path.join(self.directory, name)
+        with open(f"{path}.tmp", "wb") as f:
+            np.save(f, vectors)
+        os.replace(f"{path}.tmp", path)
+
+        with self._conn:
+            shard = self._conn.execute(
+                "INSERT INTO shards (file, rows, created_at) VALUES (?, ?, ?)", (name, len(keys), time.time())
+            ).lastrowid
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO vectors (key, shard, row) VALUES (?, ?, ?)",
+                ((key, shard, row) for row, key in enumerate(keys))
+            )
+
+    def _drop_shard(self, shard, name):
+        with self._conn:
+            self._conn.execute("DELETE FROM shards WHERE shard = ?", (shard,))
+        self._shards.pop(shard, None)
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def prune(self):
+        """
+        Keep only the keys this build used. Call it after a build that looked
+        up every chunk of the catalog, never after a partial one. Returns the
+        number of keys, shards and stray files removed.
+        """
+        self.flush()
+        with self._conn:
+            keys = self._conn.execute("DELETE FROM vectors WHERE key NOT IN (SELECT key FROM temp.used)").rowcount
+        live = dict(self._conn.execute("SELECT shard, COUNT(*) FROM vectors GROUP BY shard").fetchall())
+
+        shards = 0
+        for shard, name, rows in self._conn.execute("SELECT shard, file, rows FROM shards").fetchall():
+            n_live = live.get(shard, 0)
+            if n_live >= rows * PRUNE_REWRITE_BELOW:
+                continue
+            if n_live:
+                # Moves the live rows to a new shard: their keys are re-pointed at it
+                moved = self._conn.execute(
+                    "SELECT key, row FROM vectors WHERE shard = ? ORDER BY row", (shard,)
+                ).fetchall()
+                vectors = np.asarray(self._shard(shard)[[row for _, row in moved]])
+                self._write_shard([key for key, _ in moved], vectors)
+            self._drop_shard(shard, name)
+            shards += 1
+
+        known = {name for (name,) in self._conn.execute("SELECT file FROM shards")}
+        files = 0
+        for name in os.listdir(self.directory):
+            if name.startswith("shard-") and name not in known:
+                os.remove(os.path.join(self.directory, name))
+                files += 1
+        # Give the deleted keys' pages back
+        self._conn.execute("VACUUM")
+        print(f"Embedding cache pruned: {keys} keys, {shards} shards, {files} stray files")
+        return {"keys": keys, "shards": shards, "files": files}
+
+    def close(self):
+        self.flush()
+        self._shards.clear()
+        self._conn.close()
+
+    def stats(self):
+        stats = dict(self._counters)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
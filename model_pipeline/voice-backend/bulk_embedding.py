@@ -0,0 +1,276 @@
+"""
+Bulk embedding for index builds.
+
+embed_corpus() embeds a whole corpus in few, large requests:
+- chunks are packed, in corpus order, into batches of at most
+  BUILD_EMBED_BATCH_TOKENS tokens (and OPENAI_MAX_INPUTS inputs)
+- BUILD_EMBED_CONCURRENCY batches are in flight at once
+- an AdaptiveRateLimiter keeps them under BUILD_EMBED_TPM tokens and
+  BUILD_EMBED_RPM requests per minute. A 429 halves the allowed rate and
+  pauses every batch for Retry-After; each success wins back a little of
+  the rate (additive increase, multiplicative decrease).
+
+Local embedders get one batch at a time and no rate limit: they are bound
+by the CPU, not by an API quota. With a BuildEmbeddingCache, chunks embedded
+by an earlier build are not sent again.
+"""
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import openai
+from tqdm import tqdm
+
+from build_embedding_cache import cache_key
+from context_packer import count_tokens
+from embedders import EMBED_BATCH_SIZE, OPENAI_MAX_INPUTS, OpenAIEmbedder
+from openai_client import RETRYABLE_ERRORS, PooledOpenAI, RetriesExhausted, UpstreamUnavailable, retry_after_seconds
+
+BUILD_EMBED_CONCURRENCY = int(os.getenv("BUILD_EMBED_CONCURRENCY", 4))
+# The API accepts up to 300k tokens per request; smaller batches spread better over the workers
+BUILD_EMBED_BATCH_TOKENS = int(os.getenv("BUILD_EMBED_BATCH_TOKENS", 50000))
+BUILD_EMBED_TPM = float(os.getenv("BUILD_EMBED_TPM", 1000000))  # 0 = no token limit
+BUILD_EMBED_RPM = float(os.getenv("BUILD_EMBED_RPM", 3000))  # 0 = no request limit
+BUILD_EMBED_MAX_ATTEMPTS = int(os.getenv("BUILD_EMBED_MAX_ATTEMPTS", 8))
+
+# Seconds of quota that can be spent at once after an idle spell
+BURST_SECONDS = 10.0
+RATE_INCREASE = 0.05
+MIN_RATE_FRACTION = 0.05
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+
+def token_batches(token_counts, max_tokens, max_items):
+    """[(start, stop)] consecutive ranges of at most max_tokens tokens and max_items inputs."""
+    batches = []
+    start = 0
+    tokens = 0
+    for i, count in enumerate(token_counts):
+        if i > start and (tokens + count > max_tokens or i - start >= max_items):
+            batches.append((start, i))
+            start, tokens = i, 0
+        tokens += count
+    if start < len(token_counts):
+        batches.append((start, len(token_counts)))
+    return batches
+
+
+class AdaptiveRateLimiter:
+    """
+    Token buckets for tokens and requests per minute, shared by the
+    embedding threads. A batch may overdraw a bucket; the next one then
+    waits until it is paid back, so large batches are paced correctly.
+    """
+
+    def __init__(self, tokens_per_minute=BUILD_EMBED_TPM, requests_per_minute=BUILD_EMBED_RPM):
+        self.limits = {"tokens": tokens_per_minute / 60.0, "requests": requests_per_minute / 60.0}
+        self._levels = {name: rate * BURST_SECONDS for name, rate in self.limits.items()}
+        self.fraction = 1.0  # share of the configured rate currently allowed
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._failure_streak = 0
+        self._lock = threading.Lock()
+        self._counters = {"requests": 0, "rate_limited": 0, "errors": 0, "waited_seconds": 0.0}
+
+    def _refill(self, now):
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        for name, rate in self.limits.items():
+            if rate > 0:
+                self._levels[name] = min(rate * BURST_SECONDS, self._levels[name] + elapsed * rate * self.fraction)
+
+    def _wait_seconds(self, now):
+        wait = self._paused_until - now
+        for name, rate in self.limits.items():
+            if rate > 0 and self._levels[name] < 0:
+                wait = max(wait, -self._levels[name] / (rate * self.fraction))
+        return wait
+
+    def acquire(self, tokens):
+        """Block until a request of this many tokens may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._wait_seconds(now)
+                if wait <= 0:
+                    self._levels["tokens"] -= tokens
+                    self._levels["requests"] -= 1
+                    self._counters["requests"] += 1
+                    return
+                self._counters["waited_seconds"] += wait
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self._failure_streak = 0
+            self.fraction = min(1.0, self.fraction + RATE_INCREASE)
+
+    def _pause(self, retry_after):
+        self._failure_streak += 1
+        if retry_after is None:
+            # Full jitter, so the threads do not come back in lockstep
+            retry_after = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** self._failure_streak))
+        self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+    def on_rate_limited(self, retry_after=None):
+        """429: halve the rate and pause everyone."""
+        with self._lock:
+            self._counters["rate_limited"] += 1
+            self.fraction = max(MIN_RATE_FRACTION, self.fraction / 2)
+            # Nothing saved up during the pause may be spent in a burst right after it
+            for name in self._levels:
+                self._levels[name] = min(self._levels[name], 0.0)
+            self._pause(retry_after)
+
+    def on_error(self, retry_after=None):
+        """Timeouts and 5xx: pause everyone, but keep the rate."""
+        with self._lock:
+            self._counters["errors"] += 1
+            self._pause(retry_after)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["rate_fraction"] = round(self.fraction, 3)
+        stats["waited_seconds"] = round(stats["waited_seconds"], 3)
+        return stats
+
+
+def embed_with_retries(embedder, texts, tokens, limiter, max_attempts=BUILD_EMBED_MAX_ATTEMPTS):
+    for attempt in range(1, max_attempts + 1):
+        limiter.acquire(tokens)
+        try:
+            vectors = embedder.embed(texts)
+        except RETRYABLE_ERRORS + (UpstreamUnavailable,) as e:
+            if attempt == max_attempts:
+                raise
+            # PooledOpenAI hands back errors it gave up on as RetriesExhausted
+            cause = e.__cause__ if isinstance(e, RetriesExhausted) else e
+            retry_after = getattr(e, "retry_after", None) or retry_after_seconds(cause)
+            if isinstance(cause, openai.RateLimitError):
+                limiter.on_rate_limited(retry_after)
+            else:
+                limiter.on_error(retry_after)
+        else:
+            limiter.on_success()
+            return vectors
+
+
+def build_embedder(embedder, concurrency):
+    """
+    The embedder to bulk-embed with. OpenAI embedders get their own client
+    with a connection per batch in flight and no retries of its own: the
+    rate limiter decides when a failed batch goes again.
+    """
+    if isinstance(embedder, OpenAIEmbedder):
+        return OpenAIEmbedder(embedder.model, client=PooledOpenAI(max_retries=0, pool_size=concurrency))
+    return embedder
+
+
+def rate_limiter_for(embedder):
+    """A limiter at the configured API quota for OpenAI embedders, an unlimited one otherwise."""
+    if isinstance(embedder, OpenAIEmbedder):
+        return AdaptiveRateLimiter()
+    return AdaptiveRateLimiter(0, 0)
+
+
+def combine_stats(runs):
+    """
+    The stats of several embed_corpus() runs, e.g. the blocks of a streaming
+    build, as one. The runs are expected to share a rate limiter, whose
+    counters are cumulative.
+    """
+    if not runs:
+        return {}
+    stats = dict(runs[-1])
+    for key in ("chunks", "embedded", "tokens", "batches", "seconds", "cache_hits"):
+        if key in stats:
+            stats[key] = sum(run[key] for run in runs)
+    seconds = stats["seconds"]
+    stats["seconds"] = round(seconds, 3)
+    stats["chunks_per_second"] = round(stats["embedded"] / seconds, 2) if seconds else 0.0
+    stats["tokens_per_second"] = round(stats["tokens"] / seconds, 1) if seconds else 0.0
+    if "cache_hits" in stats:
+        stats["cache_hit_rate"] = round(stats["cache_hits"] / stats["chunks"], 4) if stats["chunks"] else 0.0
+    return stats
+
+
+def embed_corpus(embedder, texts, token_counts=None, concurrency=None, max_batch_tokens=BUILD_EMBED_BATCH_TOKENS,
+                 limiter=None, cache=None, show_progress=True):
+    """
+    (len(texts), dim) L2-normalized vectors in corpus order, and throughput
+    stats. token_counts (per text) are counted with tiktoken when not given.
+    With a BuildEmbeddingCache only the texts it does not have are embedded,
+    and their vectors are added to it as batches complete.
+    """
+    remote = isinstance(embedder, OpenAIEmbedder)
+    if concurrency is None:
+        concurrency = BUILD_EMBED_CONCURRENCY if remote else 1
+    if limiter is None:
+        limiter = rate_limiter_for(embedder)
+
+    vectors = None
+    keys = None
+    missing = list(range(len(texts)))
+    if cache is not None:
+        keys = [cache_key(embedder.name, text) for text in texts]
+        vectors, found = cache.get_many(keys)
+        missing = np.flatnonzero(~found).tolist()
+    if token_counts is None:
+        token_counts = {i: count_tokens(texts[i]) for i in missing}
+    miss_texts = [texts[i] for i in missing]
+    miss_tokens = [token_counts[i] for i in missing]
+    max_items = OPENAI_MAX_INPUTS if remote else EMBED_BATCH_SIZE
+    batches = token_batches(miss_tokens, max_batch_tokens if remote else float("inf"), max_items)
+
+    started = time.perf_counter()
+    progress = tqdm(total=len(miss_texts), unit="chunk", disable=not show_progress)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="embed") as pool:
+        futures = {
+            pool.submit(embed_with_retries, embedder, miss_texts[start:stop], sum(miss_tokens[start:stop]), limiter): (start, stop)
+            for start, stop in batches
+        }
+        try:
+            for future in as_completed(futures):
+                start, stop = futures[future]
+                rows = future.result()
+                if vectors is None:
+                    vectors = np.empty((len(texts), rows.shape[1]), dtype="float32")
+                vectors[missing[start:stop]] = rows
+                if cache is not None:
+                    cache.add([keys[i] for i in missing[start:stop]], rows)
+                progress.update(stop - start)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            progress.close()
+            # Whatever was embedded before a failure is kept for the next run
+            if cache is not None:
+                cache.flush()
+    seconds = time.perf_counter() - started
+
+    if vectors is None:
+        vectors = np.zeros((0, embedder.dimension()), dtype="float32")
+    tokens = int(sum(miss_tokens))
+    stats = {
+        "chunks": len(texts),
+        "embedded": len(miss_texts),
+        "tokens": tokens,
+        "batches": len(batches),
+        "concurrency": concurrency,
+        "seconds": round(seconds, 3),
+        "chunks_per_second": round(len(miss_texts) / seconds, 2) if seconds else 0.0,
+        "tokens_per_second": round(tokens / seconds, 1) if seconds else 0.0
+    }
+    if cache is not None:
+        stats["cache_hits"] = len(texts) - len(miss_texts)
+        stats["cache_hit_rate"] = round(stats["cache_hits"] / len(texts), 4) if texts else 0.0
+    stats.update(limiter.stats())
+    return vectors, stats
@@ -0,0 +1,152 @@
+"""
+Streaming reads of the product catalog for index builds.
+
+The metadata and reviews JSONL files are read a line at a time. Reviews
+come first: the first REVIEWS_PER_PRODUCT verified reviews of each product
+go into a temporary SQLite ReviewStore, so they can be looked up while
+the metadata file is streamed, without keeping all reviews in memory.
+iter_catalog() then yields one metadata entry (with its chunk text) per
+product, and blocks() groups them for embedding.
+"""
+import json
+import os
+import sqlite3
+
+from attribute_index import extract_attributes
+from context_packer import section_token_counts
+
+# 0 = the whole catalog
+BUILD_CATALOG_LIMIT = int(os.getenv("BUILD_CATALOG_LIMIT", 0))
+# Products embedded, indexed and written per block; bounds the build's working set
+BUILD_STREAM_BLOCK_ROWS = int(os.getenv("BUILD_STREAM_BLOCK_ROWS", 2000))
+REVIEWS_PER_PRODUCT = 5
+
+INSERT_BATCH = 10000
+
+
+def iter_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def blocks(items, size):
+    """Lists of up to size consecutive items."""
+    block = []
+    for item in items:
+        block.append(item)
+        if len(block) >= size:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+class ReviewStore:
+    """On-disk review texts by parent ASIN, at most per_product of them, in file order."""
+
+    def __init__(self, path, per_product=REVIEWS_PER_PRODUCT):
+        self.path = path
+        self.per_product = per_product
+        if os.path.exists(path):
+            os.remove(path)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=OFF")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute("CREATE TABLE reviews (id INTEGER PRIMARY KEY, parent_asin TEXT NOT NULL, text TEXT NOT NULL)")
+        self._conn.execute("CREATE INDEX reviews_by_asin ON reviews (parent_asin, id)")
+
+    def load(self, reviews):
+        """Store the verified reviews with text. Returns how many were kept."""
+        insert = (
+            "INSERT INTO reviews (parent_asin, text) SELECT ?, ? "
+            "WHERE (SELECT COUNT(*) FROM reviews WHERE parent_asin = ?) < ?"
+        )
+        batch = []
+        for r in reviews:
+            asin = r.get("parent_asin")
+            if asin and r.get("verified_purchase") and r.get("text"):
+                batch.append((asin, r["text"], asin, self.per_product))
+            if len(batch) >= INSERT_BATCH:
+                with self._conn:
+                    self._conn.executemany(insert, batch)
+                batch = []
+        if batch:
+            with self._conn:
+                self._conn.executemany(insert, batch)
+        return self._conn.execute("SELECT COUNT(*) FROM reviews").fetchone()[0]
+
+    def reviews_of(self, asin):
+        rows = self._conn.execute(
+            "SELECT text FROM reviews WHERE parent_asin = ? ORDER BY id LIMIT ?", (asin, self.per_product)
+        )
+        return [text for text, in rows]
+
+    def close(self):
+        self._conn.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def clean_text(text):
+    if isinstance(text, list):
+        text = " ".join(text)
+    elif not isinstance(text, str):
+        text = str(text)
+    return text.replace("\n", " ").replace("\r", " ").strip()
+
+
+def product_entry(entry, reviews):
+    """The metadata entry, chunk text included, of one catalog product."""
+    asin = entry.get("parent_asin")
+    title = entry.get("title", "")
+    description = entry.get("description", "")
+    features = entry.get("features", [])
+    categories = entry.get("categories", [])
+    details = entry.get("details", {})
+    rating = entry.get("average_rating", "")
+    price = entry.get("price", "")
+
+    features_str = ", ".join(features) if isinstance(features, list) else features
+    categories_str = ", ".join(categories) if isinstance(categories, list) else categories
+    details_str = "\n".join([f"{k}: {v}" for k, v in details.items()]) if isinstance(details, dict) else str(details)
+
+    reviews_str = "\n".join(reviews[:REVIEWS_PER_PRODUCT])
+
+    full_text = f"""Title: {clean_text(title)}
+Rating: {rating}
+Price: {price}
+Categories: {categories_str}
+Features: {features_str}
+Description: {clean_text(description)}
+Details:
+{details_str}
+
+Top Reviews:
+{reviews_str}
+"""
+
+    return {
+        "parent_asin": asin,
+        "title": title,
+        "chunk_text": full_text,
+        # Lets the server pack prompts to a token budget without tokenizing
+        "token_counts": section_token_counts(full_text),
+        # Typed price/rating/categories for filtered search
+        "attributes": extract_attributes(entry)
+    }
+
+
+def iter_catalog(meta, review_store, limit=BUILD_CATALOG_LIMIT):
+    """Metadata entries of the first limit products (0 = all) with a parent ASIN, in file order."""
+    count = 0
+    for entry in meta:
+        if limit and count >= limit:
+            break
+        count += 1
+        asin = entry.get("parent_asin")
+        if not asin:
+            continue
+        yield product_entry(entry, review_store.reviews_of(asin))
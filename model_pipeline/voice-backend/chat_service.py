@@ -0,0 +1,129 @@
+"""
+Framework-neutral pieces of the /chat contract, shared by the Flask app
+(app.py) and the ASGI server (asgi_app.py): prompt building, the result
+shape, sentence splitting for speech, SSE framing and per-worker startup.
+"""
+import json
+import os
+import re
+
+from context_packer import pack_context
+from embedding_cache import normalize_query
+from rag_helper import get_query_embedding, index_holder, reranker
+import warmup
+import metrics
+
+CHAT_MODEL = "gpt-3.5-turbo"
+# Total time a /chat request may spend waiting on OpenAI, across all calls and retries
+CHAT_REQUEST_BUDGET_SECONDS = float(os.getenv("CHAT_REQUEST_BUDGET_SECONDS", 25))
+BUSY_MESSAGE = "The assistant is busy right now, please try again shortly."
+
+# Sentence chunks shorter than this are held back and merged with the next one,
+# so the speech synthesizer is not fed single words like "Sure."
+MIN_SENTENCE_CHARS = int(os.getenv("STREAM_MIN_SENTENCE_CHARS", 20))
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+
+ANSWER_CACHE_COUNTERS = ("exact_hits", "semantic_hits", "misses", "invalidations")
+SINGLE_FLIGHT_COUNTERS = ("leaders", "followers", "shared_followers", "fallbacks")
+
+
+def build_prompt_with_rag(user_question, context_memory):
+    context = context_memory or "[No product context available]"
+
+    prompt = (
+        "You are a helpful assistant. Use the product context below to answer the user's question naturally.\n\n"
+        f"=== Product Context ===\n{context}\n\n"
+        f"=== User Question ===\n{user_question}\n\n"
+        "If a relevant product is found, respond with its details\n"
+        "If nothing relevant is found in databases, say so and end with:\nSorry, I do not have any information about this product.\n"
+        "Keep the answers precise and to the point"
+    )
+    return prompt
+
+
+def build_messages(prompt):
+    return [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def pack_retrieved(top_chunks):
+    """
+    Returns (top_asin, context_memory) for fetch_top_k_chunks results.
+    context_memory packs the top chunks into CONTEXT_TOKEN_BUDGET tokens.
+    """
+    with metrics.stage("context_pack"):
+        context_memory, used_chunks, tokens = pack_context(top_chunks)
+    metrics.CONTEXT_TOKENS.observe(tokens)
+    if not used_chunks:
+        return None, ""
+    return used_chunks[0]['parent_asin'], context_memory
+
+
+def extract_product_name(answer):
+    # Extract product name from last line
+    product_line = next(
+        (line for line in answer.splitlines() if line.startswith("Product: ")),
+        "Product: NOT FOUND"
+    )
+    return product_line.replace("Product: ", "").strip()
+
+
+def build_result(answer, context_memory, version):
+    """The JSON body of /chat (and of the final /chat/stream event)."""
+    answer = answer.strip()
+    return {
+        "response": answer,
+        "product_name": extract_product_name(answer),
+        "product_context": context_memory,
+        "index_version": version
+    }
+
+
+def coalesce_key(user_question, version):
+    return f"{version}\x00{normalize_query(user_question)}"
+
+
+def split_sentences(buffer, final=False):
+    """
+    Split streamed text into sentences that are ready to be spoken.
+    Returns (sentences, remainder) where remainder is the unfinished tail.
+    """
+    parts = SENTENCE_BOUNDARY.split(buffer)
+    remainder = "" if final else parts.pop()
+
+    sentences = []
+    pending = ""
+    for part in parts:
+        pending = f"{pending} {part.strip()}".strip()
+        if len(pending) >= MIN_SENTENCE_CHARS:
+            sentences.append(pending)
+            pending = ""
+
+    if pending:
+        if final:
+            sentences.append(pending)
+        else:
+            remainder = f"{pending} {remainder}" if remainder else f"{pending} "
+    return sentences, remainder
+
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def replay_events(cached):
+    """SSE events for a cached answer, the same ones a live answer produces."""
+    yield sse_event("token", {"text": cached["response"]})
+    sentences, _ = split_sentences(cached["response"], final=True)
+    for sentence in sentences:
+        yield sse_event("sentence", {"text": sentence})
+    yield sse_event("done", cached)
+
+
+def start_background_tasks():
+    """Per-worker startup work. Gunicorn calls this after fork, the ASGI server on startup."""
+    index_holder.start_polling()
+    if warmup.WARMUP_ON_START:
+        warmup.start_warmup(index_holder, embed_query=get_query_embedding, reranker=reranker)
@@ -0,0 +1,158 @@
+"""
+Token-budgeted context packing for the RAG prompt.
+
+The retrieved chunks are packed into the prompt in rank order until
+CONTEXT_TOKEN_BUDGET is used up. Chunks further than CONTEXT_MAX_DISTANCE
+from the query are dropped. A chunk that does not fit loses its
+low-value sections first (Top Reviews, then Details), line by line, and
+only then is it left out.
+
+Section token counts are computed once at index-build time and stored in
+the metadata (`token_counts`), so packing usually does not tokenize at all.
+"""
+import math
+import os
+
+CONTEXT_TOP_K = int(os.getenv("CONTEXT_TOP_K", 3))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1200))
+# Squared L2 distance between normalized vectors (2 - 2 * cosine), 0 disables the cutoff
+CONTEXT_MAX_DISTANCE = float(os.getenv("CONTEXT_MAX_DISTANCE", 1.5))
+TOKENIZER_ENCODING = "cl100k_base"
+
+# Section markers written by catalog_stream.product_entry()
+DETAILS_MARKER = "Details:\n"
+REVIEWS_MARKER = "Top Reviews:\n"
+# Trimmed first to last; "core" (title, rating, price, features, description) is kept
+TRIM_ORDER = ("reviews", "details")
+CHUNK_SEPARATOR = "\n---\n"
+
+_encoding = None
+
+
+def count_tokens(text):
+    """Tokens in text with tiktoken, or roughly 4 characters per token without it."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / 4)
+
+
+def split_sections(chunk_text):
+    """Split a chunk into {"core", "details", "reviews"} texts (missing sections are "")."""
+    sections = {"core": chunk_text, "details": "", "reviews": ""}
+
+    head, marker, reviews = chunk_text.partition(REVIEWS_MARKER)
+    if marker:
+        sections["reviews"] = marker + reviews.strip("\n")
+        sections["core"] = head
+
+    head, marker, details = sections["core"].partition(DETAILS_MARKER)
+    if marker:
+        sections["details"] = marker + details.strip("\n")
+        sections["core"] = head
+
+    sections["core"] = sections["core"].strip("\n")
+    return sections
+
+
+def section_token_counts(chunk_text):
+    """Precomputed at build time and stored as the metadata entry's `token_counts`."""
+    return {name: count_tokens(text) if text else 0 for name, text in split_sections(chunk_text).items()}
+
+
+def _join(sections):
+    return "\n".join(sections[name] for name in ("core", "details", "reviews") if sections[name])
+
+
+def _fit_lines(text, budget):
+    """Keep the section header and as many following lines as fit in budget tokens."""
+    lines = text.split("\n")
+    kept = []
+    used = 0
+    for line in lines:
+        cost = count_tokens(line) + 1  # + newline
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    # A header with no lines under it is not worth sending
+    return ("\n".join(kept), used) if len(kept) > 1 else ("", 0)
+
+
+def _truncate_words(text, budget):
+    """Longest word prefix of text that fits in budget tokens."""
+    words = text.split(" ")
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(" ".join(words[:middle])) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    truncated = " ".join(words[:low])
+    return truncated, count_tokens(truncated) if truncated else 0
+
+
+def fit_chunk(chunk, budget, truncate_core=False):
+    """
+    The chunk's text trimmed to budget tokens, and the tokens it uses.
+    If even its core does not fit, returns ("", 0), or the core cut to the
+    budget when truncate_core is set.
+    """
+    sections = split_sections(chunk["chunk_text"])
+    counts = chunk.get("token_counts") or section_token_counts(chunk["chunk_text"])
+    # Sections are joined with one newline, which costs about a token each
+    costs = {name: counts.get(name, 0) + 1 if sections[name] else 0 for name in sections}
+
+    total = sum(costs.values())
+    if total <= budget:
+        return _join(sections), total
+
+    for name in TRIM_ORDER:
+        without = total - costs[name]
+        if without > budget:
+            # Dropping this section entirely is not enough, so drop it and move on
+            sections[name] = ""
+            total = without
+            continue
+        sections[name], used = _fit_lines(sections[name], budget - without)
+        return _join(sections), without + used
+
+    if truncate_core:
+        return _truncate_words(sections["core"], budget)
+    return "", 0
+
+
+def pack_context(chunks, budget=CONTEXT_TOKEN_BUDGET, max_distance=CONTEXT_MAX_DISTANCE):
+    """
+    Pack ranked search results (fetch_top_k_chunks output) into one context
+    string. Returns (context, used_chunks, tokens). The best chunk is always
+    sent, cut down if needed, as long as it passes the distance cutoff;
+    lower chunks that do not fit are skipped until the budget is spent.
+    """
+    if max_distance > 0:
+        chunks = [chunk for chunk in chunks if chunk.get("similarity", 0.0) <= max_distance]
+
+    parts = []
+    used_chunks = []
+    tokens = 0
+    separator_cost = count_tokens(CHUNK_SEPARATOR)
+    for chunk in chunks:
+        remaining = budget - tokens - (separator_cost if parts else 0)
+        if remaining <= 0:
+            break
+        text, cost = fit_chunk(chunk, remaining, truncate_core=not parts)
+        if not text:
+            # A long chunk that does not fit can leave room for a shorter one after it
+            continue
+        parts.append(text)
+        used_chunks.append(chunk)
+        tokens += cost + (separator_cost if len(parts) > 1 else 0)
+
+    return CHUNK_SEPARATOR.join(parts), used_chunks, tokens
@@ -0,0 +1,139 @@
+"""
+Pluggable text embedders.
+
+The index builder, the server and the offline validation scripts all get
+their embedder from get_embedder(), configured by EMBEDDER:
+- openai:<model>                  OpenAI embeddings API (default)
+- local:<sentence-transformers model>  on-CPU inference, no network hop
+
+Every embedder returns L2-normalized float32 rows. Its `name` is recorded in
+the index manifest, and the server refuses to search an index that was
+built by a different embedder (see index_holder.check_embedder).
+"""
+import abc
+import asyncio
+import os
+import threading
+
+import numpy as np
+from sklearn.preprocessing import normalize
+
+from openai_client import shared_client, async_client
+import metrics
+
+DEFAULT_EMBEDDER = "openai:text-embedding-3-small"
+EMBEDDER = os.getenv("EMBEDDER", DEFAULT_EMBEDDER)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 64))
+# Local backend only: "none", "int8" (dynamic quantization of the linear
+# layers) or "onnx" (onnxruntime, needs sentence-transformers>=3.2)
+LOCAL_EMBEDDER_ACCEL = os.getenv("LOCAL_EMBEDDER_ACCEL", "none").lower()
+# Largest input list the OpenAI embeddings API accepts in one call
+OPENAI_MAX_INPUTS = 2048
+
+
+class Embedder(abc.ABC):
+    name = None
+
+    @abc.abstractmethod
+    def embed(self, texts):
+        """(len(texts), dim) float32 array of L2-normalized embeddings."""
+
+    async def embed_async(self, texts):
+        # CPU-bound backends run off the event loop
+        return await asyncio.to_thread(self.embed, texts)
+
+    def dimension(self):
+        return self.embed(["dimension probe"]).shape[1]
+
+
+class OpenAIEmbedder(Embedder):
+    def __init__(self, model, client=shared_client, aclient=async_client):
+        self.model = model
+        self.name = f"openai:{model}"
+        self.client = client
+        self.aclient = aclient
+
+    @staticmethod
+    def _rows(response):
+        metrics.record_embedding_usage(response.usage)
+        return [item.embedding for item in response.data]
+
+    def embed(self, texts):
+        rows = []
+        for start in range(0, len(texts), OPENAI_MAX_INPUTS):
+            response = self.client.embeddings(input=list(texts[start:start + OPENAI_MAX_INPUTS]), model=self.model)
+            rows.extend(self._rows(response))
+        return normalize(np.array(rows, dtype="float32"), axis=1)
+
+    async def embed_async(self, texts):
+        rows = []
+        for start in range(0, len(texts), OPENAI_MAX_INPUTS):
+            response = await self.aclient.embeddings(input=list(texts[start:start + OPENAI_MAX_INPUTS]), model=self.model)
+            rows.extend(self._rows(response))
+        return normalize(np.array(rows, dtype="float32"), axis=1)
+
+
+class LocalEmbedder(Embedder):
+    """sentence-transformers on the CPU. The model is loaded on first use."""
+
+    def __init__(self, model, accel=LOCAL_EMBEDDER_ACCEL, batch_size=EMBED_BATCH_SIZE):
+        self.model_name = model
+        self.accel = accel
+        self.batch_size = batch_size
+        # int8/ONNX only approximate the same vector space, so they share the name
+        self.name = f"local:{model}"
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        from sentence_transformers import SentenceTransformer
+
+        if self.accel == "onnx":
+            model = SentenceTransformer(self.model_name, device="cpu", backend="onnx")
+        else:
+            model = SentenceTransformer(self.model_name, device="cpu")
+            if self.accel == "int8":
+                import torch
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        print(f"Loaded local embedder {self.name} (accel={self.accel})")
+        return model
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._load()
+        return self._model
+
+    def embed(self, texts):
+        vectors = self.model.encode(
+            list(texts),
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        return np.asarray(vectors, dtype="float32").reshape(len(texts), -1)
+
+    def dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+
+_embedders = {}
+_embedders_lock = threading.Lock()
+
+
+def get_embedder(spec=None):
+    """The embedder for spec ("backend:model"), one shared instance per spec."""
+    spec = spec or EMBEDDER
+    with _embedders_lock:
+        if spec not in _embedders:
+            backend, _, model = spec.partition(":")
+            if backend == "openai":
+                _embedders[spec] = OpenAIEmbedder(model)
+            elif backend == "local":
+                _embedders[spec] = LocalEmbedder(model)
+            else:
+                raise ValueError(f"Unknown embedder backend {backend!r} in {spec!r} (use openai:<model> or local:<model>)")
+        return _embedders[spec]
@@ -0,0 +1,165 @@
+"""
+Query embedding cache for the RAG assistant.
+
+Two tiers:
+- an in-process LRU with a TTL, private to each worker
+- an optional SQLite file shared by every gunicorn worker on the instance,
+  pruned of expired rows and down to EMBED_CACHE_SHARED_SIZE rows whenever
+  the LRU evicts (at most every EMBED_CACHE_PRUNE_SECONDS)
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", 1024))
+EMBED_CACHE_TTL = float(os.getenv("EMBED_CACHE_TTL", 24 * 3600))
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH")  # unset = no shared tier
+EMBED_CACHE_SHARED_SIZE = int(os.getenv("EMBED_CACHE_SHARED_SIZE", 100000))
+EMBED_CACHE_PRUNE_SECONDS = float(os.getenv("EMBED_CACHE_PRUNE_SECONDS", 60))
+
+
+def normalize_query(text):
+    """Lowercase and collapse whitespace so trivially different questions share an entry."""
+    return " ".join(text.lower().split())
+
+
+def make_cache_key(text, model):
+    return hashlib.sha256(f"{model}\x00{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, max_entries=EMBED_CACHE_SIZE, ttl_seconds=EMBED_CACHE_TTL, shared_path=EMBED_CACHE_PATH,
+                 shared_max_entries=EMBED_CACHE_SHARED_SIZE, prune_interval=EMBED_CACHE_PRUNE_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.shared_path = shared_path
+        self.shared_max_entries = shared_max_entries
+        self.prune_interval = prune_interval
+        self._pruned_at = None
+
+        self._entries = OrderedDict()  # key -> (expires_at, vector)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters = {"hits": 0, "shared_hits": 0, "misses": 0}
+
+        if shared_path:
+            self._connect().execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._connect().execute("CREATE INDEX IF NOT EXISTS embeddings_by_age ON embeddings (created_at)")
+
+    def _connect(self):
+        # sqlite3 connections cannot be shared between threads, keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.shared_path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _remember(self, key, vector):
+        """Store a frozen private copy (handed to every later caller). Returns (copy, whether the LRU evicted)."""
+        vector = vector.copy()
+        vector.setflags(write=False)
+        evicted = False
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted = True
+        return vector, evicted
+
+    def _prune_shared(self):
+        """Drop expired rows, then the oldest ones past shared_max_entries, at most every prune_interval."""
+        now = time.monotonic()
+        with self._lock:
+            if self._pruned_at is not None and now - self._pruned_at < self.prune_interval:
+                return
+            self._pruned_at = now
+        try:
+            conn = self._connect()
+            conn.execute("DELETE FROM embeddings WHERE created_at <= ?", (time.time() - self.ttl_seconds,))
+            conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.shared_max_entries,)
+            )
+        except sqlite3.Error as e:
+            print("Embedding cache prune failed:", e)
+
+    def get(self, text, model):
+        key = make_cache_key(text, model)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, vector = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return vector
+                del self._entries[key]
+
+        if self.shared_path:
+            try:
+                row = self._connect().execute(
+                    "SELECT dim, vector FROM embeddings WHERE key = ? AND created_at > ?",
+                    (key, time.time() - self.ttl_seconds)
+                ).fetchone()
+            except sqlite3.Error as e:
+                print("Embedding cache read failed:", e)
+                row = None
+            if row is not None:
+                dim, blob = row
+                vector, evicted = self._remember(key, np.frombuffer(blob, dtype="float32").reshape(1, dim))
+                if evicted:
+                    self._prune_shared()
+                self._count("shared_hits")
+                return vector
+
+        self._count("misses")
+        return None
+
+    def put(self, text, model, vector):
+        key = make_cache_key(text, model)
+        vector, evicted = self._remember(key, np.ascontiguousarray(vector, dtype="float32").reshape(1, -1))
+
+        if self.shared_path:
+            try:
+                self._connect().execute(
+                    "INSERT OR REPLACE INTO embeddings (key, dim, vector, created_at) VALUES (?, ?, ?, ?)",
+                    (key, vector.shape[1], vector.tobytes(), time.time())
+                )
+            except sqlite3.Error as e:
+                # A locked or full shared tier should never fail the request
+                print("Embedding cache write failed:", e)
+            if evicted:
+                self._prune_shared()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for name in self._counters:
+                self._counters[name] = 0
+        if self.shared_path:
+            self._connect().execute("DELETE FROM embeddings")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["shared_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["shared_hits"]) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,65 @@
+"""
+Single-file container for read-only numpy arrays, shared by the index
+artifacts that workers memory-map (lexical_index.bin, attributes.bin):
+
+    magic (8 bytes) | data offset (uint64) | JSON header | 64-byte aligned arrays
+
+The header holds free-form params plus dtype, shape and offset of every
+array. Reading maps the file once and returns views into it, so opening is
+O(1) and all workers share the pages through the OS page cache.
+"""
+import json
+import os
+import struct
+
+import numpy as np
+
+ALIGN = 64
+
+
+def _aligned(n):
+    return -(-n // ALIGN) * ALIGN
+
+
+def write_arrays(path, magic, arrays, params):
+    """Write the named arrays and params to path, atomically."""
+    layout = {}
+    position = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": position}
+        position += _aligned(array.nbytes)
+    header = json.dumps({"params": params, "arrays": layout}).encode("utf-8")
+    data_start = _aligned(len(magic) + 8 + len(header))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(magic)
+        f.write(struct.pack("<Q", data_start))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + position)
+    # Readers never see a half-written file
+    os.replace(tmp_path, path)
+
+
+def read_arrays(path, magic):
+    """(params, {name: read-only array view}) for a file written by write_arrays."""
+    with open(path, "rb") as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError(f"{path} is not a {magic.decode('ascii', 'replace')} file")
+        data_start, = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(data_start - len(magic) - 8).rstrip(b"\x00").decode("utf-8"))
+
+    raw = np.memmap(path, dtype="uint8", mode="r")
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        shape = tuple(spec["shape"])
+        start = data_start + spec["offset"]
+        count = int(np.prod(shape, dtype="int64"))
+        arrays[name] = raw[start:start + count * dtype.itemsize].view(dtype).reshape(shape)
+    return header["params"], arrays
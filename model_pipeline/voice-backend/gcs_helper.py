@@ -34,6 +34,16 @@ def check_if_blob_exists(bucket_name, blob_name):
     
     return blob.exists()
 
+def get_blob_fingerprint(bucket_name, blob_name):
+    """Generation and md5 of a blob, or None if it does not exist."""
+    storage_client = storage.Client()
+    bucket = storage_client.bucket(bucket_name)
+    blob = bucket.get_blob(blob_name)
+    
+    if blob is None:
+        return None
+    return f"{blob.generation}:{blob.md5_hash}"
+
 def get_gcs_bucket_name():
     """Get the GCS bucket name from environment variables."""
     # First try the environment variable
@@ -44,37 +54,3 @@ def get_gcs_bucket_name():
         bucket_name = os.getenv('GCS_BUCKET')
     
     return bucket_name
-
-def ensure_index_files():
-    """
-    Ensures FAISS index files are available locally.
-    If not present locally, attempts to download from GCS.
-    """
-    bucket_name = get_gcs_bucket_name()
-    if not bucket_name:
-        print("No GCS bucket configured. Using local files only.")
-        return
-    
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    index_path = os.path.join(base_dir, "faiss_index.index")
-    metadata_path = os.path.join(base_dir, "index_metadata.json")
-    
-    # Check if local files exist
-    local_index_exists = os.path.exists(index_path)
-    local_metadata_exists = os.path.exists(metadata_path)
-    
-    # If both exist locally, nothing to do
-    if local_index_exists and local_metadata_exists:
-        print("Using existing local index files.")
-        return
-    
-    # Check if files exist in GCS
-    gcs_index_exists = check_if_blob_exists(bucket_name, "model/faiss_index.index")
-    gcs_metadata_exists = check_if_blob_exists(bucket_name, "model/index_metadata.json")
-    
-    # Download from GCS if needed
-    if not local_index_exists and gcs_index_exists:
-        download_blob_to_file(bucket_name, "model/faiss_index.index", index_path)
-    
-    if not local_metadata_exists and gcs_metadata_exists:
-        download_blob_to_file(bucket_name, "model/index_metadata.json", metadata_path)
\ No newline at end of file
@@ -0,0 +1,44 @@
+"""
+Gunicorn settings for the voice backend.
+
+GUNICORN_PRELOAD=true loads app.py (and the FAISS index) once in the master,
+so workers share the index pages copy-on-write. FAISS_INDEX_MMAP=true gets
+the same sharing through the page cache without preloading.
+
+Chat requests are admitted (admission.py) within each worker's
+GUNICORN_THREADS threads, so run more than one thread (gthread) for the
+admission queue to ever hold a request.
+
+With more than one worker, point PROMETHEUS_MULTIPROC_DIR at an empty
+directory so /metrics adds up every worker's histograms and counters.
+"""
+import os
+from memory_stats import log_memory
+
+bind = f":{os.getenv('PORT', '8080')}"
+workers = int(os.getenv("GUNICORN_WORKERS", 1))
+threads = int(os.getenv("GUNICORN_THREADS", 1))
+worker_class = "gthread" if threads > 1 else "sync"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+preload_app = os.getenv("GUNICORN_PRELOAD", "false").lower() == "true"
+
+
+def when_ready(server):
+    if preload_app:
+        # Load the index in the master so forked workers share its pages
+        from rag_helper import index_holder
+        index_holder.current()
+    log_memory("master ready")
+
+
+def post_worker_init(worker):
+    log_memory(f"worker {worker.pid} ready (preload={preload_app})")
+
+    # Warmup and index polling threads must start after fork, one per worker
+    from app import start_background_tasks
+    start_background_tasks()
+
+
+def child_exit(server, worker):
+    from metrics import mark_worker_dead
+    mark_worker_dead(worker.pid)
@@ -0,0 +1,209 @@
+"""
+Incremental index updates, keyed by product (parent ASIN).
+
+The FAISS index is an IndexIDMap2 whose ids are metadata row ids. An ASIN
+keeps its row id from one build to the next: a product whose chunk text
+changed is re-embedded and replaced in place, a new product gets the next
+row id, and a deleted product leaves a tombstone row (a metadata entry
+marked "deleted", with no vector, BM25 postings or attribute bits). Row ids
+stay small and dense, so the bitmap filters and the BM25/attribute arrays,
+which are all indexed by row id, keep working unchanged.
+
+Tombstones are compacted away (rows renumbered, nothing re-embedded) when
+they exceed INDEX_COMPACT_TOMBSTONE_RATIO of the rows, or when the last
+compaction is more than INDEX_COMPACT_INTERVAL_HOURS old.
+"""
+import datetime
+import json
+import os
+
+import faiss
+import numpy as np
+
+INDEX_COMPACT_TOMBSTONE_RATIO = float(os.getenv("INDEX_COMPACT_TOMBSTONE_RATIO", 0.2))
+INDEX_COMPACT_INTERVAL_HOURS = float(os.getenv("INDEX_COMPACT_INTERVAL_HOURS", 24))  # 0 = only by ratio
+
+
+def tombstone():
+    return {"parent_asin": None, "title": "", "chunk_text": "", "token_counts": {}, "attributes": {}, "deleted": True}
+
+
+def is_tombstone(entry):
+    return bool(entry.get("deleted"))
+
+
+def id_mapped_index(vectors, ids=None):
+    """An IndexIDMap2 over an exact L2 index, ids defaulting to row positions."""
+    index = faiss.IndexIDMap2(faiss.IndexFlatL2(vectors.shape[1]))
+    ids = np.arange(len(vectors), dtype="int64") if ids is None else np.asarray(ids, dtype="int64")
+    index.add_with_ids(np.ascontiguousarray(vectors, dtype="float32"), ids)
+    return index
+
+
+def stored_vectors(index):
+    """(ids, vectors) of every vector in an ID-mapped or plain flat index, by ascending id."""
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index)
+        ids = faiss.vector_to_array(index.id_map)
+        vectors = faiss.downcast_index(index.index).reconstruct_n(0, index.ntotal)
+    else:
+        ids = np.arange(index.ntotal, dtype="int64")
+        vectors = index.reconstruct_n(0, index.ntotal)
+    order = np.argsort(ids, kind="stable")
+    return ids[order], vectors[order]
+
+
+def flat_vectors(index):
+    """
+    (ids, vectors) of an ID-mapped or plain flat index in storage order,
+    without copying the vectors: they are a view of the index's own
+    storage, valid only while the index is. Other indexes fall back to
+    stored_vectors().
+    """
+    mapped = faiss.downcast_index(index) if isinstance(index, faiss.IndexIDMap) else None
+    flat = faiss.downcast_index(mapped.index if mapped is not None else index)
+    if not isinstance(flat, faiss.IndexFlat):
+        return stored_vectors(index)
+    vectors = faiss.rev_swig_ptr(flat.get_xb(), flat.ntotal * flat.d).reshape(flat.ntotal, flat.d)
+    ids = faiss.vector_to_array(mapped.id_map) if mapped is not None else np.arange(flat.ntotal, dtype="int64")
+    return ids, vectors
+
+
+def as_id_mapped(index):
+    """
+    An ID-mapped exact index with the vectors of index, which can be updated
+    in place. Plain flat indexes (built before row ids were mapped) and ANN
+    indexes (rebuilt by index_tuning after the update) are converted.
+    """
+    mapped = index if isinstance(index, faiss.IndexIDMap2) else faiss.downcast_index(index)
+    if isinstance(mapped, faiss.IndexIDMap2) and isinstance(faiss.downcast_index(mapped.index), faiss.IndexFlat):
+        if mapped is not index:
+            # The downcast wrapper does not own the index: keep the owner alive
+            mapped.referenced_objects = [index]
+        return mapped
+    ids, vectors = stored_vectors(index)
+    return id_mapped_index(vectors, ids)
+
+
+def _comparable(entry):
+    return json.dumps(entry, sort_keys=True, default=str)
+
+
+class CatalogDiff:
+    """Row-level changes between the deployed metadata and a new catalog."""
+
+    def __init__(self):
+        self.added = []          # new entries, in catalog order
+        self.changed = []        # (row_id, entry) whose chunk text changed: re-embedded
+        self.updated = []        # (row_id, entry) whose other fields changed: no embedding
+        self.deleted = []        # row ids of products no longer in the catalog
+        self.unchanged = 0
+
+    def summary(self):
+        return {
+            "added": len(self.added),
+            "changed": len(self.changed),
+            "updated": len(self.updated),
+            "deleted": len(self.deleted),
+            "unchanged": self.unchanged
+        }
+
+    def to_embed(self):
+        """Entries that need new vectors: changed rows, then added ones."""
+        return [entry for _, entry in self.changed] + self.added
+
+
+def diff_catalog(previous, entries):
+    """
+    Compare the deployed metadata (list position = row id) with the new
+    catalog's entries. Products are matched by parent_asin; if an ASIN
+    appears more than once, the first occurrence wins on both sides.
+    """
+    diff = CatalogDiff()
+    previous_rows = {}
+    for row_id, entry in enumerate(previous):
+        if is_tombstone(entry):
+            continue
+        if entry["parent_asin"] in previous_rows:
+            diff.deleted.append(row_id)
+        else:
+            previous_rows[entry["parent_asin"]] = row_id
+
+    seen = set()
+    for entry in entries:
+        asin = entry["parent_asin"]
+        if asin in seen:
+            continue
+        seen.add(asin)
+        row_id = previous_rows.get(asin)
+        if row_id is None:
+            diff.added.append(entry)
+        elif previous[row_id]["chunk_text"] != entry["chunk_text"]:
+            diff.changed.append((row_id, entry))
+        elif _comparable(previous[row_id]) != _comparable(entry):
+            diff.updated.append((row_id, entry))
+        else:
+            diff.unchanged += 1
+
+    diff.deleted.extend(row_id for asin, row_id in previous_rows.items() if asin not in seen)
+    diff.deleted.sort()
+    return diff
+
+
+def apply_diff(index, previous, diff, vectors):
+    """
+    The updated (index, metadata). vectors holds the new embeddings for
+    diff.to_embed(), in that order. previous is not modified.
+    """
+    index = as_id_mapped(index)
+    metadata = list(previous)
+
+    changed_rows = [row_id for row_id, _ in diff.changed]
+    removed = np.array(diff.deleted + changed_rows, dtype="int64")
+    if len(removed):
+        index.remove_ids(removed)
+    for row_id in diff.deleted:
+        metadata[row_id] = tombstone()
+    for row_id, entry in diff.changed + diff.updated:
+        metadata[row_id] = entry
+
+    added_rows = list(range(len(metadata), len(metadata) + len(diff.added)))
+    metadata.extend(diff.added)
+    rows = np.array(changed_rows + added_rows, dtype="int64")
+    if len(rows):
+        index.add_with_ids(np.ascontiguousarray(vectors, dtype="float32"), rows)
+    return index, metadata
+
+
+def tombstone_count(metadata):
+    return sum(1 for entry in metadata if is_tombstone(entry))
+
+
+def compact(index, metadata):
+    """Drop tombstone rows and renumber the rest in order. No vector is re-embedded."""
+    live = [row_id for row_id, entry in enumerate(metadata) if not is_tombstone(entry)]
+    ids, vectors = stored_vectors(index)
+    if not np.array_equal(ids, np.array(live, dtype="int64")):
+        raise ValueError(f"index holds {len(ids)} vectors but metadata has {len(live)} live rows")
+    return id_mapped_index(vectors), [metadata[row_id] for row_id in live]
+
+
+def needs_compaction(metadata, compacted_at, now=None,
+                     ratio=INDEX_COMPACT_TOMBSTONE_RATIO, interval_hours=INDEX_COMPACT_INTERVAL_HOURS):
+    """
+    True if tombstones are more than ratio of the rows, or if there are
+    some and the last compaction (ISO time from the manifest) is older
+    than interval_hours.
+    """
+    tombstones = tombstone_count(metadata)
+    if not tombstones:
+        return False
+    if tombstones > ratio * len(metadata):
+        return True
+    if interval_hours <= 0:
+        return False
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    if not compacted_at:
+        return True
+    age = now - datetime.datetime.fromisoformat(compacted_at)
+    return age.total_seconds() > interval_hours * 3600
@@ -0,0 +1,483 @@
+"""
+Versioned FAISS index + metadata holder with zero-downtime reloads.
+
+A loaded index/metadata pair is an immutable IndexVersion. Requests take a
+reference to the current version once and use it until they finish, so a
+swap never changes the index under an in-flight request. New versions are
+staged into their own directory, checked (row counts, checksums) and only
+then swapped in. Workers on one instance share a staged version's directory
+(and so its mapped pages); it is removed once no live worker has it loaded.
+"""
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import faiss
+
+from metadata_store import open_metadata
+from lexical_index import LEXICAL_FILE, open_lexical_index
+from attribute_index import ATTRIBUTES_FILE, open_attribute_index
+from index_tuning import apply_search_params
+from memory_stats import log_memory
+
+INDEX_FILE = "faiss_index.index"
+METADATA_FILE = "index_metadata.json"
+METADATA_STORE_FILE = "index_metadata.db"
+MANIFEST_FILE = "index_manifest.json"
+ARTIFACT_FILES = (INDEX_FILE, METADATA_FILE, METADATA_STORE_FILE, LEXICAL_FILE, ATTRIBUTES_FILE, MANIFEST_FILE)
+REQUIRED_FILES = (INDEX_FILE, METADATA_FILE)
+
+# Map the index file read-only instead of copying it into each worker's heap
+FAISS_INDEX_MMAP = os.getenv("FAISS_INDEX_MMAP", "false").lower() == "true"
+# Where new versions come from: a local directory or gs://bucket/prefix/
+INDEX_SOURCE = os.getenv("INDEX_SOURCE")
+INDEX_POLL_SECONDS = float(os.getenv("INDEX_POLL_SECONDS", 0))  # 0 disables polling
+INDEX_STAGING_DIR = os.getenv("INDEX_STAGING_DIR", "/tmp/index_versions")
+INDEX_KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", 2))
+# Artifacts are downloaded under this prefix, then renamed into place
+INCOMING_PREFIX = ".incoming-"
+# A worker that loaded a staged version leaves <staging dir>/.loaded/<version>.<pid>;
+# outside the version, so that its mtime still orders versions by age
+LOADED_DIR = ".loaded"
+# Indexes built before manifests recorded an embedder all used this one
+LEGACY_EMBEDDER = "openai:text-embedding-3-small"
+
+
+class IndexValidationError(Exception):
+    pass
+
+
+class EmbedderMismatchError(IndexValidationError):
+    """The index was built by a different embedder than the one querying it."""
+
+
+def load_faiss_index(path, mmap=FAISS_INDEX_MMAP):
+    if mmap:
+        # IO_FLAG_MMAP_IFC also maps flat codes (IndexFlat*), older FAISS only maps IVF lists
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        return faiss.read_index(path, flags)
+    return faiss.read_index(path)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_manifest(directory, row_count, **extra):
+    """
+    Record the row count and a checksum of every artifact file, so a loader
+    can tell that the index and metadata belong together and arrived intact.
+    """
+    checksums = {
+        name: file_sha256(os.path.join(directory, name))
+        for name in ARTIFACT_FILES
+        if name != MANIFEST_FILE and os.path.exists(os.path.join(directory, name))
+    }
+    combined = hashlib.sha256(json.dumps(checksums, sort_keys=True).encode("utf-8")).hexdigest()
+    created_at = datetime.datetime.now(datetime.timezone.utc)
+
+    manifest = {
+        "version": f"{created_at:%Y%m%dT%H%M%S}-{combined[:8]}",
+        "created_at": created_at.isoformat(),
+        "row_count": row_count,
+        "files": checksums
+    }
+    manifest.update(extra)
+    with open(os.path.join(directory, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def publish_artifacts(build_dir, directory):
+    """
+    Move the artifacts written to build_dir (on the same filesystem) into
+    directory, the manifest last: until it lands, loaders in directory see
+    the previous manifest, whose checksums the new files fail.
+    """
+    names = [name for name in ARTIFACT_FILES if os.path.exists(os.path.join(build_dir, name))]
+    if MANIFEST_FILE not in names:
+        raise IndexValidationError(f"{MANIFEST_FILE} missing from {build_dir}")
+    names.remove(MANIFEST_FILE)
+    for name in names + [MANIFEST_FILE]:
+        os.replace(os.path.join(build_dir, name), os.path.join(directory, name))
+    shutil.rmtree(build_dir, ignore_errors=True)
+
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def manifest_embedder(manifest):
+    return (manifest or {}).get("embedder", LEGACY_EMBEDDER)
+
+
+def check_embedder(manifest, embedder_name):
+    """Raise EmbedderMismatchError unless the index was built by embedder_name."""
+    built_with = manifest_embedder(manifest)
+    if embedder_name and built_with != embedder_name:
+        raise EmbedderMismatchError(
+            f"index was built with {built_with} but queries are embedded with {embedder_name}; "
+            "rebuild the index or set EMBEDDER to match"
+        )
+
+
+def local_fingerprint(directory):
+    """Cheap change detector for a local artifact directory (size + mtime)."""
+    parts = []
+    for name in ARTIFACT_FILES:
+        try:
+            st = os.stat(os.path.join(directory, name))
+            parts.append(f"{name}:{st.st_size}:{st.st_mtime_ns}")
+        except OSError:
+            continue
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+class IndexVersion:
+    """One loaded, validated index/metadata pair. Never mutated after creation."""
+
+    def __init__(self, index, metadata, version, directory, manifest=None, lexical=None, attributes=None):
+        self.index = index
+        self.metadata = metadata
+        # BM25 and attribute indexes, None for versions built without them
+        self.lexical = lexical
+        self.attributes = attributes
+        self.version = version
+        self.directory = directory
+        self.manifest = manifest or {}
+        self.embedder = manifest_embedder(self.manifest)
+        self.loaded_at = time.time()
+
+
+def load_index_version(directory, mmap=FAISS_INDEX_MMAP, verify_checksums=True, embedder_name=None):
+    """
+    Load and validate the artifacts in directory. Raises IndexValidationError,
+    including when embedder_name is given and did not build the index.
+    """
+    for name in REQUIRED_FILES:
+        if not os.path.exists(os.path.join(directory, name)):
+            raise IndexValidationError(f"{name} missing from {directory}")
+
+    manifest = read_manifest(directory)
+    check_embedder(manifest, embedder_name)
+    if manifest and verify_checksums:
+        for name, expected in manifest.get("files", {}).items():
+            path = os.path.join(directory, name)
+            if not os.path.exists(path):
+                raise IndexValidationError(f"{name} listed in manifest but missing from {directory}")
+            if file_sha256(path) != expected:
+                raise IndexValidationError(f"checksum mismatch for {name} in {directory}")
+
+    index = load_faiss_index(os.path.join(directory, INDEX_FILE), mmap=mmap)
+    # nprobe / efSearch chosen by the build's tuning (see index_tuning)
+    apply_search_params(index, (manifest or {}).get("ann", {}).get("params"))
+    metadata = open_metadata(os.path.join(directory, METADATA_STORE_FILE), os.path.join(directory, METADATA_FILE))
+
+    # Incrementally updated indexes keep tombstone rows: metadata, BM25 and
+    # attribute rows are indexed by row id, only live rows have a vector
+    rows = len(metadata)
+    live_rows = (manifest or {}).get("live_rows", rows)
+    if index.ntotal != live_rows:
+        raise IndexValidationError(f"index has {index.ntotal} vectors but metadata has {live_rows} rows")
+    if manifest and manifest.get("row_count") not in (None, rows):
+        raise IndexValidationError(f"manifest expects {manifest['row_count']} rows, metadata has {rows}")
+    if manifest and manifest.get("embedding_dim") not in (None, index.d):
+        raise IndexValidationError(f"manifest expects {manifest['embedding_dim']}-dim vectors, index has {index.d}")
+
+    lexical = open_lexical_index(os.path.join(directory, LEXICAL_FILE))
+    if lexical is not None and len(lexical) != rows:
+        raise IndexValidationError(f"metadata has {rows} rows but lexical index has {len(lexical)} docs")
+    attributes = open_attribute_index(os.path.join(directory, ATTRIBUTES_FILE))
+    if attributes is not None and len(attributes) != rows:
+        raise IndexValidationError(f"metadata has {rows} rows but attribute index has {len(attributes)} rows")
+
+    version = manifest["version"] if manifest else f"local-{local_fingerprint(directory)}"
+    return IndexVersion(index, metadata, version, directory, manifest, lexical=lexical, attributes=attributes)
+
+
+class IndexHolder:
+    def __init__(self, initial_dir=None, source=INDEX_SOURCE, staging_dir=INDEX_STAGING_DIR,
+                 keep_versions=INDEX_KEEP_VERSIONS, embedder_name=None):
+        """
+        initial_dir is loaded on first use (or by warmup), not at construction,
+        so importing the app stays fast. With embedder_name set, versions
+        built by another embedder are refused.
+        """
+        self.initial_dir = initial_dir
+        self.embedder_name = embedder_name
+        self.source = source
+        self.staging_dir = staging_dir
+        self.keep_versions = keep_versions
+
+        self._current = None
+        self._reload_lock = threading.Lock()
+        self._source_fingerprint = None
+        self._poller = None
+        self.last_error = None
+
+    def current(self):
+        """The version new requests should use. Grab it once per request."""
+        version = self._current
+        if version is None:
+            version = self._load_initial()
+        return version
+
+    def loaded(self):
+        """The current version, or None if nothing is loaded yet. Never loads."""
+        return self._current
+
+    def _load_initial(self):
+        with self._reload_lock:
+            if self._current is None:
+                if not self.initial_dir:
+                    raise RuntimeError("No FAISS index loaded")
+                self.load(self.initial_dir)
+        return self._current
+
+    def swap(self, new_version):
+        old = self._current
+        self._current = new_version  # single reference assignment, atomic for readers
+        print(f"Index version {old.version if old else None} -> {new_version.version} ({new_version.index.ntotal} vectors)")
+        return old
+
+    def load(self, directory, **kwargs):
+        kwargs.setdefault("embedder_name", self.embedder_name)
+        new_version = load_index_version(directory, **kwargs)
+        self.swap(new_version)
+        log_memory(f"index {new_version.version} loaded ({new_version.index.ntotal} vectors, mmap={FAISS_INDEX_MMAP})")
+        return new_version
+
+    def source_fingerprint(self, source=None):
+        source = source or self.source
+        if source.startswith("gs://"):
+            from gcs_helper import get_blob_fingerprint
+            bucket_name, prefix = parse_gcs_uri(source)
+            parts = [get_blob_fingerprint(bucket_name, prefix + name) for name in ARTIFACT_FILES]
+            return hashlib.sha256("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:16]
+        return local_fingerprint(source)
+
+    def source_version(self, source=None):
+        """The manifest version of the artifacts at source, or None without a manifest."""
+        source = source or self.source
+        if source.startswith("gs://"):
+            from gcs_helper import check_if_blob_exists, download_blob_to_file
+            bucket_name, prefix = parse_gcs_uri(source)
+            if not check_if_blob_exists(bucket_name, prefix + MANIFEST_FILE):
+                return None
+            with tempfile.TemporaryDirectory() as tmp:
+                download_blob_to_file(bucket_name, prefix + MANIFEST_FILE, os.path.join(tmp, MANIFEST_FILE))
+                manifest = read_manifest(tmp)
+        else:
+            manifest = read_manifest(source)
+        return manifest.get("version") if manifest else None
+
+    def stage(self, source=None):
+        """
+        The staged directory of the artifacts at source, shared by every
+        worker: staging_dir/<source fingerprint>. The first worker downloads
+        them into a private temporary directory and renames it into place, so
+        a version directory is complete once it exists, and no file that is
+        (or may be) mapped is ever written to. Later workers reuse it.
+        """
+        source = source or self.source
+        fingerprint = self.source_fingerprint(source)
+        target = os.path.join(self.staging_dir, fingerprint)
+        if os.path.isdir(target):
+            return target, fingerprint
+
+        os.makedirs(self.staging_dir, exist_ok=True)
+        incoming = tempfile.mkdtemp(dir=self.staging_dir, prefix=f"{INCOMING_PREFIX}{os.getpid()}-")
+        try:
+            if source.startswith("gs://"):
+                from gcs_helper import check_if_blob_exists, download_blob_to_file
+                bucket_name, prefix = parse_gcs_uri(source)
+                for name in ARTIFACT_FILES:
+                    if check_if_blob_exists(bucket_name, prefix + name):
+                        download_blob_to_file(bucket_name, prefix + name, os.path.join(incoming, name))
+            else:
+                for name in ARTIFACT_FILES:
+                    path = os.path.join(source, name)
+                    if os.path.exists(path):
+                        shutil.copy2(path, os.path.join(incoming, name))
+            try:
+                os.rename(incoming, target)
+            except OSError:
+                if not os.path.isdir(target):
+                    raise
+                # Another worker published the same version first
+                shutil.rmtree(incoming, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(incoming, ignore_errors=True)
+            raise
+        return target, fingerprint
+
+    def reload(self, source=None):
+        """
+        Stage, validate and swap in the artifacts from source. Concurrent
+        callers are serialized. Returns the new IndexVersion; on failure the
+        current version stays in place and the error is raised.
+        """
+        source = source or self.source
+        if not source:
+            raise ValueError("No index source configured (set INDEX_SOURCE)")
+
+        with self._reload_lock:
+            target, fingerprint = self.stage(source)
+            old = self._current
+            try:
+                new_version = self.load(target)
+            except Exception as e:
+                self.last_error = str(e)
+                # Restaged on the next attempt, unless a worker runs it after all
+                if not live_loaders(target):
+                    shutil.rmtree(target, ignore_errors=True)
+                raise
+            mark_loaded(target)
+            if old is not None and os.path.abspath(old.directory) != os.path.abspath(target):
+                unmark_loaded(old.directory)
+            self._source_fingerprint = fingerprint
+            self.last_error = None
+            self._cleanup_staging()
+            return new_version
+
+    def reload_in_background(self, source=None):
+        def run():
+            try:
+                self.reload(source)
+            except Exception as e:
+                print("Index reload failed:", e)
+
+        thread = threading.Thread(target=run, name="index-reload", daemon=True)
+        thread.start()
+        return thread
+
+    def check_for_update(self):
+        """Reload if the source changed since the last reload. Returns True if swapped."""
+        fingerprint = self.source_fingerprint()
+        if self._source_fingerprint is None:
+            # First look at the source: the startup load came from initial_dir,
+            # which is only current if it holds the same version
+            current = self._current
+            if current is not None and self.source_version() == current.version:
+                self._source_fingerprint = fingerprint
+                return False
+            self.reload()
+            return True
+        if fingerprint == self._source_fingerprint:
+            return False
+        self.reload()
+        return True
+
+    def start_polling(self, interval=INDEX_POLL_SECONDS):
+        """
+        Poll the source in a daemon thread. Call this in each worker after
+        fork (gunicorn post_worker_init), never in a preloading master.
+        """
+        if not self.source or interval <= 0 or self._poller is not None:
+            return None
+
+        def poll():
+            while True:
+                try:
+                    self.check_for_update()
+                except Exception as e:
+                    self.last_error = str(e)
+                    print("Index poll failed:", e)
+                time.sleep(interval)
+
+        self._poller = threading.Thread(target=poll, name="index-poller", daemon=True)
+        self._poller.start()
+        return self._poller
+
+    def _cleanup_staging(self):
+        """
+        Drop the staged versions no live worker has loaded, except the newest
+        keep_versions, and downloads whose worker exited (or, for this
+        worker, that were interrupted: reloads hold the lock).
+        """
+        if not os.path.isdir(self.staging_dir):
+            return
+        staged = []
+        for name in os.listdir(self.staging_dir):
+            path = os.path.join(self.staging_dir, name)
+            if name.startswith(INCOMING_PREFIX):
+                pid = name[len(INCOMING_PREFIX):].split("-")[0]
+                if not pid.isdigit() or int(pid) == os.getpid() or not process_alive(int(pid)):
+                    shutil.rmtree(path, ignore_errors=True)
+            elif not name.startswith(".") and os.path.isdir(path):
+                staged.append(path)
+
+        staged.sort(key=os.path.getmtime, reverse=True)
+        # Old directories can go even if a straggler request still maps them:
+        # an unlinked mmapped file stays readable until it is unmapped
+        for path in staged[self.keep_versions:]:
+            if not live_loaders(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+
+def _loaded_marker(directory, pid):
+    staging_dir, version = os.path.split(os.path.abspath(directory))
+    return os.path.join(staging_dir, LOADED_DIR, f"{version}.{pid}")
+
+
+def mark_loaded(directory, pid=None):
+    marker = _loaded_marker(directory, pid or os.getpid())
+    os.makedirs(os.path.dirname(marker), exist_ok=True)
+    open(marker, "w").close()
+
+
+def unmark_loaded(directory, pid=None):
+    try:
+        os.remove(_loaded_marker(directory, pid or os.getpid()))
+    except OSError:
+        pass
+
+
+def live_loaders(directory):
+    """Pids of the running workers that have directory loaded. Markers of exited ones are removed."""
+    markers = os.path.dirname(_loaded_marker(directory, 0))
+    version = os.path.basename(os.path.abspath(directory))
+    pids = []
+    try:
+        names = os.listdir(markers)
+    except OSError:
+        return pids
+    for name in names:
+        marked, _, pid = name.rpartition(".")
+        if marked == version and pid.isdigit():
+            if process_alive(int(pid)):
+                pids.append(int(pid))
+            else:
+                unmark_loaded(directory, pid)
+    return pids
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def parse_gcs_uri(uri):
+    """gs://bucket/some/prefix -> ("bucket", "some/prefix/")"""
+    bucket_name, _, prefix = uri[len("gs://"):].partition("/")
+    if prefix and not prefix.endswith("/"):
+        prefix += "/"
+    return bucket_name, prefix
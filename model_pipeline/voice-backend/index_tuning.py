@@ -0,0 +1,283 @@
+"""
+ANN index selection for index builds.
+
+select_ann_index() picks the FAISS index a build ships, in two steps.
+
+tune_index() ranks the candidates on at most INDEX_TUNING_MAX_ROWS vectors
+(a random sample of larger catalogs, so tuning memory stays bounded). Some
+of them are held out as queries, and each candidate is built over the rest
+and measured against exact search:
+
+- IVF-Flat with nlist = IVF_NLIST_FACTORS * sqrt(n), at each of NPROBES
+- HNSW-Flat with M in HNSW_MS, at each of EF_SEARCHES
+
+A setting qualifies when its recall@k reaches INDEX_TARGET_RECALL and its p95
+single-query latency stays under INDEX_TARGET_P95_MS; qualifying settings are
+ranked by mean latency.
+
+The ranked settings are then built over the whole catalog, in order, and
+measured again on catalog queries. An IVF setting from a sample is first
+scaled to the catalog (scaled_config). The first one that still meets the
+targets at full size is shipped, with its full-size numbers. Exact search
+(Flat) is kept when none does, and for catalogs under INDEX_TUNING_MIN_ROWS.
+
+The choice is recorded in the manifest as "ann". load_index_version() applies
+its search parameters, and search_parameters() carries them (widened for
+selective filters) into filtered searches, whose typed SearchParameters would
+otherwise replace them with FAISS defaults.
+"""
+import math
+import os
+import time
+
+import faiss
+import numpy as np
+
+from incremental_index import flat_vectors, id_mapped_index
+from lexical_index import HYBRID_VECTOR_CANDIDATES
+
+INDEX_TUNING = os.getenv("INDEX_TUNING", "true").lower() == "true"
+INDEX_TUNING_MIN_ROWS = int(os.getenv("INDEX_TUNING_MIN_ROWS", 20000))
+INDEX_TUNING_QUERIES = int(os.getenv("INDEX_TUNING_QUERIES", 500))
+# Vectors the candidates are built and measured over (a random sample of the catalog)
+INDEX_TUNING_MAX_ROWS = int(os.getenv("INDEX_TUNING_MAX_ROWS", 50000))
+# Rows the ANN stage has to find: the hybrid search's vector candidates by default
+INDEX_TUNING_K = int(os.getenv("INDEX_TUNING_K", HYBRID_VECTOR_CANDIDATES))
+INDEX_TARGET_RECALL = float(os.getenv("INDEX_TARGET_RECALL", 0.95))
+INDEX_TARGET_P95_MS = float(os.getenv("INDEX_TARGET_P95_MS", 5.0))
+
+IVF_NLIST_FACTORS = (2, 4, 8)
+NPROBES = (1, 2, 4, 8, 16, 32, 64, 128)
+HNSW_MS = (16, 32, 48)
+EF_SEARCHES = (16, 32, 64, 128, 256)
+HNSW_EF_CONSTRUCTION = 80
+# IVF needs about 39 training points per list; more than this adds little
+MIN_POINTS_PER_LIST = 39
+MAX_TRAIN_SIZE = 100000
+# Upper bound on efSearch when a filter widens an HNSW search
+MAX_FILTERED_EF_SEARCH = 1024
+
+FLAT = {"type": "flat", "factory": "Flat", "params": {}}
+
+
+def recall_at_k(found, exact):
+    k = exact.shape[1]
+    return float(np.mean([len(set(f[:k]) & set(e)) / k for f, e in zip(found.tolist(), exact.tolist())]))
+
+
+def latency_ms(seconds):
+    p50, p95, p99 = np.percentile(seconds, [50, 95, 99]) * 1000
+    return {"p50": round(float(p50), 4), "p95": round(float(p95), 4), "p99": round(float(p99), 4),
+            "mean": round(float(np.mean(seconds)) * 1000, 4)}
+
+
+def candidate_structures(n):
+    """[(type, factory string, search parameter, values to sweep)] worth building for n vectors."""
+    candidates = []
+    nlists = sorted({min(int(f * math.sqrt(n)), n // MIN_POINTS_PER_LIST) for f in IVF_NLIST_FACTORS})
+    for nlist in nlists:
+        if nlist >= 2:
+            candidates.append(("ivf", f"IVF{nlist},Flat", "nprobe", [p for p in NPROBES if p <= nlist]))
+    for m in HNSW_MS:
+        candidates.append(("hnsw", f"HNSW{m}", "efSearch", list(EF_SEARCHES)))
+    return candidates
+
+
+def ivf_nlist(config):
+    return int(config["factory"][len("IVF"):].split(",")[0])
+
+
+def scaled_config(config, scale, n):
+    """
+    config, tuned on a sample, for scale times as many (n) vectors: IVF
+    keeps its list size and the share of lists it probes, but no more lists
+    than its training sample (MAX_TRAIN_SIZE) can fill. HNSW is unchanged.
+    """
+    if config["type"] != "ivf" or scale == 1:
+        return config
+    nlist = ivf_nlist(config)
+    max_nlist = min(n, MAX_TRAIN_SIZE) // MIN_POINTS_PER_LIST
+    scaled_nlist = max(nlist, min(int(round(nlist * scale)), max_nlist))
+    nprobe = min(scaled_nlist, max(1, int(round(config["params"]["nprobe"] * scaled_nlist / nlist))))
+    return {"type": "ivf", "factory": f"IVF{scaled_nlist},Flat", "params": dict(config["params"], nprobe=nprobe)}
+
+
+def apply_search_params(index, params):
+    """Set search parameters (nprobe, efSearch) on index, through any ID map."""
+    space = faiss.ParameterSpace()
+    for name, value in (params or {}).items():
+        space.set_index_parameter(index, name, value)
+
+
+def build_ann_index(vectors, ids, config, rng=None):
+    """An IndexIDMap2 (FAISS id = row id) of the configured type over vectors, search parameters set."""
+    if config["type"] == "flat":
+        return id_mapped_index(vectors, ids)
+    rng = rng or np.random.default_rng(0)
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    inner = faiss.index_factory(vectors.shape[1], config["factory"], faiss.METRIC_L2)
+    if config["type"] == "hnsw":
+        inner.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    if not inner.is_trained:
+        n = len(vectors)
+        sample = vectors if n <= MAX_TRAIN_SIZE else vectors[np.sort(rng.choice(n, MAX_TRAIN_SIZE, replace=False))]
+        inner.train(sample)
+    index = faiss.IndexIDMap2(inner)
+    index.add_with_ids(vectors, np.asarray(ids, dtype="int64"))
+    if config["type"] == "ivf":
+        # Lets vector_distances() reconstruct rows the ANN search did not return
+        faiss.extract_index_ivf(index).make_direct_map()
+    apply_search_params(index, config["params"])
+    return index
+
+
+def time_queries(index, queries, k):
+    """Per-query latencies (seconds) and the top-k ids of one search per query, as serving sends them."""
+    seconds = np.empty(len(queries))
+    found = np.empty((len(queries), k), dtype="int64")
+    for i in range(len(queries)):
+        started = time.perf_counter()
+        _, I = index.search(queries[i:i + 1], k)
+        seconds[i] = time.perf_counter() - started
+        found[i] = I[0]
+    return seconds, found
+
+
+def _measure(index, queries, exact, k, config):
+    seconds, found = time_queries(index, queries, k)
+    return dict(config, recall_at_k=round(recall_at_k(found, exact), 4), latency_ms=latency_ms(seconds))
+
+
+def _qualifies(result, target_recall, target_p95_ms):
+    return result["recall_at_k"] >= target_recall and result["latency_ms"]["p95"] <= target_p95_ms
+
+
+def tune_index(vectors, k=INDEX_TUNING_K, target_recall=INDEX_TARGET_RECALL, target_p95_ms=INDEX_TARGET_P95_MS,
+               n_queries=INDEX_TUNING_QUERIES, max_rows=INDEX_TUNING_MAX_ROWS, seed=0):
+    """
+    (ranked, measurements): the settings that meet the targets on (a sample
+    of at most max_rows of) vectors, lowest mean latency first, and every
+    setting that was measured. Each is {"type", "factory", "params"} plus
+    its measured recall and latency and the rows it was measured over.
+    """
+    n = len(vectors)
+    rng = np.random.default_rng(seed)
+    if n > max_rows > 0:
+        print(f"Tuning on a sample of {max_rows} of {n} vectors")
+        vectors = vectors[np.sort(rng.choice(n, max_rows, replace=False))]
+    n_tuned = len(vectors)
+    held_out = np.zeros(n_tuned, dtype=bool)
+    held_out[rng.choice(n_tuned, min(n_queries, n_tuned // 2), replace=False)] = True
+    queries = np.ascontiguousarray(vectors[held_out], dtype="float32")
+    base = np.ascontiguousarray(vectors[~held_out], dtype="float32")
+    del vectors
+    k = min(k, len(base))
+    exact = faiss.knn(queries, base, k)[1]
+
+    flat = faiss.IndexFlatL2(base.shape[1])
+    flat.add(base)
+    measurements = [dict(_measure(flat, queries, exact, k, FLAT), rows=len(base))]
+    del flat
+
+    for index_type, factory, param, values in candidate_structures(len(base)):
+        config = {"type": index_type, "factory": factory, "params": {}}
+        started = time.perf_counter()
+        index = build_ann_index(base, np.arange(len(base)), config, rng)
+        build_seconds = round(time.perf_counter() - started, 3)
+        for value in values:
+            config = {"type": index_type, "factory": factory, "params": {param: value}}
+            apply_search_params(index, config["params"])
+            result = _measure(index, queries, exact, k, config)
+            result.update(build_seconds=build_seconds, rows=len(base))
+            measurements.append(result)
+            _report(result, k)
+            # Wider searches only cost more from here on
+            if result["recall_at_k"] >= target_recall:
+                break
+        del index
+
+    qualifying = [r for r in measurements if _qualifies(r, target_recall, target_p95_ms)]
+    return sorted(qualifying, key=lambda r: r["latency_ms"]["mean"]), measurements
+
+
+def _report(result, k):
+    print(f"{result['factory']:<14} {result['params']} rows={result['rows']} recall@{k}={result['recall_at_k']:.3f} "
+          f"p95={result['latency_ms']['p95']:.3f}ms mean={result['latency_ms']['mean']:.3f}ms")
+
+
+def without_self(found, own_ids, k):
+    """The first k ids of each row of found other than the query's own."""
+    return np.array([[i for i in row if i != own][:k] for row, own in zip(found.tolist(), own_ids.tolist())])
+
+
+def select_ann_index(index, k=INDEX_TUNING_K, target_recall=INDEX_TARGET_RECALL, target_p95_ms=INDEX_TARGET_P95_MS,
+                     n_queries=INDEX_TUNING_QUERIES, min_rows=INDEX_TUNING_MIN_ROWS, max_rows=INDEX_TUNING_MAX_ROWS,
+                     seed=0):
+    """
+    (index, config, measurements) for the exact ID-mapped index of a build:
+    the first setting ranked by tune_index() that still meets the targets
+    once built over every vector, or index itself (Flat). config carries
+    the full-size recall and latency, and "sample", what tuning measured.
+    Catalog rows are the full-size queries, each scored without itself.
+    """
+    targets = {"k": k, "recall_at_k": target_recall, "p95_ms": target_p95_ms}
+    n = index.ntotal
+    if not INDEX_TUNING or n < max(min_rows, 2):
+        return index, dict(FLAT, targets=targets), []
+
+    # A view of the exact index's storage: tuning samples it, an ANN index copies it once
+    ids, vectors = flat_vectors(index)
+    ranked, measurements = tune_index(vectors, k, target_recall, target_p95_ms, n_queries, max_rows, seed)
+
+    rows = np.sort(np.random.default_rng(seed + 1).choice(n, min(n_queries, n), replace=False))
+    queries = np.ascontiguousarray(vectors[rows], dtype="float32")
+    own_ids = ids[rows]
+    k = min(k, n - 1)
+    exact = without_self(index.search(queries, k + 1)[1], own_ids, k)
+
+    def measure(candidate, config, sample=None):
+        seconds, found = time_queries(candidate, queries, k + 1)
+        result = dict(config, recall_at_k=round(recall_at_k(without_self(found, own_ids, k), exact), 4),
+                      latency_ms=latency_ms(seconds), rows=n)
+        if sample is not None:
+            result["sample"] = {key: sample[key] for key in ("factory", "params", "rows", "recall_at_k", "latency_ms")}
+        measurements.append(result)
+        _report(result, k)
+        return result
+
+    exact_result = None
+    for tuned in ranked:
+        config = scaled_config({key: tuned[key] for key in FLAT}, n / tuned["rows"], n)
+        candidate = index if config["type"] == "flat" else build_ann_index(vectors, ids, config)
+        result = measure(candidate, config, tuned)
+        if _qualifies(result, target_recall, target_p95_ms):
+            return candidate, dict(result, targets=targets), measurements
+        print(f"{config['factory']} {config['params']} misses the targets over all {n} vectors")
+        if config["type"] == "flat":
+            exact_result = result
+        del candidate
+
+    print(f"No index meets recall@{k} >= {target_recall} and p95 <= {target_p95_ms}ms, keeping exact search")
+    return index, dict(exact_result or measure(index, FLAT), targets=targets), measurements
+
+
+def search_parameters(index, selection):
+    """
+    SearchParameters restricting index to selection (an attribute_index
+    Selection), or None without one. IVF and HNSW need their own parameter
+    types, with the index's nprobe/efSearch, widened in proportion to how
+    few rows the filter keeps so that enough of them are visited.
+    """
+    if selection is None:
+        return None
+    widen = selection.n_rows / max(1, selection.count)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        nprobe = min(ivf.nlist, int(math.ceil(ivf.nprobe * widen)))
+        return faiss.SearchParametersIVF(sel=selection.selector, nprobe=nprobe)
+
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        ef = min(MAX_FILTERED_EF_SEARCH, max(inner.hnsw.efSearch, int(math.ceil(inner.hnsw.efSearch * widen))))
+        return faiss.SearchParametersHNSW(sel=selection.selector, efSearch=ef)
+    return selection.params
@@ -0,0 +1,199 @@
+"""
+BM25 inverted index over the chunk texts, built next to the FAISS index.
+
+Dense search blurs exact names ("Office 2019", "Norton 360"), the lexical
+path catches them. The index is one memory-mapped flat_arrays file, so all
+workers share its pages and nothing is rebuilt at load time:
+
+- term_hashes  uint64[V]    sorted 64-bit hashes of the vocabulary
+- offsets      uint64[V+1]  postings of term i are [offsets[i], offsets[i+1])
+- doc_ids      uint32[P]    FAISS row ids
+- weights      float32[P]   precomputed BM25 impact of the term in the doc
+
+A query is a binary search per term plus a sum over its postings, so it
+takes microseconds and never touches the chunk texts.
+"""
+import hashlib
+import os
+import re
+
+import numpy as np
+
+from flat_arrays import write_arrays, read_arrays
+
+LEXICAL_FILE = "lexical_index.bin"
+MAGIC = b"BM25IDX1"
+
+BM25_K1 = float(os.getenv("BM25_K1", 1.2))
+BM25_B = float(os.getenv("BM25_B", 0.75))
+# Hybrid retrieval: fuse BM25 and FAISS rankings when the index ships a lexical file
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+# Candidates taken from each path before fusion; the ANN stage can stay small
+# because exact-name matches come in through the lexical path
+HYBRID_VECTOR_CANDIDATES = int(os.getenv("HYBRID_VECTOR_CANDIDATES", 8))
+HYBRID_LEXICAL_CANDIDATES = int(os.getenv("HYBRID_LEXICAL_CANDIDATES", 8))
+RRF_K = int(os.getenv("RRF_K", 60))
+
+# Keeps version strings like "2.1" and model numbers like "x-1000" in one token
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how i in is it its me my of on or "
+    "that the this to was what which with you your does do can".split()
+)
+
+
+def tokenize(text):
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def term_hash(term):
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class LexicalIndexWriter:
+    """
+    Builds the BM25 index from texts added in blocks (doc ids continue from
+    one add() to the next). Postings are kept as compact numpy blocks, not
+    Python objects, and weighted once the corpus statistics are known.
+    """
+
+    def __init__(self, path, k1=BM25_K1, b=BM25_B):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.n_docs = 0
+        self._lengths = []
+        self._hashes = []
+        self._doc_ids = []
+        self._tfs = []
+
+    def add(self, texts):
+        hashes, doc_ids, tfs = [], [], []
+        lengths = np.zeros(len(texts), dtype="float32")
+        for i, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[i] = len(tokens)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                hashes.append(term_hash(token))
+                doc_ids.append(self.n_docs + i)
+                tfs.append(tf)
+        self._lengths.append(lengths)
+        self._hashes.append(np.array(hashes, dtype="uint64"))
+        self._doc_ids.append(np.array(doc_ids, dtype="uint32"))
+        self._tfs.append(np.array(tfs, dtype="float32"))
+        self.n_docs += len(texts)
+
+    def close(self):
+        """Write the index. Returns (terms, postings)."""
+        k1, b = self.k1, self.b
+        doc_lengths = np.concatenate(self._lengths) if self._lengths else np.zeros(0, dtype="float32")
+        hashes = np.concatenate(self._hashes) if self._hashes else np.zeros(0, dtype="uint64")
+        doc_ids = np.concatenate(self._doc_ids) if self._doc_ids else np.zeros(0, dtype="uint32")
+        tfs = np.concatenate(self._tfs) if self._tfs else np.zeros(0, dtype="float32")
+        self._lengths, self._hashes, self._doc_ids, self._tfs = [], [], [], []
+
+        # Postings of a term are contiguous and in doc id order
+        order = np.lexsort((doc_ids, hashes))
+        hashes, doc_ids, tfs = hashes[order], doc_ids[order], tfs[order].astype("float64")
+        term_hashes, starts, doc_freqs = np.unique(hashes, return_index=True, return_counts=True)
+        offsets = np.zeros(len(term_hashes) + 1, dtype="uint64")
+        offsets[1:] = starts.astype("uint64") + doc_freqs.astype("uint64")
+
+        n_docs = self.n_docs
+        avg_length = float(doc_lengths.mean()) if n_docs else 0.0
+        idf = np.log(1.0 + (n_docs - doc_freqs + 0.5) / (doc_freqs + 0.5))
+        if avg_length:
+            norm = k1 * (1.0 - b + b * doc_lengths[doc_ids].astype("float64") / avg_length)
+        else:
+            norm = np.full(len(tfs), k1)
+        weights = np.repeat(idf, doc_freqs) * tfs * (k1 + 1.0) / (tfs + norm)
+
+        arrays = {
+            "term_hashes": term_hashes.astype("uint64"),
+            "offsets": offsets,
+            "doc_ids": doc_ids.astype("uint32"),
+            "weights": weights.astype("float32")
+        }
+        write_arrays(self.path, MAGIC, arrays, {"n_docs": n_docs, "k1": k1, "b": b, "avg_doc_length": avg_length})
+        return len(term_hashes), len(doc_ids)
+
+    def abort(self):
+        """Drop the rows added so far, and a file close() left half-written."""
+        self._lengths, self._hashes, self._doc_ids, self._tfs = [], [], [], []
+        if os.path.exists(f"{self.path}.tmp"):
+            os.remove(f"{self.path}.tmp")
+
+
+def build_lexical_index(path, texts, k1=BM25_K1, b=BM25_B):
+    """Write the BM25 index for texts (list position = FAISS row id) to path."""
+    writer = LexicalIndexWriter(path, k1, b)
+    writer.add(texts)
+    return writer.close()
+
+
+class LexicalIndex:
+    """Read-only BM25 index over a memory-mapped file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.params, arrays = read_arrays(path, MAGIC)
+        self.n_docs = self.params["n_docs"]
+        self.term_hashes = arrays["term_hashes"]
+        self.offsets = arrays["offsets"]
+        self.doc_ids = arrays["doc_ids"]
+        self.weights = arrays["weights"]
+
+    def __len__(self):
+        return self.n_docs
+
+    def _postings(self, term):
+        h = np.uint64(term_hash(term))
+        i = int(np.searchsorted(self.term_hashes, h))
+        if i == len(self.term_hashes) or self.term_hashes[i] != h:
+            return None
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.doc_ids[start:end], self.weights[start:end]
+
+    def search(self, query, k, allowed=None):
+        """
+        (doc_ids, scores) of the k best BM25 matches, best first. allowed
+        (an attribute_index.Selection) restricts the matches to its rows.
+        """
+        found = [p for p in (self._postings(term) for term in set(tokenize(query))) if p is not None]
+        if not found:
+            return np.zeros(0, dtype="int64"), np.zeros(0, dtype="float32")
+
+        docs = np.concatenate([ids for ids, _ in found])
+        unique_docs, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate([w for _, w in found]))
+        if allowed is not None:
+            keep = allowed.contains(unique_docs)
+            unique_docs, scores = unique_docs[keep], scores[keep]
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.lexsort((unique_docs[top], -scores[top]))]
+        return unique_docs[top].astype("int64"), scores[top].astype("float32")
+
+
+def open_lexical_index(path):
+    """The LexicalIndex at path, or None if this index version has none."""
+    if not os.path.exists(path):
+        return None
+    return LexicalIndex(path)
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Fuse ranked id lists: score(id) = sum of 1 / (k + rank) over the lists
+    it appears in. Returns [(id, score)] best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
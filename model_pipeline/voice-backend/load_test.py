@@ -0,0 +1,354 @@
+"""
+Load generator for /chat and /chat/stream.
+
+Runs a closed-loop load (N concurrent clients, each sending its next
+question as soon as the previous answer is in) for every concurrency level,
+and reports throughput, p50/p95/p99 latency, error rates and the per-stage
+breakdown from the server's /metrics. For /chat/stream it also reports the
+time to the first spoken sentence.
+
+With --launch it starts mock_openai_server.py and then the backend itself,
+once per worker/thread setting, so capacity can be measured without real
+OpenAI calls:
+
+    python load_test.py --launch gunicorn --workers 1,2 --threads 4,8 \\
+        --concurrency 1,8,32 --duration 30 --output load_results.json
+
+Against a server that is already running (pointed at the mock or not):
+
+    python load_test.py --url http://127.0.0.1:8080 --endpoint chat_stream --concurrency 4,16
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import numpy as np
+from prometheus_client.parser import text_string_to_metric_families
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ENDPOINTS = {"chat": "/chat", "chat_stream": "/chat/stream"}
+QUESTIONS = [
+    "What is the best antivirus software?",
+    "Is there a cheap photo editor under $20?",
+    "Tell me about Microsoft Office 2019",
+    "Which video editing software is good for beginners?",
+    "Do you have a top-rated password manager?",
+    "What tax software do you recommend?",
+    "Is Norton 360 worth it?",
+    "Recommend a music production program",
+    "Which PDF editor has the best reviews?",
+    "What language learning software do you have?"
+]
+
+
+class RequestLog:
+    def __init__(self):
+        self.latencies = []
+        self.first_sentence = []
+        self.statuses = {}
+        self.errors = 0
+
+    def record(self, status, latency, first_sentence=None, error=False):
+        self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+        self.errors += int(error)
+        if not error:
+            self.latencies.append(latency)
+            if first_sentence is not None:
+                self.first_sentence.append(first_sentence)
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": round(float(p50), 4), "p95": round(float(p95), 4), "p99": round(float(p99), 4),
+            "mean": round(float(np.mean(values)), 4)}
+
+
+def summarize(log, elapsed):
+    total = sum(log.statuses.values())
+    summary = {
+        "requests": total,
+        "duration_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(log.latencies) / elapsed, 3) if elapsed else 0.0,
+        "error_rate": round(log.errors / total, 4) if total else 0.0,
+        "statuses": log.statuses,
+        "latency_seconds": percentiles(log.latencies)
+    }
+    if log.first_sentence:
+        summary["first_sentence_seconds"] = percentiles(log.first_sentence)
+    return summary
+
+
+def question_stream(seed, repeat_ratio, questions):
+    """
+    Questions in a reproducible order. A repeat_ratio share of them are asked
+    verbatim (cache hits once seen); the rest are made unique (cache misses).
+    """
+    rng = random.Random(seed)
+    for i in itertools.count():
+        question = rng.choice(questions)
+        yield question if rng.random() < repeat_ratio else f"{question} (load test {seed}-{i})"
+
+
+async def send_chat(client, url, question):
+    started = time.perf_counter()
+    response = await client.post(url, json={"message": question})
+    return response.status_code, time.perf_counter() - started, None, response.status_code != 200
+
+
+async def send_chat_stream(client, url, question):
+    started = time.perf_counter()
+    first_sentence = None
+    error = False
+    async with client.stream("POST", url, json={"message": question}) as response:
+        event = None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+                if event == "sentence" and first_sentence is None:
+                    first_sentence = time.perf_counter() - started
+                elif event == "error":
+                    error = True
+        status = response.status_code
+    return status, time.perf_counter() - started, first_sentence, error or status != 200
+
+
+async def run_level(base_url, endpoint, concurrency, duration, max_requests, questions, timeout):
+    """One closed-loop run. Returns the RequestLog and the elapsed time."""
+    url = base_url.rstrip("/") + ENDPOINTS[endpoint]
+    send = send_chat_stream if endpoint == "chat_stream" else send_chat
+    log = RequestLog()
+    sent = itertools.count()
+    stop_at = time.perf_counter() + duration
+
+    async def user(client):
+        while time.perf_counter() < stop_at and (max_requests is None or next(sent) < max_requests):
+            question = next(questions)
+            try:
+                status, latency, first_sentence, error = await send(client, url, question)
+            except httpx.HTTPError as e:
+                status, latency, first_sentence, error = type(e).__name__, None, None, True
+            log.record(status, latency, first_sentence, error)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(user(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return log, elapsed
+
+
+def scrape_stages(base_url):
+    """{stage: (count, sum, {le: cumulative count})} from the server's rag_stage_seconds histogram."""
+    stages = {}
+    try:
+        text = httpx.get(base_url.rstrip("/") + "/metrics", timeout=10).text
+    except httpx.HTTPError as e:
+        print("Could not scrape /metrics:", e)
+        return stages
+    for family in text_string_to_metric_families(text):
+        if family.name != "rag_stage_seconds":
+            continue
+        for sample in family.samples:
+            count, total, buckets = stages.get(sample.labels.get("stage"), (0.0, 0.0, {}))
+            if sample.name.endswith("_count"):
+                count = sample.value
+            elif sample.name.endswith("_sum"):
+                total = sample.value
+            elif sample.name.endswith("_bucket"):
+                buckets[float(sample.labels["le"])] = sample.value
+            stages[sample.labels.get("stage")] = (count, total, buckets)
+    return stages
+
+
+def stage_breakdown(before, after):
+    """Mean and bucket-estimated p95 of each stage over the run, from two scrapes."""
+    breakdown = {}
+    for stage, (count, total, buckets) in after.items():
+        prev_count, prev_total, prev_buckets = before.get(stage, (0.0, 0.0, {}))
+        runs = count - prev_count
+        if runs <= 0:
+            continue
+        p95 = None
+        for le in sorted(buckets):
+            if buckets[le] - prev_buckets.get(le, 0.0) >= 0.95 * runs:
+                p95 = le
+                break
+        breakdown[stage] = {"count": int(runs), "mean_seconds": round((total - prev_total) / runs, 5), "p95_le_seconds": p95}
+    return breakdown
+
+
+def wait_until_ready(base_url, timeout=180):
+    give_up_at = time.time() + timeout
+    while time.time() < give_up_at:
+        try:
+            if httpx.get(base_url.rstrip("/") + "/readyz", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{base_url} was not ready after {timeout}s")
+
+
+def start_process(command, env, name):
+    print(f"Starting {name}: {' '.join(command)}")
+    return subprocess.Popen(command, cwd=BASE_DIR, env=env, start_new_session=True)
+
+
+def stop_process(process):
+    if process.poll() is None:
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(timeout=20)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+
+
+def server_command(kind, port, workers, threads):
+    if kind == "gunicorn":
+        return ["gunicorn", "-c", "gunicorn.conf.py", "-b", f"127.0.0.1:{port}", "app:app"]
+    return ["uvicorn", "asgi_app:app", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers),
+            "--log-level", "warning"]
+
+
+def server_settings(args):
+    if not args.launch:
+        return [None]
+    threads = args.threads if args.launch == "gunicorn" else [None]
+    return [{"server": args.launch, "workers": w, "threads": t} for w in args.workers for t in threads]
+
+
+def run(args):
+    report = {
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "config": {k: v for k, v in vars(args).items() if k != "env"},
+        "runs": []
+    }
+    questions = QUESTIONS
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    mock = None
+    env = dict(os.environ)
+    if args.launch:
+        mock = start_process([
+            sys.executable, "mock_openai_server.py", "--port", str(args.mock_port),
+            "--embed-latency", args.embed_latency, "--chat-latency", args.chat_latency,
+            "--token-delay", str(args.token_delay), "--error-rate", str(args.error_rate), "--seed", str(args.seed)
+        ], env, "mock OpenAI")
+        env.update({
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{args.mock_port}/v1",
+            "OPENAI_API_KEY": "mock",
+            # One client address sends everything: per-client limits would measure nothing
+            "RATE_LIMIT_PER_MINUTE": "0",
+            "INDEX_POLL_SECONDS": "0"
+        })
+    env.update(dict(item.split("=", 1) for item in args.env))
+
+    try:
+        for setting in server_settings(args):
+            server = None
+            base_url = args.url
+            if setting is not None:
+                base_url = f"http://127.0.0.1:{args.port}"
+                server_env = dict(env)
+                server_env["GUNICORN_WORKERS"] = str(setting["workers"])
+                server_env["GUNICORN_THREADS"] = str(setting["threads"] or 1)
+                server_env["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prom-")
+                server = start_process(
+                    server_command(setting["server"], args.port, setting["workers"], setting["threads"]),
+                    server_env, f"{setting['server']} {setting}"
+                )
+            try:
+                wait_until_ready(base_url)
+                for endpoint in args.endpoint:
+                    for concurrency in args.concurrency:
+                        report["runs"].append(run_one(args, base_url, endpoint, concurrency, setting, questions))
+            finally:
+                if server is not None:
+                    stop_process(server)
+    finally:
+        if mock is not None:
+            stop_process(mock)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to {args.output}")
+    return report
+
+
+def run_one(args, base_url, endpoint, concurrency, setting, questions):
+    # Every endpoint/concurrency pair asks its own questions, so one run never
+    # answers from the cache another run filled; server settings repeat them
+    stream = question_stream(f"{args.seed}:{endpoint}:{concurrency}", args.repeat_ratio, questions)
+    if args.warmup_requests:
+        asyncio.run(run_level(base_url, endpoint, 1, args.duration, args.warmup_requests, stream, args.timeout))
+
+    before = scrape_stages(base_url)
+    log, elapsed = asyncio.run(
+        run_level(base_url, endpoint, concurrency, args.duration, args.requests, stream, args.timeout)
+    )
+    result = {
+        "setting": setting,
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "summary": summarize(log, elapsed),
+        "stages": stage_breakdown(before, scrape_stages(base_url))
+    }
+    latency = result["summary"]["latency_seconds"]
+    print(
+        f"{endpoint:<12} {str(setting or base_url):<50} c={concurrency:<4} "
+        f"{result['summary']['throughput_rps']:>8.2f} rps  p50={latency['p50']}  p95={latency['p95']}  "
+        f"p99={latency['p99']}  errors={result['summary']['error_rate']:.2%}"
+    )
+    return result
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the chat endpoints")
+    parser.add_argument("--url", default="http://127.0.0.1:8080", help="server to test when not launching one")
+    parser.add_argument("--launch", choices=("gunicorn", "asgi"), help="start mock OpenAI and this server per setting")
+    parser.add_argument("--port", type=int, default=8181, help="port for a launched server")
+    parser.add_argument("--workers", type=int_list, default=[1])
+    parser.add_argument("--threads", type=int_list, default=[4], help="gunicorn threads per worker")
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), action="append",
+                        help="endpoint to load, repeatable (default: chat)")
+    parser.add_argument("--concurrency", type=int_list, default=[1, 4, 16])
+    parser.add_argument("--duration", type=float, default=20, help="seconds per concurrency level")
+    parser.add_argument("--requests", type=int, default=None, help="stop a level after this many requests")
+    parser.add_argument("--warmup-requests", type=int, default=5)
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="share of verbatim (cacheable) questions")
+    parser.add_argument("--questions", help="file with one question per line")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE for launched servers, repeatable")
+    parser.add_argument("--mock-port", type=int, default=8900)
+    parser.add_argument("--embed-latency", default="lognormal:0.05,0.5")
+    parser.add_argument("--chat-latency", default="lognormal:0.8,0.4")
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+    args.endpoint = args.endpoint or ["chat"]
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""
+Process memory reporting for the voice backend workers.
+"""
+import os
+import resource
+
+SMAPS_ROLLUP = "/proc/self/smaps_rollup"
+
+
+def process_memory():
+    """
+    Memory of the current process in MB.
+    shared = pages also mapped by other processes (mmap'd index, pages
+    inherited from a preloading master), private = pages only this process
+    holds, pss = private + this process's share of the shared pages.
+    """
+    try:
+        fields = {}
+        with open(SMAPS_ROLLUP, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+        return {
+            "rss_mb": round(fields.get("Rss", 0.0), 1),
+            "pss_mb": round(fields.get("Pss", 0.0), 1),
+            "shared_mb": round(fields.get("Shared_Clean", 0.0) + fields.get("Shared_Dirty", 0.0), 1),
+            "private_mb": round(fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0), 1)
+        }
+    except OSError:
+        # Not Linux: only peak RSS is available (KB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {"rss_mb": round(peak / 1024, 1), "pss_mb": None, "shared_mb": None, "private_mb": None}
+
+
+def log_memory(label):
+    stats = process_memory()
+    print(
+        f"[memory] {label} pid={os.getpid()} rss={stats['rss_mb']}MB pss={stats['pss_mb']}MB "
+        f"shared={stats['shared_mb']}MB private={stats['private_mb']}MB"
+    )
+    return stats
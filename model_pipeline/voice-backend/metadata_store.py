@@ -0,0 +1,168 @@
+"""
+On-disk metadata store for the FAISS index.
+
+Rows live in a read-only SQLite file keyed by FAISS row id and are fetched on
+demand, so worker memory does not grow with the catalog. The file is
+memory-mapped by SQLite, so all workers on an instance share its pages
+through the OS page cache.
+"""
+import json
+import os
+import sqlite3
+import textwrap
+import threading
+
+METADATA_MMAP_BYTES = int(os.getenv("METADATA_MMAP_BYTES", 256 * 1024 * 1024))
+
+COLUMNS = ("parent_asin", "title", "chunk_text")
+
+
+class MetadataStoreWriter:
+    """
+    Writes a new metadata SQLite file in blocks, so a build never holds
+    every entry at once. Row ids continue from one add() to the next, and
+    the file only replaces path on close().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        self.rows = 0
+        self._conn = sqlite3.connect(self.tmp_path)
+        self._conn.execute(
+            "CREATE TABLE metadata ("
+            "row_id INTEGER PRIMARY KEY, parent_asin TEXT, title TEXT, chunk_text TEXT, extra TEXT)"
+        )
+
+    def add(self, entries):
+        start = self.rows
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO metadata (row_id, parent_asin, title, chunk_text, extra) VALUES (?, ?, ?, ?, ?)",
+                (
+                    (
+                        row_id,
+                        entry.get("parent_asin"),
+                        entry.get("title"),
+                        entry.get("chunk_text"),
+                        json.dumps({k: v for k, v in entry.items() if k not in COLUMNS})
+                    )
+                    for row_id, entry in enumerate(entries, start)
+                )
+            )
+        self.rows = start + len(entries)
+
+    def close(self):
+        self._conn.close()
+        # Readers never see a half-written store
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self._conn.close()
+        os.remove(self.tmp_path)
+
+
+class MetadataJsonWriter:
+    """Writes the legacy index_metadata.json array a block of entries at a time."""
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.rows = 0
+        self._file = open(self.tmp_path, "w", encoding="utf-8")
+        self._file.write("[")
+
+    def add(self, entries):
+        for entry in entries:
+            # Same layout as json.dump(metadata, f, indent=2)
+            self._file.write(",\n" if self.rows else "\n")
+            self._file.write(textwrap.indent(json.dumps(entry, indent=2), "  "))
+            self.rows += 1
+
+    def close(self):
+        self._file.write("\n]" if self.rows else "]")
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self.tmp_path)
+
+
+def write_metadata_store(path, metadata):
+    """
+    Write metadata entries (list position = FAISS row id) to a new SQLite file.
+    Fields other than COLUMNS are kept in a JSON `extra` column.
+    """
+    writer = MetadataStoreWriter(path)
+    try:
+        writer.add(metadata)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+
+
+class MetadataStore:
+    """Read-only, list-like view over a metadata SQLite file."""
+
+    def __init__(self, path, mmap_bytes=METADATA_MMAP_BYTES):
+        self.path = path
+        self.mmap_bytes = mmap_bytes
+        self._local = threading.local()
+        self._length = self._connect().execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
+
+    def _connect(self):
+        # One connection per thread, and never reuse one inherited across a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            conn.execute(f"PRAGMA mmap_size={self.mmap_bytes}")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def __len__(self):
+        return self._length
+
+    def warm(self):
+        """Scan every row once so the file's pages are in the page cache."""
+        self._connect().execute("SELECT SUM(LENGTH(chunk_text)) FROM metadata").fetchone()
+
+    def __getitem__(self, row_id):
+        row_id = int(row_id)
+        if row_id < 0:
+            row_id += self._length
+        row = self._connect().execute(
+            "SELECT parent_asin, title, chunk_text, extra FROM metadata WHERE row_id = ?", (row_id,)
+        ).fetchone()
+        if row is None:
+            raise IndexError(f"metadata row {row_id} out of range")
+        return self._to_entry(row)
+
+    def __iter__(self):
+        for row in self._connect().execute("SELECT parent_asin, title, chunk_text, extra FROM metadata ORDER BY row_id"):
+            yield self._to_entry(row)
+
+    @staticmethod
+    def _to_entry(row):
+        parent_asin, title, chunk_text, extra = row
+        entry = {"parent_asin": parent_asin, "title": title, "chunk_text": chunk_text}
+        if extra:
+            entry.update(json.loads(extra))
+        return entry
+
+
+def open_metadata(store_path, json_path):
+    """
+    Open the SQLite store if the index build produced one, otherwise fall
+    back to loading the legacy index_metadata.json into memory.
+    """
+    if os.path.exists(store_path):
+        return MetadataStore(store_path)
+
+    print(f"No metadata store at {store_path}, loading {json_path} into memory")
+    with open(json_path, "r", encoding="utf-8") as f:
+        return json.load(f)
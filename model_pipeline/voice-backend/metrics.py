@@ -0,0 +1,139 @@
+"""
+Prometheus metrics for the voice backend.
+
+- rag_stage_seconds{stage}: latency of each step of a request (admission_wait,
+  embed, attribute_filter, faiss_search, lexical_search, fusion, metadata_fetch,
+  rerank, context_pack, prompt_build, llm, llm_first_token, total)
+- rag_context_tokens: size of the packed product context sent to the LLM
+- rag_requests_total{endpoint, outcome}: answered, cache hits, rate_limited,
+  shed and errors
+- rag_llm_tokens_total / rag_embedding_tokens_total: OpenAI token usage
+- rag_<source>_*: the stats() of the caches, batchers and OpenAI client,
+  read at scrape time by StatsCollector
+
+With several gunicorn workers set PROMETHEUS_MULTIPROC_DIR to an empty
+directory so the histograms and counters are summed across workers. The
+stats() sources are per process and always describe the worker that
+answered the scrape.
+"""
+import contextlib
+import os
+import time
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# From a BM25 lookup (tens of microseconds) to a slow LLM answer
+STAGE_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25)
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_seconds", "Time spent in each stage of a chat request", ["stage"], buckets=STAGE_BUCKETS
+)
+REQUESTS = Counter(
+    "rag_requests_total", "Chat requests by endpoint and outcome", ["endpoint", "outcome"]
+)
+LLM_TOKENS = Counter(
+    "rag_llm_tokens_total", "Chat completion tokens reported by OpenAI", ["kind"]
+)
+EMBEDDING_TOKENS = Counter(
+    "rag_embedding_tokens_total", "Embedding tokens reported by OpenAI"
+)
+CONTEXT_TOKENS = Histogram(
+    "rag_context_tokens", "Tokens of product context packed into the prompt",
+    buckets=(0, 100, 250, 500, 750, 1000, 1500, 2000, 3000, 4000)
+)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Time the block into rag_stage_seconds{stage=name}, also when it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage=name).observe(time.perf_counter() - started)
+
+
+def observe_stage(name, seconds):
+    STAGE_SECONDS.labels(stage=name).observe(seconds)
+
+
+def count_request(endpoint, outcome):
+    REQUESTS.labels(endpoint=endpoint, outcome=outcome).inc()
+
+
+def _token_count(usage, field):
+    # usage is None when OpenAI did not report it (e.g. a stream without include_usage)
+    value = getattr(usage, field, None)
+    return value if isinstance(value, int) else 0
+
+
+def record_llm_usage(usage):
+    """Add a chat completion's usage block to the token counters."""
+    LLM_TOKENS.labels(kind="prompt").inc(_token_count(usage, "prompt_tokens"))
+    LLM_TOKENS.labels(kind="completion").inc(_token_count(usage, "completion_tokens"))
+
+
+def record_embedding_usage(usage):
+    EMBEDDING_TOKENS.inc(_token_count(usage, "total_tokens"))
+
+
+class StatsCollector:
+    """
+    Exposes existing stats() dicts as metrics at scrape time. Numeric keys
+    named in `counters` become rag_<source>_<key>_total counters, other
+    numeric keys become gauges, and string values become a gauge with the
+    value as a label (e.g. rag_openai_breaker_state{value="open"} 1).
+    Registering a source name again replaces the earlier one.
+    """
+
+    def __init__(self):
+        self._sources = {}
+
+    def register(self, source, stats_fn, counters=()):
+        self._sources[source] = (stats_fn, set(counters))
+
+    def collect(self):
+        for source, (stats_fn, counters) in list(self._sources.items()):
+            try:
+                stats = stats_fn()
+            except Exception as e:
+                print(f"Metrics: {source} stats failed:", e)
+                continue
+
+            for key, value in stats.items():
+                name = f"rag_{source}_{key}"
+                if isinstance(value, bool) or isinstance(value, dict):
+                    continue
+                if isinstance(value, str):
+                    metric = GaugeMetricFamily(name, f"{source} {key}", labels=["value"])
+                    metric.add_metric([value], 1)
+                elif key in counters:
+                    metric = CounterMetricFamily(name, f"{source} {key}", value=value)
+                else:
+                    metric = GaugeMetricFamily(name, f"{source} {key}", value=value)
+                yield metric
+
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+
+def render():
+    """Body and content type for /metrics."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(stats_collector)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_worker_dead(pid):
+    """Gunicorn child_exit hook: drop a dead worker's live gauges."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid)
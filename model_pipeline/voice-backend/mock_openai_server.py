@@ -0,0 +1,270 @@
+"""
+Local stand-in for the OpenAI embeddings and chat completions APIs, for load
+tests that should not spend API money.
+
+- POST /v1/embeddings returns deterministic unit vectors: the same text
+  always gets the same vector, so caches and FAISS behave as in production.
+- POST /v1/chat/completions returns a canned answer, or streams it token by
+  token with "stream": true (including the final usage chunk).
+- Latency is drawn from configurable distributions, server errors (500) and
+  rate limits (429 with Retry-After) are injected at configurable rates, and
+  everything random is seeded.
+
+Point the backend at it with OPENAI_BASE_URL=http://127.0.0.1:8900/v1.
+
+Run with:
+    python mock_openai_server.py --port 8900 --embed-latency lognormal:0.05,0.5 \\
+        --chat-latency lognormal:0.8,0.4 --token-delay 0.02
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+DEFAULT_DIM = 1536
+CANNED_ANSWER = (
+    "Here is what I found in the catalog. This product matches your question and is well reviewed. "
+    "It is available at the listed price.\nProduct: Mock Product"
+)
+
+
+def parse_latency(spec):
+    """
+    A sampler for a latency spec, in seconds:
+    const:S, uniform:LOW,HIGH, normal:MEAN,STD or lognormal:MEDIAN,SIGMA.
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "const":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        return lambda rng: values[0] * float(np.exp(rng.gauss(0.0, values[1])))
+    raise ValueError(f"Unknown latency distribution {spec!r} (use const, uniform, normal or lognormal)")
+
+
+def deterministic_embedding(text, dim):
+    """Unit vector seeded by the text, identical across runs and processes."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim)
+    return (vector / np.linalg.norm(vector)).astype("float32").tolist()
+
+
+def index_dimension(default=DEFAULT_DIM):
+    """Dimension of the local FAISS index, so mock vectors can be searched with it."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "faiss_index.index")
+    if not os.path.exists(path):
+        return default
+    import faiss
+    return faiss.read_index(path).d
+
+
+class MockOpenAI:
+    def __init__(self, dim=DEFAULT_DIM, embed_latency="const:0", chat_latency="const:0", token_delay=0.0,
+                 error_rate=0.0, rate_limit_rate=0.0, retry_after=1.0, answer=CANNED_ANSWER, seed=0):
+        self.dim = dim
+        self.embed_latency = parse_latency(embed_latency)
+        self.chat_latency = parse_latency(chat_latency)
+        self.token_delay = token_delay
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.answer = answer
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counters = {"embeddings": 0, "chat": 0, "errors": 0, "rate_limited": 0}
+
+    def _draw(self, sampler):
+        """(delay, failure status or None) for one request."""
+        with self._lock:
+            delay, roll = sampler(self._rng), self._rng.random()
+        if roll < self.error_rate:
+            return delay, 500
+        if roll < self.error_rate + self.rate_limit_rate:
+            return delay, 429
+        return delay, None
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def embeddings(self, body):
+        delay, fail = self._draw(self.embed_latency)
+        time.sleep(delay)
+        self._count("embeddings")
+        if fail:
+            return fail
+        inputs = body.get("input", [])
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        tokens = sum(max(1, len(text) // 4) for text in inputs)
+        return {
+            "object": "list",
+            "model": body.get("model", "mock"),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": deterministic_embedding(text, self.dim)}
+                for i, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+        }
+
+    def usage(self, body):
+        prompt = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+        completion = len(self.answer) // 4
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+    def chat(self, body):
+        """(first_token_delay, failure status or None) for a chat completion request."""
+        delay, fail = self._draw(self.chat_latency)
+        self._count("chat")
+        return delay, fail
+
+    def completion(self, body):
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": self.answer}, "finish_reason": "stop"}],
+            "usage": self.usage(body)
+        }
+
+    def stream_chunks(self, body):
+        def chunk(delta, finish_reason=None, usage=None):
+            return {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                "usage": usage
+            }
+
+        yield chunk({"role": "assistant", "content": ""})
+        for word in self.answer.split(" "):
+            yield chunk({"content": word + " "})
+        yield chunk({}, finish_reason="stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield chunk(None, usage=self.usage(body))
+
+
+def make_handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+        def _send_json(self, status, payload, headers=None):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_error(self, status):
+            if status == 429:
+                mock._count("rate_limited")
+                self._send_json(429, {"error": {"message": "injected rate limit", "type": "rate_limit_exceeded"}},
+                                {"Retry-After": str(mock.retry_after)})
+            else:
+                mock._count("errors")
+                self._send_json(500, {"error": {"message": "injected mock failure", "type": "server_error"}})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path.endswith("/embeddings"):
+                payload = mock.embeddings(body)
+                if not isinstance(payload, dict):
+                    self._send_error(payload)
+                else:
+                    self._send_json(200, payload)
+            elif self.path.endswith("/chat/completions"):
+                delay, fail = mock.chat(body)
+                time.sleep(delay)
+                if fail:
+                    self._send_error(fail)
+                elif body.get("stream"):
+                    self._stream(body)
+                else:
+                    # Without streaming the whole answer is generated before anything is sent
+                    time.sleep(mock.token_delay * len(mock.answer.split(" ")))
+                    self._send_json(200, mock.completion(body))
+            else:
+                self._send_json(404, {"error": {"message": f"no mock for {self.path}", "type": "invalid_request_error"}})
+
+        def _stream(self, body):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            first = True
+            for chunk in mock.stream_chunks(body):
+                if not first and mock.token_delay:
+                    time.sleep(mock.token_delay)
+                first = False
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _write_chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start_mock_server(mock, host="127.0.0.1", port=0):
+    """Serve mock in a daemon thread. Returns (server, base_url)."""
+    server = ThreadingHTTPServer((host, port), make_handler(mock))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI embeddings and chat APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--dim", type=int, default=None, help="embedding size (default: the local index's)")
+    parser.add_argument("--embed-latency", default="lognormal:0.05,0.5")
+    parser.add_argument("--chat-latency", default="lognormal:0.8,0.4", help="time to the first token")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="seconds between streamed tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests answered 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with a 429")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    mock = MockOpenAI(
+        dim=args.dim or index_dimension(),
+        embed_latency=args.embed_latency,
+        chat_latency=args.chat_latency,
+        token_delay=args.token_delay,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        seed=args.seed
+    )
+    server, base_url = start_mock_server(mock, args.host, args.port)
+    print(f"Mock OpenAI serving {mock.dim}-dim embeddings at {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,18 +5,18 @@ import os
 import json
 import faiss
 import numpy as np
-import openai
 from dotenv import load_dotenv
+from embedders import get_embedder
+from index_holder import check_embedder, read_manifest
 from sklearn.metrics.pairwise import cosine_similarity
 from tqdm import tqdm
 import random
 
-# Load env and API key
+# Load env and API key (read by the shared OpenAI client)
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
 
 # Constants
-EMBED_MODEL = "text-embedding-3-small"
+embedder = get_embedder()
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 INDEX_PATH = os.path.join(BASE_DIR, "faiss_index.index")
 METADATA_PATH = os.path.join(BASE_DIR, "index_metadata.json")
@@ -59,15 +59,12 @@ def load_validation_queries():
 
 def get_query_embedding(text):
     """Get embedding for a query text"""
-    response = openai.embeddings.create(
-        input=[text],
-        model=EMBED_MODEL
-    )
-    return np.array(response.data[0].embedding, dtype="float32")
+    return embedder.embed([text])[0]
 
 def evaluate_rag_system():
     """Evaluate the RAG system using validation queries"""
     # Load FAISS index and metadata
+    check_embedder(read_manifest(BASE_DIR), embedder.name)
     faiss_index = faiss.read_index(INDEX_PATH)
     
     with open(METADATA_PATH, "r", encoding="utf-8") as f:
@@ -0,0 +1,356 @@
+"""
+Shared OpenAI client for the RAG assistant.
+
+Every OpenAI call in the backend and the offline scripts goes through
+PooledOpenAI (or AsyncPooledOpenAI in the ASGI server), which adds:
+- one keep-alive connection pool per process
+- per-call timeouts capped by the caller's remaining deadline
+- jittered exponential retries, limited by a retry budget
+- a circuit breaker that fails fast while the upstream is degraded
+"""
+import asyncio
+import contextlib
+import contextvars
+import os
+import random
+import threading
+import time
+
+import httpx
+import openai
+from openai import AsyncOpenAI, OpenAI
+
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 30))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", 3))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 2))
+OPENAI_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", 20))
+OPENAI_RETRY_BUDGET_RATIO = float(os.getenv("OPENAI_RETRY_BUDGET_RATIO", 0.2))
+OPENAI_BREAKER_FAILURES = int(os.getenv("OPENAI_BREAKER_FAILURES", 5))
+OPENAI_BREAKER_RESET_SECONDS = float(os.getenv("OPENAI_BREAKER_RESET_SECONDS", 30))
+
+BACKOFF_BASE_SECONDS = 0.2
+BACKOFF_MAX_SECONDS = 2.0
+# Don't start an attempt with less time than this left on the deadline
+MIN_ATTEMPT_SECONDS = 0.05
+
+RETRYABLE_ERRORS = (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+# Errors that mean the upstream itself is unhealthy (429 only means we are sending too much)
+BREAKER_ERRORS = (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
+_deadline = contextvars.ContextVar("openai_deadline", default=None)
+
+
+class UpstreamUnavailable(Exception):
+    """OpenAI was not called, or gave up, because it cannot answer in time."""
+
+    retry_after = None
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    def __init__(self, retry_after):
+        super().__init__(f"OpenAI circuit breaker is open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(UpstreamUnavailable):
+    pass
+
+
+class RetriesExhausted(UpstreamUnavailable):
+    """A retryable OpenAI error that retries could not get past; the original is the __cause__."""
+
+    def __init__(self, error):
+        super().__init__(f"OpenAI call failed after retries: {error}")
+        self.retry_after = retry_after_seconds(error)
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """
+    Give every OpenAI call inside the block a share of one time budget.
+    Nested deadlines can only shorten the outer one.
+    """
+    new_deadline = time.monotonic() + seconds
+    outer = _deadline.get()
+    if outer is not None:
+        new_deadline = min(new_deadline, outer)
+    token = _deadline.set(new_deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time():
+    """Seconds left on the current deadline, or None if there is none."""
+    current = _deadline.get()
+    return None if current is None else current - time.monotonic()
+
+
+class RetryBudget:
+    """
+    Retries may be at most `ratio` of recent requests. Every request deposits
+    `ratio` tokens, every retry spends one, so retries cannot multiply load
+    on an upstream that is already struggling.
+    """
+
+    def __init__(self, ratio=OPENAI_RETRY_BUDGET_RATIO, max_tokens=10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self):
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+    @property
+    def tokens(self):
+        return self._tokens
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failure_threshold` consecutive upstream failures.
+    open -> half_open after `reset_seconds`, when one probe call is let through.
+    half_open -> closed on success, back to open on failure.
+    """
+
+    def __init__(self, failure_threshold=OPENAI_BREAKER_FAILURES, reset_seconds=OPENAI_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Raise CircuitOpenError unless a call may go out now."""
+        with self._lock:
+            if self.state == "closed":
+                return
+            elapsed = time.monotonic() - self._opened_at
+            if self.state == "open" and elapsed >= self.reset_seconds:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            raise CircuitOpenError(max(self.reset_seconds - elapsed, 1.0))
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    def record_neutral(self):
+        """The call finished without telling us anything about upstream health."""
+        with self._lock:
+            self._probe_in_flight = False
+
+
+def retry_after_seconds(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class PooledOpenAI:
+    def __init__(self, base_url=None, api_key=None, timeout=OPENAI_TIMEOUT,
+                 max_retries=OPENAI_MAX_RETRIES, pool_size=OPENAI_POOL_SIZE, breaker=None, budget=None):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self.breaker = breaker or CircuitBreaker()
+        self.budget = budget or RetryBudget()
+
+        self._sdk = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._counters = {"calls": 0, "retries": 0, "failures": 0, "short_circuited": 0, "deadline_exceeded": 0}
+
+    @property
+    def sdk(self):
+        """The OpenAI SDK client, created lazily and again after a fork."""
+        if self._sdk is None or self._pid != os.getpid():
+            with self._lock:
+                if self._sdk is None or self._pid != os.getpid():
+                    self._sdk = self._create_sdk()
+                    self._pid = os.getpid()
+        return self._sdk
+
+    def _client_options(self):
+        return {
+            "api_key": self.api_key or os.getenv("OPENAI_API_KEY"),
+            # OPENAI_BASE_URL can point at a local stand-in for tests and load tests
+            "base_url": self.base_url or os.getenv("OPENAI_BASE_URL"),
+            "max_retries": 0  # retries are ours, bounded by deadline and budget
+        }
+
+    def _http_options(self):
+        return {
+            "limits": httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.pool_size,
+                keepalive_expiry=60
+            ),
+            "timeout": httpx.Timeout(self.timeout, connect=OPENAI_CONNECT_TIMEOUT)
+        }
+
+    def _create_sdk(self):
+        return OpenAI(http_client=httpx.Client(**self._http_options()), **self._client_options())
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _attempt_timeout(self):
+        left = remaining_time()
+        if left is None:
+            return self.timeout
+        if left < MIN_ATTEMPT_SECONDS:
+            self._count("deadline_exceeded")
+            raise DeadlineExceeded("Request deadline exceeded before calling OpenAI")
+        return min(self.timeout, left)
+
+    def call(self, fn):
+        """
+        Run fn(sdk_client) with retries. fn gets a client whose timeout is
+        already set from the remaining deadline.
+        """
+        self._start_call()
+
+        attempt = 0
+        while True:
+            try:
+                sdk = self.sdk.with_options(timeout=self._attempt_timeout())
+                result = fn(sdk)
+                self.breaker.record_success()
+                return result
+            except RETRYABLE_ERRORS as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise RetriesExhausted(e) from e
+                attempt += 1
+                time.sleep(delay)
+            except Exception:
+                self.breaker.record_neutral()
+                self._count("failures")
+                raise
+
+    def _start_call(self):
+        try:
+            self.breaker.allow()
+        except CircuitOpenError:
+            self._count("short_circuited")
+            raise
+
+        self._count("calls")
+        self.budget.record_request()
+
+    def _retry_delay(self, error, attempt):
+        """Record a retryable failure. Returns seconds to wait before retrying, or None to give up."""
+        if isinstance(error, BREAKER_ERRORS):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_neutral()
+
+        delay = retry_after_seconds(error)
+        if delay is None:
+            # Full jitter: spreads out retries from many workers
+            delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+        left = remaining_time()
+
+        give_up = (
+            attempt >= self.max_retries
+            or (left is not None and delay + MIN_ATTEMPT_SECONDS > left)
+            or self.breaker.state == "open"
+            or not self.budget.try_spend()
+        )
+        if give_up:
+            self._count("failures")
+            return None
+
+        self._count("retries")
+        return delay
+
+    def embeddings(self, input, model):
+        return self.call(lambda sdk: sdk.embeddings.create(input=input, model=model))
+
+    def chat_completion(self, **kwargs):
+        """Chat completion. With stream=True, retries only cover opening the stream."""
+        return self.call(lambda sdk: sdk.chat.completions.create(**kwargs))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["breaker_state"] = self.breaker.state
+        stats["retry_budget_tokens"] = round(self.budget.tokens, 2)
+        return stats
+
+
+class AsyncPooledOpenAI(PooledOpenAI):
+    """
+    PooledOpenAI for asyncio servers: same deadlines, retry budget and
+    breaker, but calls are awaited and backoff does not block the event loop.
+    Use it from one event loop per process.
+    """
+
+    def _create_sdk(self):
+        return AsyncOpenAI(http_client=httpx.AsyncClient(**self._http_options()), **self._client_options())
+
+    async def call(self, fn):
+        """Await fn(sdk_client) with retries, like PooledOpenAI.call."""
+        self._start_call()
+
+        attempt = 0
+        while True:
+            try:
+                sdk = self.sdk.with_options(timeout=self._attempt_timeout())
+                result = await fn(sdk)
+                self.breaker.record_success()
+                return result
+            except RETRYABLE_ERRORS as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise RetriesExhausted(e) from e
+                attempt += 1
+                await asyncio.sleep(delay)
+            except Exception:
+                self.breaker.record_neutral()
+                self._count("failures")
+                raise
+
+    async def embeddings(self, input, model):
+        return await self.call(lambda sdk: sdk.embeddings.create(input=input, model=model))
+
+    async def chat_completion(self, **kwargs):
+        """Chat completion. With stream=True, retries only cover opening the stream."""
+        return await self.call(lambda sdk: sdk.chat.completions.create(**kwargs))
+
+
+shared_client = PooledOpenAI()
+# Only used by the ASGI server; nothing is created until the first call
+async_client = AsyncPooledOpenAI()
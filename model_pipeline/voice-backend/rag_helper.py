@@ -1,53 +1,224 @@
 import os
-import faiss
-import json
 import numpy as np
-import openai
 from dotenv import load_dotenv
-from sklearn.preprocessing import normalize
+from embedding_cache import EmbeddingCache
+from embedders import get_embedder
+from batching import MicroBatcher
+from index_holder import IndexHolder, EmbedderMismatchError
+from lexical_index import HYBRID_SEARCH, HYBRID_VECTOR_CANDIDATES, HYBRID_LEXICAL_CANDIDATES, reciprocal_rank_fusion
+from attribute_index import ATTRIBUTE_FILTERS
+from index_tuning import search_parameters
+from reranker import RERANK_CANDIDATES, get_reranker
+from openai_client import shared_client
+import metrics
 
-# Load env and API key
+# Load env and API key (read by the shared OpenAI client)
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
 
 # Constants
-EMBED_MODEL = "text-embedding-3-small"
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 INDEX_PATH = os.path.join(BASE_DIR, "faiss_index.index")
 METADATA_PATH = os.path.join(BASE_DIR, "index_metadata.json")
+METADATA_STORE_PATH = os.path.join(BASE_DIR, "index_metadata.db")
 
-# Load FAISS index and metadata once
-faiss_index = faiss.read_index(INDEX_PATH)
+# The deployed FAISS index is loaded on first use or by warmup, not at import.
+# Newer versions are swapped in by index_holder.reload() (admin endpoint or
+# INDEX_SOURCE polling). Metadata rows are read from disk on demand.
+# Query embeddings come from EMBEDDER, which must be the one that built the index.
+embedder = get_embedder()
+index_holder = IndexHolder(initial_dir=BASE_DIR, embedder_name=embedder.name)
 
-with open(METADATA_PATH, "r", encoding="utf-8") as f:
-    metadata_list = json.load(f)
+embedding_cache = EmbeddingCache()
+# Cross-encoder re-ranking of the retrieved candidates, None unless RERANKER is set
+reranker = get_reranker()
+
+
+def embed_batch(texts):
+    """One embedder call for a batch of query texts, one normalized (1, d) row per text."""
+    unique_texts = list(dict.fromkeys(texts))
+    embs = embedder.embed(unique_texts)
+    rows = {text: embs[i:i + 1] for i, text in enumerate(unique_texts)}
+    return [rows[text] for text in texts]
+
+
+def search_batch(requests):
+    """
+    One FAISS search per index version and attribute selection over the
+    stacked query vectors of (snapshot, query_vector, k[, selection])
+    requests. A batch can straddle a reload, so requests are grouped by the
+    version they started on.
+    """
+    results = [None] * len(requests)
+    groups = {}
+    for i, request in enumerate(requests):
+        selection = request[3] if len(request) > 3 else None
+        groups.setdefault((id(request[0]), id(selection)), []).append(i)
+
+    for positions in groups.values():
+        snapshot = requests[positions[0]][0]
+        selection = requests[positions[0]][3] if len(requests[positions[0]]) > 3 else None
+        max_k = max(requests[i][2] for i in positions)
+        queries = np.vstack([requests[i][1] for i in positions])
+        if selection is None:
+            D, I = snapshot.index.search(queries, max_k)
+        else:
+            D, I = snapshot.index.search(queries, max_k, params=search_parameters(snapshot.index, selection))
+        for row, i in enumerate(positions):
+            k = requests[i][2]
+            results[i] = (D[row:row + 1, :k], I[row:row + 1, :k])
+    return results
+
+
+# Concurrent requests in one worker share embedding calls and FAISS searches
+# when RAG_BATCH_WINDOW_MS > 0
+embedding_batcher = MicroBatcher(embed_batch, name="embedding")
+search_batcher = MicroBatcher(search_batch, name="faiss_search")
+
+metrics.stats_collector.register("embedding_cache", embedding_cache.stats, counters=("hits", "shared_hits", "misses"))
+metrics.stats_collector.register("embedding_batcher", embedding_batcher.stats, counters=("batches", "items"))
+metrics.stats_collector.register("search_batcher", search_batcher.stats, counters=("batches", "items"))
+if reranker is not None:
+    metrics.stats_collector.register("reranker", reranker.stats, counters=("requests", "pairs_scored", "pairs_cached"))
+metrics.stats_collector.register(
+    "openai", shared_client.stats, counters=("calls", "retries", "failures", "short_circuited", "deadline_exceeded")
+)
 
 
 def get_query_embedding(text: str) -> np.ndarray:
-    response = openai.embeddings.create(
-        input=[text],
-        model=EMBED_MODEL
-    )
-    emb = np.array(response.data[0].embedding, dtype="float32").reshape(1, -1)
-    return normalize(emb, axis=1)
+    cached = embedding_cache.get(text, embedder.name)
+    if cached is not None:
+        return cached
+
+    emb = embedding_batcher.submit(text)
+    embedding_cache.put(text, embedder.name, emb)
+    return emb
+
+
+async def get_query_embedding_async(text: str) -> np.ndarray:
+    """get_query_embedding for the ASGI server: the embedding call is awaited, not batched."""
+    cached = embedding_cache.get(text, embedder.name)
+    if cached is not None:
+        return cached
+
+    emb = await embedder.embed_async([text])
+    embedding_cache.put(text, embedder.name, emb)
+    return emb
+
 
+def current_index():
+    """The index version a new request should use for its whole lifetime."""
+    return index_holder.current()
 
-def fetch_top_k_chunks(query: str, k=3):
-    query_vector = get_query_embedding(query)
-    D, I = faiss_index.search(query_vector, k)  # D = distances, I = indices
+
+def index_version() -> str:
+    return index_holder.current().version
+
+
+def vector_distances(index, query_vector, row_ids):
+    """
+    Squared L2 distance of the query to rows the ANN search did not return
+    (lexical-only hits), so the context packer can apply its cutoff to them.
+    Rows the index cannot reconstruct are left out.
+    """
+    distances = {}
+    for row_id in row_ids:
+        try:
+            vector = index.reconstruct(int(row_id))
+        except RuntimeError:
+            continue
+        distances[row_id] = float(np.sum((np.asarray(query_vector).reshape(-1) - vector) ** 2))
+    return distances
+
+
+def fetch_top_k_chunks(query: str, k=3, query_vector=None, snapshot=None):
+    """
+    The k best chunks for the query. When the index version ships a BM25
+    index (and HYBRID_SEARCH is on), the FAISS and BM25 rankings are fused by
+    reciprocal rank fusion; otherwise this is a plain FAISS top-k.
+
+    With an attribute index (and ATTRIBUTE_FILTERS on), price, rating and
+    category constraints in the query restrict both searches to the matching
+    rows. Constraints no row satisfies are dropped rather than returning nothing.
+
+    With a re-ranker, RERANK_CANDIDATES rows are retrieved and the
+    cross-encoder picks the k it scores highest.
+    """
+    if snapshot is None:
+        snapshot = index_holder.current()
+    if snapshot.embedder != embedder.name:
+        # Vectors from another embedder live in a different space: the results would be noise
+        raise EmbedderMismatchError(f"index {snapshot.version} was built with {snapshot.embedder}, not {embedder.name}")
+    if query_vector is None:
+        query_vector = get_query_embedding(query)
+
+    attributes = snapshot.attributes if ATTRIBUTE_FILTERS else None
+    selection = None
+    lexical_query = query
+    if attributes is not None:
+        with metrics.stage("attribute_filter"):
+            constraints = attributes.parse(query)
+            selection = attributes.select(constraints)
+        if selection is not None:
+            print(f"Filtering on {constraints}: {selection.count} of {selection.n_rows} rows")
+            if selection.count == 0:
+                selection = None
+            else:
+                lexical_query = constraints.remainder or query
+
+    candidate_k = max(k, RERANK_CANDIDATES) if reranker is not None else k
+    lexical = snapshot.lexical if HYBRID_SEARCH else None
+    vector_k = max(candidate_k, HYBRID_VECTOR_CANDIDATES) if lexical is not None else candidate_k
+    with metrics.stage("faiss_search"):
+        D, I = search_batcher.submit((snapshot, query_vector, vector_k, selection))  # D = distances, I = indices
+
+    metadata_list = snapshot.metadata
+    distances = {int(idx): float(dist) for idx, dist in zip(I[0], D[0]) if 0 <= idx < len(metadata_list)}
+    bm25_scores = {}
+    if lexical is None:
+        ranked = list(distances)[:candidate_k]
+    else:
+        with metrics.stage("lexical_search"):
+            doc_ids, scores = lexical.search(
+                lexical_query, max(HYBRID_LEXICAL_CANDIDATES, candidate_k), allowed=selection
+            )
+        bm25_scores = dict(zip(doc_ids.tolist(), scores.tolist()))
+        with metrics.stage("fusion"):
+            fused = reciprocal_rank_fusion([list(distances), list(bm25_scores)])
+            ranked = [row_id for row_id, _ in fused[:candidate_k]]
+            distances.update(vector_distances(snapshot.index, query_vector, [r for r in ranked if r not in distances]))
 
     results = []
-    print("Finding relevant matches from RAG")
-    for idx, dist in zip(I[0], D[0]):
-        if idx >= 0 and idx < len(metadata_list):
+    with metrics.stage("metadata_fetch"):
+        for idx in ranked:
+            if idx >= len(metadata_list):
+                continue
             entry = metadata_list[idx]
-            print(f"- Title: {entry['title']}, ASIN: {entry['parent_asin']}, Score: {dist:.4f}")
-            results.append({
+            result = {
                 "parent_asin": entry["parent_asin"],
                 "title": entry["title"],
                 "chunk_text": entry["chunk_text"],
-                "similarity": float(dist)
-            })
+                "token_counts": entry.get("token_counts")
+            }
+            if idx in distances:
+                result["similarity"] = distances[idx]
+            if idx in bm25_scores:
+                result["bm25"] = bm25_scores[idx]
+            results.append((idx, result))
 
-    return results
+    if reranker is not None and len(results) > 1:
+        with metrics.stage("rerank"):
+            rerank_scores = reranker.score(
+                query, [f"{snapshot.version}:{idx}" for idx, _ in results], [r["chunk_text"] for _, r in results]
+            )
+        for (_, result), score in zip(results, rerank_scores):
+            result["rerank_score"] = float(score)
+        # Stable sort: ties keep their retrieval order
+        order = sorted(range(len(results)), key=lambda i: -rerank_scores[i])
+        results = [results[i] for i in order]
 
+    print("Finding relevant matches from RAG")
+    for idx, result in results[:k]:
+        print(f"- Title: {result['title']}, ASIN: {result['parent_asin']}, "
+              f"Score: {distances.get(idx, float('nan')):.4f}, BM25: {bm25_scores.get(idx, 0.0):.2f}"
+              + (f", Rerank: {result['rerank_score']:.3f}" if "rerank_score" in result else ""))
+    return [result for _, result in results[:k]]
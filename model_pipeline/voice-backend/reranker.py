@@ -0,0 +1,134 @@
+"""
+Optional cross-encoder re-ranking of retrieved chunks.
+
+With RERANKER set to a sentence-transformers cross-encoder (for example
+cross-encoder/ms-marco-MiniLM-L-6-v2), fetch_top_k_chunks takes
+RERANK_CANDIDATES rows from retrieval and keeps the k the cross-encoder
+scores highest. All uncached (query, chunk) pairs of a request are scored in
+one batched predict() on the CPU. Scores are cached per normalized query and
+chunk, so a repeated question is re-ranked without running the model.
+
+Because the final order comes from the cross-encoder, the ANN stage only has
+to get the right chunk somewhere into the candidates, not to rank 1.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from context_packer import split_sections
+from embedding_cache import normalize_query
+
+RERANKER = os.getenv("RERANKER", "")  # unset = no re-ranking
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", 50))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", 32))
+# Cross-encoder input length per pair; the core and details sections fit in this
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", 256))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", 20000))
+
+
+def rerank_text(chunk_text):
+    """The part of a chunk the cross-encoder reads: reviews are left out."""
+    sections = split_sections(chunk_text)
+    return f"{sections['core']}\n{sections['details']}".strip()
+
+
+class PairScoreCache:
+    """LRU of cross-encoder scores keyed by (normalized query, chunk key)."""
+
+    def __init__(self, max_entries=RERANK_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, query, keys):
+        """{chunk key: score} for the pairs that are cached."""
+        query = normalize_query(query)
+        found = {}
+        with self._lock:
+            for key in keys:
+                score = self._entries.get((query, key))
+                if score is not None:
+                    self._entries.move_to_end((query, key))
+                    found[key] = score
+        return found
+
+    def put_many(self, query, scores):
+        query = normalize_query(query)
+        with self._lock:
+            for key, score in scores.items():
+                self._entries[(query, key)] = score
+                self._entries.move_to_end((query, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CrossEncoderReranker:
+    """sentence-transformers CrossEncoder on the CPU. The model is loaded on first use."""
+
+    def __init__(self, model, batch_size=RERANK_BATCH_SIZE, max_length=RERANK_MAX_LENGTH, cache_size=RERANK_CACHE_SIZE):
+        self.name = model
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.cache = PairScoreCache(cache_size)
+        self._model = None
+        self._lock = threading.Lock()
+        self._counters = {"requests": 0, "pairs_scored": 0, "pairs_cached": 0}
+
+    def _load(self):
+        from sentence_transformers import CrossEncoder
+
+        model = CrossEncoder(self.name, device="cpu", max_length=self.max_length)
+        print(f"Loaded re-ranker {self.name}")
+        return model
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._load()
+        return self._model
+
+    def warm(self):
+        self.model.predict([("warmup", "warmup")], batch_size=1, show_progress_bar=False)
+
+    def score(self, query, keys, texts):
+        """
+        float32 scores of (query, text) pairs, higher is more relevant. keys
+        identify the chunks for the cache (index version + row id).
+        """
+        scores = self.cache.get_many(query, keys)
+        missing = [i for i, key in enumerate(keys) if key not in scores]
+        if missing:
+            predicted = self.model.predict(
+                [(query, rerank_text(texts[i])) for i in missing],
+                batch_size=self.batch_size,
+                show_progress_bar=False
+            )
+            new_scores = {keys[i]: float(s) for i, s in zip(missing, np.asarray(predicted).reshape(-1))}
+            self.cache.put_many(query, new_scores)
+            scores.update(new_scores)
+
+        with self._lock:
+            self._counters["requests"] += 1
+            self._counters["pairs_scored"] += len(missing)
+            self._counters["pairs_cached"] += len(keys) - len(missing)
+        return np.array([scores[key] for key in keys], dtype="float32")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["cache_size"] = len(self.cache)
+        stats["model_loaded"] = self._model is not None
+        return stats
+
+
+def get_reranker(model=None):
+    """The configured CrossEncoderReranker, or None when RERANKER is unset."""
+    model = model or RERANKER
+    return CrossEncoderReranker(model) if model else None
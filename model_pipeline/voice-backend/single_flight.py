@@ -0,0 +1,230 @@
+"""
+Single-flight coalescing of identical concurrent requests.
+
+The first caller for a key becomes the leader and does the work; callers
+that arrive while it is in flight wait for the leader's result instead of
+repeating the embedding and LLM calls. A follower that times out, or
+whose leader fails, falls back to doing the work itself.
+
+With SINGLE_FLIGHT_DIR set, leaders in different gunicorn workers on the
+instance also coordinate: a per-key lock file picks one leader and its
+result is handed over through a small SQLite file in the same directory.
+Results must be JSON-serializable in that mode.
+
+AsyncSingleFlight does the same for coroutines on one event loop (the
+ASGI server), without the cross-worker mode.
+"""
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_TIMEOUT", 20))
+SINGLE_FLIGHT_DIR = os.getenv("SINGLE_FLIGHT_DIR")  # unset = coalesce within one worker only
+# Shared results older than this are not handed to followers
+SINGLE_FLIGHT_RESULT_TTL = float(os.getenv("SINGLE_FLIGHT_RESULT_TTL", 30))
+LOCK_POLL_SECONDS = 0.02
+# Lock files untouched for this long are removed when results are published
+STALE_LOCK_SECONDS = 3600
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, timeout=SINGLE_FLIGHT_TIMEOUT, shared_dir=SINGLE_FLIGHT_DIR,
+                 result_ttl=SINGLE_FLIGHT_RESULT_TTL):
+        self.timeout = timeout
+        self.shared_dir = shared_dir
+        self.result_ttl = result_ttl
+
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters = {"leaders": 0, "followers": 0, "shared_followers": 0, "fallbacks": 0}
+
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+            self._connect().execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        # One connection per thread, and never reuse one inherited across a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(os.path.join(self.shared_dir, "results.sqlite"), timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def do(self, key, fn, timeout=None):
+        """
+        Return (fn(), shared) where shared is True if the value came from
+        another caller's in-flight call. timeout caps how long a follower
+        waits before running fn itself.
+        """
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            self._count("followers")
+            if call.done.wait(timeout) and call.error is None:
+                return call.result, True
+            self._count("fallbacks")
+            return fn(), False
+
+        self._count("leaders")
+        try:
+            call.result, shared = self._lead(key, fn, timeout)
+            return call.result, shared
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _lead(self, key, fn, timeout):
+        if not self.shared_dir:
+            return fn(), False
+
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        with open(os.path.join(self.shared_dir, f"{digest}.lock"), "a+") as lock_file:
+            if self._try_lock(lock_file):
+                try:
+                    os.utime(lock_file.fileno())  # keeps a busy lock file from looking stale
+                    result = fn()
+                    self._publish(digest, result)
+                    return result, False
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+            # Another worker is leading: wait for it to let go of the lock, then read its result
+            waited_until = time.monotonic() + timeout
+            while time.monotonic() < waited_until:
+                time.sleep(LOCK_POLL_SECONDS)
+                if self._try_lock(lock_file):
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    break
+
+        result = self._read(digest)
+        if result is not None:
+            self._count("shared_followers")
+            return result, True
+        self._count("fallbacks")
+        return fn(), False
+
+    @staticmethod
+    def _try_lock(lock_file):
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _publish(self, digest, result):
+        try:
+            conn = self._connect()
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, created_at) VALUES (?, ?, ?)",
+                (digest, json.dumps(result), now)
+            )
+            conn.execute("DELETE FROM results WHERE created_at < ?", (now - self.result_ttl,))
+            self._remove_stale_locks()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            # Followers in other workers fall back to doing the work themselves
+            print("Single-flight publish failed:", e)
+
+    def _read(self, digest):
+        try:
+            row = self._connect().execute(
+                "SELECT value FROM results WHERE key = ? AND created_at >= ?",
+                (digest, time.time() - self.result_ttl)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print("Single-flight read failed:", e)
+            return None
+        return json.loads(row[0]) if row else None
+
+    def _remove_stale_locks(self):
+        cutoff = time.time() - STALE_LOCK_SECONDS
+        for name in os.listdir(self.shared_dir):
+            path = os.path.join(self.shared_dir, name)
+            try:
+                if name.endswith(".lock") and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                continue
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["in_flight"] = len(self._calls)
+        return stats
+
+
+class _AsyncCall:
+    def __init__(self):
+        self.done = asyncio.Event()
+        self.result = None
+        self.error = None
+
+
+class AsyncSingleFlight:
+    def __init__(self, timeout=SINGLE_FLIGHT_TIMEOUT):
+        self.timeout = timeout
+        self._calls = {}  # only touched from the event loop, so no lock
+        self._counters = {"leaders": 0, "followers": 0, "shared_followers": 0, "fallbacks": 0}
+
+    async def do(self, key, fn, timeout=None):
+        """Like SingleFlight.do, with fn a coroutine function."""
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        call = self._calls.get(key)
+        if call is not None:
+            self._counters["followers"] += 1
+            try:
+                await asyncio.wait_for(call.done.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            if call.done.is_set() and call.error is None:
+                return call.result, True
+            self._counters["fallbacks"] += 1
+            return await fn(), False
+
+        self._counters["leaders"] += 1
+        call = self._calls[key] = _AsyncCall()
+        try:
+            call.result = await fn()
+            return call.result, False
+        except BaseException as e:
+            # Includes cancellation: followers must not wait on a leader that is gone
+            call.error = e
+            raise
+        finally:
+            del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        stats = dict(self._counters)
+        stats["in_flight"] = len(self._calls)
+        return stats
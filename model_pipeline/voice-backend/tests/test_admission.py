@@ -0,0 +1,222 @@
+"""
+Tests for rate limiting and admission control.
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from unittest.mock import patch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from admission import AdmissionController, AsyncAdmissionController, TokenBucketLimiter, Rejected, client_id
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestTokenBucketLimiter:
+    def test_limits_after_the_burst_per_client(self):
+        limiter = TokenBucketLimiter(rate_per_minute=60, burst=2)
+
+        limiter.check("a")
+        limiter.check("a")
+        with pytest.raises(Rejected) as e:
+            limiter.check("a")
+        limiter.check("b")
+
+        assert e.value.status == 429
+        assert 0 < e.value.retry_after <= 1
+        assert limiter.stats() == {"allowed": 3, "limited": 1, "clients": 2}
+
+    def test_forgets_least_recent_clients(self):
+        limiter = TokenBucketLimiter(rate_per_minute=60, burst=1, max_clients=2)
+        for client in ("a", "b", "c"):
+            limiter.check(client)
+
+        # "a" was evicted, so it starts over with a full bucket
+        limiter.check("a")
+
+    def test_client_id_prefers_the_original_client(self):
+        assert client_id("203.0.113.7, 10.0.0.1", "10.0.0.2") == "203.0.113.7"
+        assert client_id(None, "10.0.0.2") == "10.0.0.2"
+
+    def test_client_id_ignores_what_the_client_put_in_the_header(self):
+        assert client_id("6.6.6.6, 203.0.113.7, 10.0.0.1", "10.0.0.2") == "203.0.113.7"
+        assert client_id("6.6.6.6", "10.0.0.2") == "10.0.0.2"
+        assert client_id("203.0.113.7, 10.0.0.1", "10.0.0.2", hop=0) == "10.0.0.2"
+        assert client_id("203.0.113.7, 10.0.0.1", "10.0.0.2", hop=1) == "10.0.0.1"
+
+
+class TestAdmissionController:
+    def test_refuses_a_limit_that_fills_every_thread(self):
+        with pytest.raises(ValueError):
+            AdmissionController(max_in_flight=16, threads=1)
+        AdmissionController(max_in_flight=4, threads=8)
+
+    def test_logs_that_a_single_thread_worker_has_no_limit(self, capsys):
+        AdmissionController(max_in_flight=0, max_queue=1, threads=1)
+        assert "Admission control is off" in capsys.readouterr().out
+
+        AdmissionController(max_in_flight=1, threads=2)
+        assert capsys.readouterr().out == ""
+
+    def test_queued_request_gets_the_released_slot(self):
+        admission = AdmissionController(max_in_flight=1, max_queue=1, max_queue_wait=2)
+        first = admission.acquire()
+        admitted = []
+
+        waiter = threading.Thread(target=lambda: admitted.append(admission.acquire()))
+        waiter.start()
+        time.sleep(0.05)
+        assert admission.stats()["waiting"] == 1
+
+        admission.release(first)
+        waiter.join()
+        assert len(admitted) == 1
+        assert admission.stats()["in_flight"] == 1
+
+    def test_sheds_when_the_queue_is_full(self):
+        admission = AdmissionController(max_in_flight=1, max_queue=0, max_queue_wait=2)
+        admission.acquire()
+
+        with pytest.raises(Rejected) as e:
+            admission.acquire()
+        assert e.value.status == 503
+        assert e.value.reason == "queue_full"
+
+    def test_sheds_when_the_expected_wait_is_too_long(self):
+        admission = AdmissionController(max_in_flight=1, max_queue=10, max_queue_wait=0.5)
+        admission.service_time = 5.0
+        admission.acquire()
+
+        started = time.monotonic()
+        with pytest.raises(Rejected) as e:
+            admission.acquire()
+        assert e.value.reason == "queue_wait"
+        assert e.value.retry_after_header() == "5"
+        assert time.monotonic() - started < 0.1
+
+    def test_sheds_after_waiting_the_maximum_queue_time(self):
+        admission = AdmissionController(max_in_flight=1, max_queue=1, max_queue_wait=0.1)
+        admission.service_time = 0.01
+        admission.acquire()
+
+        with pytest.raises(Rejected) as e:
+            admission.acquire()
+        assert e.value.reason == "queue_timeout"
+        stats = admission.stats()
+        assert stats["shed_timeout"] == 1
+        assert stats["waiting"] == 0
+
+    def test_async_controller_queues_and_sheds(self):
+        admission = AsyncAdmissionController(max_in_flight=1, max_queue=1, max_queue_wait=1)
+        admission.service_time = 0.1
+
+        async def scenario():
+            first = await admission.acquire()
+            waiter = asyncio.ensure_future(admission.acquire())
+            await asyncio.sleep(0.01)
+            with pytest.raises(Rejected):
+                await admission.acquire()  # queue of one is taken by the waiter
+            await admission.release(first)
+            await waiter
+
+        asyncio.run(scenario())
+        stats = admission.stats()
+        assert stats["admitted"] == 2
+        assert stats["shed_queue_full"] == 1
+
+
+class TestChatAdmission:
+    def test_chat_answers_429_with_retry_after(self):
+        import app as app_module
+
+        app_module.app.config['TESTING'] = True
+        limiter = TokenBucketLimiter(rate_per_minute=6, burst=0)
+        with patch("app.rate_limiter", limiter), app_module.app.test_client() as client:
+            response = client.post('/chat', json={"message": "hello"})
+
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "10"
+        assert app_module.admission.stats()["in_flight"] == 0
+
+    def test_chat_stream_sheds_with_503(self):
+        import app as app_module
+
+        app_module.app.config['TESTING'] = True
+        full = AdmissionController(max_in_flight=1, max_queue=0)
+        full.acquire()
+        with patch("app.admission", full), app_module.app.test_client() as client:
+            response = client.post('/chat/stream', json={"message": "hello"})
+
+        assert response.status_code == 503
+        assert "Retry-After" in response.headers
+
+
+SLOW_APP = """
+import time
+from admission import AdmissionController, Rejected, GUNICORN_THREADS
+
+admission = AdmissionController(threads=GUNICORN_THREADS)
+
+def app(environ, start_response):
+    try:
+        started = admission.acquire()
+    except Rejected as e:
+        start_response("503 Service Unavailable", [("Retry-After", e.retry_after_header())])
+        return [b"shed"]
+    try:
+        time.sleep(1)
+    finally:
+        admission.release(started)
+    start_response("200 OK", [])
+    return [b"ok"]
+"""
+
+
+class TestUnderGunicorn:
+    def test_gthread_workers_queue_and_shed(self, tmp_path):
+        pytest.importorskip("gunicorn")
+        (tmp_path / "slow_app.py").write_text(SLOW_APP)
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        env = dict(os.environ, GUNICORN_THREADS="4", ADMISSION_MAX_QUEUE_WAIT="0.5",
+                   PYTHONPATH=os.pathsep.join([str(tmp_path), BACKEND_DIR]))
+        env.pop("ADMISSION_MAX_IN_FLIGHT", None)
+        env.pop("ADMISSION_MAX_QUEUE", None)
+        server = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "--worker-class", "gthread", "--threads", "4",
+             "--bind", f"127.0.0.1:{port}", "slow_app:app"],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        url = f"http://127.0.0.1:{port}/"
+
+        def status():
+            try:
+                return urllib.request.urlopen(url, timeout=10).status
+            except urllib.error.HTTPError as e:
+                return e.code
+
+        try:
+            for _ in range(100):
+                try:
+                    socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            with ThreadPoolExecutor(6) as pool:
+                statuses = list(pool.map(lambda _: status(), range(6)))
+        finally:
+            server.terminate()
+            server.wait(10)
+
+        # 4 threads: 2 requests run, the rest are shed instead of waiting behind them
+        assert statuses.count(200) == 2
+        assert statuses.count(503) == 4
@@ -12,6 +12,7 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from app import app as flask_app
 from rag_helper import get_query_embedding, fetch_top_k_chunks
+from admission import TokenBucketLimiter
 
 # Setup test data
 @pytest.fixture
@@ -45,9 +46,21 @@ class TestApp:
         flask_app.config['TESTING'] = True
         with flask_app.test_client() as client:
             yield client
+
+    @pytest.fixture(autouse=True)
+    def isolated_pipeline(self):
+        # Fresh answer cache and a fixed query embedding for every endpoint test
+        import app as app_module
+        app_module.answer_cache.clear()
+        query_vector = np.array([[0.1, 0.2, 0.3]], dtype="float32")
+        query_vector /= np.linalg.norm(query_vector)
+        # Every test client request comes from one address: no rate limit here
+        with patch('app.get_query_embedding', return_value=query_vector), \
+                patch('app.rate_limiter', TokenBucketLimiter(rate_per_minute=0)):
+            yield
     
     @patch('app.fetch_top_k_chunks')
-    @patch('app.client.chat.completions.create')
+    @patch('app.shared_client.chat_completion')
     def test_chat_endpoint(self, mock_openai, mock_fetch_chunks, client):
         # Mock the OpenAI response
         mock_message = MagicMock()
@@ -76,9 +89,213 @@ class TestApp:
         assert "product_name" in data
         assert data["product_name"] == "Test Software 1"
 
+    @patch('app.fetch_top_k_chunks')
+    @patch('app.shared_client.chat_completion')
+    def test_chat_stream_endpoint(self, mock_openai, mock_fetch_chunks, client):
+        # Mock a streamed OpenAI response, one delta per chunk
+        deltas = ["Test Software 1 is a great ", "productivity tool. It costs ", "$49.99.\n", "Product: Test Software 1"]
+        stream_chunks = []
+        for text in deltas:
+            mock_chunk = MagicMock()
+            mock_chunk.choices = [MagicMock()]
+            mock_chunk.choices[0].delta.content = text
+            stream_chunks.append(mock_chunk)
+        mock_openai.return_value = iter(stream_chunks)
+
+        mock_fetch_chunks.return_value = [
+            {
+                "parent_asin": "ABC123",
+                "title": "Test Software 1",
+                "chunk_text": "Title: Test Software 1\nRating: 4.5\nPrice: $49.99"
+            }
+        ]
+
+        response = client.post('/chat/stream', json={'message': 'Tell me about test software'})
+        body = response.get_data(as_text=True)
+
+        assert response.status_code == 200
+        assert response.mimetype == "text/event-stream"
+
+        events = []
+        for block in body.strip().split("\n\n"):
+            event_line, data_line = block.split("\n")
+            events.append((event_line.replace("event: ", ""), json.loads(data_line.replace("data: ", ""))))
+
+        tokens = [payload["text"] for name, payload in events if name == "token"]
+        sentences = [payload["text"] for name, payload in events if name == "sentence"]
+        assert "".join(tokens) == "".join(deltas)
+        assert sentences[0] == "Test Software 1 is a great productivity tool."
+        # "It costs $49.99." is too short to speak on its own, so it is merged forward
+        assert sentences[-1] == "It costs $49.99. Product: Test Software 1"
+
+        name, final = events[-1]
+        assert name == "done"
+        assert final["product_name"] == "Test Software 1"
+        assert final["product_context"].startswith("Title: Test Software 1")
+
+    @patch('app.fetch_top_k_chunks')
+    @patch('app.shared_client.chat_completion')
+    def test_chat_answer_cache(self, mock_openai, mock_fetch_chunks, client):
+        mock_message = MagicMock()
+        mock_message.content = "This is a test response.\nProduct: Test Software 1"
+        mock_choice = MagicMock()
+        mock_choice.message = mock_message
+        mock_response = MagicMock()
+        mock_response.choices = [mock_choice]
+        mock_openai.return_value = mock_response
+        mock_fetch_chunks.return_value = [
+            {
+                "parent_asin": "ABC123",
+                "title": "Test Software 1",
+                "chunk_text": "Title: Test Software 1\nRating: 4.5\nPrice: $49.99"
+            }
+        ]
+
+        first = client.post('/chat', json={'message': 'Tell me about test software'})
+        # Exact tier: same question after normalization
+        second = client.post('/chat', json={'message': 'tell me about  test software'})
+        # Semantic tier: different wording, same embedding and same top chunk
+        third = client.post('/chat', json={'message': 'What is Test Software 1?'})
+
+        assert mock_openai.call_count == 1
+        assert json.loads(second.data) == json.loads(first.data)
+        assert json.loads(third.data) == json.loads(first.data)
+
+        import app as app_module
+        stats = app_module.answer_cache.stats()
+        assert stats["exact_hits"] == 1
+        assert stats["semantic_hits"] == 1
+
+    @patch('app.fetch_top_k_chunks')
+    @patch('app.shared_client.chat_completion')
+    def test_chat_coalesces_concurrent_identical_questions(self, mock_openai, mock_fetch_chunks):
+        import threading
+        import time
+
+        def slow_completion(**kwargs):
+            time.sleep(0.2)
+            mock_response = MagicMock()
+            mock_response.choices = [MagicMock()]
+            mock_response.choices[0].message.content = "This is a test response.\nProduct: Test Software 1"
+            return mock_response
+
+        mock_openai.side_effect = slow_completion
+        mock_fetch_chunks.return_value = []
+
+        responses = []
+
+        def ask():
+            with flask_app.test_client() as client:
+                responses.append(client.post('/chat', json={'message': 'Tell me about coalesced software'}))
+
+        threads = [threading.Thread(target=ask) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert mock_openai.call_count == 1
+        assert [response.status_code for response in responses] == [200] * 4
+        assert len({response.data for response in responses}) == 1
+
+    @patch('app.fetch_top_k_chunks')
+    @patch('app.shared_client.chat_completion')
+    def test_metrics_endpoint(self, mock_openai, mock_fetch_chunks, client):
+        from prometheus_client import REGISTRY
+
+        mock_message = MagicMock()
+        mock_message.content = "This is a test response.\nProduct: Test Software 1"
+        mock_response = MagicMock()
+        mock_response.choices = [MagicMock(message=mock_message)]
+        mock_response.usage.prompt_tokens = 120
+        mock_response.usage.completion_tokens = 30
+        mock_openai.return_value = mock_response
+        mock_fetch_chunks.return_value = []
+
+        def sample(name, **labels):
+            return REGISTRY.get_sample_value(name, labels) or 0
+
+        llm_before = sample('rag_stage_seconds_count', stage='llm')
+        answered_before = sample('rag_requests_total', endpoint='chat', outcome='answered')
+        tokens_before = sample('rag_llm_tokens_total', kind='prompt')
+
+        client.post('/chat', json={'message': 'Tell me about metrics software'})
+
+        assert sample('rag_stage_seconds_count', stage='llm') == llm_before + 1
+        assert sample('rag_requests_total', endpoint='chat', outcome='answered') == answered_before + 1
+        assert sample('rag_llm_tokens_total', kind='prompt') == tokens_before + 120
+
+        response = client.get('/metrics')
+        body = response.get_data(as_text=True)
+        assert response.status_code == 200
+        for stage in ("embed", "prompt_build", "llm", "total"):
+            assert f'rag_stage_seconds_bucket{{le="0.0005",stage="{stage}"}}' in body
+        # stats() of the caches and the OpenAI client are exported too
+        assert "rag_answer_cache_misses_total" in body
+        assert "rag_embedding_cache_hit_rate" in body
+        assert 'rag_openai_breaker_state{value="closed"} 1.0' in body
+
+    def test_reload_index_requires_admin_token(self, client):
+        response = client.post('/admin/reload-index', headers={'X-Admin-Token': 'wrong'})
+        assert response.status_code == 403
+
+    def test_health_and_readiness(self, client, mock_faiss_index, test_metadata):
+        import warmup
+        from index_holder import IndexHolder, IndexVersion
+
+        mock_faiss_index.ntotal = 2
+        mock_faiss_index.d = 3
+        holder = IndexHolder()
+        holder.swap(IndexVersion(mock_faiss_index, test_metadata, "test-version", "/tmp"))
+
+        assert client.get('/healthz').status_code == 200
+
+        with patch('app.index_holder', holder), patch('warmup.state', warmup.WarmupState()):
+            response = client.get('/readyz')
+            assert response.status_code == 503
+            assert json.loads(response.data)["warmup"]["status"] == "cold"
+
+            embed = MagicMock()
+            warmup.run_warmup(holder, embed_query=embed, warm_state=warmup.state)
+            response = client.get('/readyz')
+            body = json.loads(response.data)
+
+        assert response.status_code == 200
+        assert body["index_version"] == "test-version"
+        assert body["index_rows"] == 2
+        assert body["memory"]["rss_mb"] > 0
+        assert set(body["warmup"]["steps"]) == {"load_index", "touch_index", "touch_metadata", "synthetic_search", "openai_connect"}
+        assert embed.called
+        assert mock_faiss_index.search.call_count == warmup.WARMUP_SEARCHES
+
+    def test_chat_stream_requires_message(self, client):
+        response = client.post('/chat/stream', json={})
+        assert response.status_code == 400
+
+    def test_split_sentences_holds_back_short_fragments(self):
+        from chat_service import split_sentences
+
+        sentences, remainder = split_sentences("Sure. Test Software 1 costs $49.99. It is")
+        assert sentences == ["Sure. Test Software 1 costs $49.99."]
+        assert remainder == "It is"
+
+        sentences, remainder = split_sentences("Hi. ")
+        assert sentences == []
+        assert remainder.strip() == "Hi."
+
+        sentences, remainder = split_sentences("Thanks.", final=True)
+        assert sentences == ["Thanks."]
+        assert remainder == ""
+
 # Test rag_helper.py
 class TestRagHelper:
-    @patch('rag_helper.openai.embeddings.create')
+    @pytest.fixture(autouse=True)
+    def empty_embedding_cache(self):
+        import rag_helper
+        rag_helper.embedding_cache.clear()
+        yield
+
+    @patch('rag_helper.shared_client.embeddings')
     def test_get_query_embedding(self, mock_openai):
         # Mock the OpenAI embeddings response
         mock_data = MagicMock()
@@ -96,21 +313,30 @@ class TestRagHelper:
         # Check embedding shape and normalization
         assert embedding.shape[1] == 3  # dimensions
         assert np.isclose(np.linalg.norm(embedding), 1.0)  # should be normalized
+
+    @patch('rag_helper.shared_client.embeddings')
+    def test_get_query_embedding_uses_cache(self, mock_openai):
+        mock_data = MagicMock()
+        mock_data.embedding = [0.1, 0.2, 0.3]
+        mock_response = MagicMock()
+        mock_response.data = [mock_data]
+        mock_openai.return_value = mock_response
+
+        first = get_query_embedding("Tell me about  Test Software")
+        second = get_query_embedding("tell me about test software")
+
+        # Same question after normalization only hits the API once
+        mock_openai.assert_called_once()
+        assert np.array_equal(first, second)
     
-    @patch('rag_helper.faiss_index', new_callable=MagicMock)
-    @patch('rag_helper.metadata_list')
+    @patch('rag_helper.index_holder.current')
     @patch('rag_helper.get_query_embedding')
-    def test_fetch_top_k_chunks(self, mock_get_embedding, mock_metadata, mock_index, test_metadata):
-        # Mock embeddings and metadata
+    def test_fetch_top_k_chunks(self, mock_get_embedding, mock_current, mock_faiss_index, test_metadata):
+        from index_holder import IndexVersion
+
+        # Mock embeddings, FAISS search and metadata of the current index version
         mock_get_embedding.return_value = np.array([[0.1, 0.2, 0.3]])
-        mock_metadata.__getitem__.side_effect = test_metadata.__getitem__
-        mock_metadata.__len__.return_value = len(test_metadata)
-        
-        # Mock FAISS search
-        mock_index.search.return_value = (
-            np.array([[0.85, 0.75]]),  # distances
-            np.array([[0, 1]])         # indices
-        )
+        mock_current.return_value = IndexVersion(mock_faiss_index, test_metadata, "test-version", "/tmp")
         
         # Test chunk retrieval
         results = fetch_top_k_chunks("test query", k=2)
@@ -122,6 +348,39 @@ class TestRagHelper:
         assert "similarity" in results[0]
         assert "similarity" in results[1]
 
+    def test_fetch_top_k_chunks_refuses_mismatched_embedder(self, mock_faiss_index, test_metadata):
+        from index_holder import IndexVersion, EmbedderMismatchError
+
+        snapshot = IndexVersion(mock_faiss_index, test_metadata, "test-version", "/tmp", {"embedder": "local:other-model"})
+
+        with pytest.raises(EmbedderMismatchError):
+            fetch_top_k_chunks("test query", k=2, query_vector=np.zeros((1, 3), dtype="float32"), snapshot=snapshot)
+        mock_faiss_index.search.assert_not_called()
+
+    def test_load_faiss_index_mmap(self, tmp_path):
+        import faiss
+        from index_holder import load_faiss_index
+
+        vectors = np.eye(3, dtype="float32")
+        index = faiss.IndexFlatL2(3)
+        index.add(vectors)
+        path = str(tmp_path / "faiss_index.index")
+        faiss.write_index(index, path)
+
+        mapped = load_faiss_index(path, mmap=True)
+        _, in_memory_ids = load_faiss_index(path, mmap=False).search(vectors, 1)
+        _, mapped_ids = mapped.search(vectors, 1)
+
+        assert mapped.ntotal == 3
+        assert mapped_ids.tolist() == in_memory_ids.tolist() == [[0], [1], [2]]
+
+    def test_process_memory_report(self):
+        from memory_stats import process_memory
+
+        stats = process_memory()
+        assert stats["rss_mb"] > 0
+        assert set(stats) == {"rss_mb", "pss_mb", "shared_mb", "private_mb"}
+
 # Test model_validation.py (placeholder tests)
 def test_validation_thresholds():
     """Ensure validation thresholds are reasonable"""
@@ -0,0 +1,149 @@
+"""
+Tests for the ASGI entry point. Same contract as the Flask app.
+"""
+import os
+import sys
+import json
+import asyncio
+import numpy as np
+import pytest
+from unittest.mock import patch, MagicMock, AsyncMock
+from starlette.testclient import TestClient
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asgi_app
+from index_holder import IndexVersion
+from single_flight import AsyncSingleFlight
+from admission import TokenBucketLimiter
+
+TOP_CHUNKS = [
+    {
+        "parent_asin": "ABC123",
+        "title": "Test Software 1",
+        "chunk_text": "Title: Test Software 1\nRating: 4.5\nPrice: $49.99"
+    }
+]
+
+
+def completion(text):
+    response = MagicMock()
+    response.choices = [MagicMock()]
+    response.choices[0].message.content = text
+    return response
+
+
+class AsyncStream:
+    def __init__(self, deltas):
+        self.chunks = []
+        for text in deltas:
+            chunk = MagicMock()
+            chunk.choices = [MagicMock()]
+            chunk.choices[0].delta.content = text
+            self.chunks.append(chunk)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+class TestAsgiApp:
+    @pytest.fixture
+    def client(self):
+        # No `with` block, so the lifespan (warmup, index polling) does not run
+        return TestClient(asgi_app.app)
+
+    @pytest.fixture(autouse=True)
+    def isolated_pipeline(self):
+        asgi_app.answer_cache.clear()
+        query_vector = np.array([[0.1, 0.2, 0.3]], dtype="float32")
+        query_vector /= np.linalg.norm(query_vector)
+        snapshot = IndexVersion(MagicMock(), [], "test-version", "/tmp")
+        with patch('asgi_app.get_query_embedding_async', AsyncMock(return_value=query_vector)), \
+                patch('asgi_app.current_index', return_value=snapshot), \
+                patch('asgi_app.fetch_top_k_chunks', return_value=TOP_CHUNKS), \
+                patch('asgi_app.rate_limiter', TokenBucketLimiter(rate_per_minute=0)):
+            yield
+
+    @patch('asgi_app.async_client.chat_completion', new_callable=AsyncMock)
+    def test_chat_endpoint_matches_flask_shape(self, mock_openai, client):
+        mock_openai.return_value = completion("This is a test response.\nProduct: Test Software 1")
+
+        response = client.post('/chat', json={'message': 'Tell me about test software'})
+        data = response.json()
+
+        assert response.status_code == 200
+        assert set(data) == {"response", "product_name", "product_context", "index_version"}
+        assert data["product_name"] == "Test Software 1"
+        assert data["index_version"] == "test-version"
+        assert data["product_context"].startswith("Title: Test Software 1")
+
+    def test_chat_requires_message(self, client):
+        assert client.post('/chat', json={}).status_code == 400
+        assert client.post('/chat/stream', json={}).status_code == 400
+
+    @patch('asgi_app.async_client.chat_completion', new_callable=AsyncMock)
+    def test_chat_stream_endpoint(self, mock_openai, client):
+        deltas = ["Test Software 1 is a great ", "productivity tool. It costs ", "$49.99.\n", "Product: Test Software 1"]
+        mock_openai.return_value = AsyncStream(deltas)
+
+        response = client.post('/chat/stream', json={'message': 'Tell me about test software'})
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = []
+        for block in response.text.strip().split("\n\n"):
+            event_line, data_line = block.split("\n")
+            events.append((event_line.replace("event: ", ""), json.loads(data_line.replace("data: ", ""))))
+
+        assert "".join(payload["text"] for name, payload in events if name == "token") == "".join(deltas)
+        assert events[-1][0] == "done"
+        assert events[-1][1]["product_name"] == "Test Software 1"
+
+    @patch('asgi_app.async_client.chat_completion', new_callable=AsyncMock)
+    def test_upstream_unavailable_returns_503(self, mock_openai, client):
+        from openai_client import CircuitOpenError
+        mock_openai.side_effect = CircuitOpenError(12)
+
+        response = client.post('/chat', json={'message': 'Tell me about test software'})
+
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "13"
+
+    def test_chat_is_shed_when_no_slot_frees_up(self, client):
+        from admission import AsyncAdmissionController
+
+        full = AsyncAdmissionController(max_in_flight=1, max_queue=0)
+        full.in_flight = 1
+        with patch('asgi_app.admission', full):
+            response = client.post('/chat/stream', json={'message': 'Tell me about test software'})
+
+        assert response.status_code == 503
+        assert "Retry-After" in response.headers
+        assert full.stats()["shed_queue_full"] == 1
+
+    def test_health_and_metrics(self, client):
+        assert client.get('/healthz').json() == {"status": "ok"}
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        assert "rag_stage_seconds" in response.text
+
+    def test_concurrent_questions_share_one_llm_call(self):
+        flight = AsyncSingleFlight(timeout=5)
+        calls = []
+
+        async def answer():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"response": "shared"}
+
+        async def ask_many():
+            return await asyncio.gather(*(flight.do("v\x00q", answer) for _ in range(50)))
+
+        results = asyncio.run(ask_many())
+
+        assert len(calls) == 1
+        assert all(value == {"response": "shared"} for value, _ in results)
+        assert sum(shared for _, shared in results) == 49
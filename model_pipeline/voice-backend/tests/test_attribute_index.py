@@ -0,0 +1,122 @@
+"""
+Tests for attribute columns, bitmap selection and the query constraint parser.
+"""
+import os
+import sys
+import faiss
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from attribute_index import AttributeIndex, Selection, build_attribute_index, extract_attributes, parse_constraints
+
+CATEGORIES = ["Antivirus & Security", "Photography", "Business & Office"]
+ATTRIBUTES = [
+    {"price": 15.0, "rating": 4.7, "categories": ["Software", "Photography"]},
+    {"price": 19.99, "rating": 3.9, "categories": ["Software", "Photography"]},
+    {"price": 45.0, "rating": 4.6, "categories": ["Software", "Antivirus & Security"]},
+    {"price": None, "rating": 4.8, "categories": ["Software", "Antivirus & Security"]},
+    {"price": 120.0, "rating": None, "categories": ["Software", "Business & Office"]},
+    {"price": 20.5, "rating": 4.1, "categories": ["Software", "Photography"]},
+    {"price": 8.0, "rating": 2.5, "categories": ["Software"]},
+    {"price": 60.0, "rating": 4.5, "categories": ["Software", "Business & Office"]},
+    {"price": 9.99, "rating": 4.9, "categories": ["Software", "Antivirus & Security"]}
+]
+
+
+@pytest.fixture
+def attributes(tmp_path):
+    path = str(tmp_path / "attributes.bin")
+    build_attribute_index(path, ATTRIBUTES)
+    return AttributeIndex(path)
+
+
+def selected_rows(selection):
+    return np.flatnonzero(selection.contains(np.arange(selection.n_rows))).tolist()
+
+
+class TestConstraintParser:
+    @pytest.mark.parametrize("query, expected", [
+        ("cheap photo editor under $20", {"max_price": 20.0, "categories": ("Photography",)}),
+        ("top-rated antivirus", {"min_rating": 4.5, "categories": ("Antivirus & Security",)}),
+        ("office suite between $10 and $30", {"min_price": 10.0, "max_price": 30.0, "categories": ("Business & Office",)}),
+        ("something with at least 4 stars over 50 dollars", {"min_rating": 4.0, "min_price": 50.0}),
+        ("budget video converter", {"max_price": 20.0})
+    ])
+    def test_parses_price_rating_and_category(self, query, expected):
+        constraints = parse_constraints(query, CATEGORIES)
+
+        for key, value in expected.items():
+            assert getattr(constraints, key) == value
+
+    def test_bare_numbers_with_units_are_not_prices(self):
+        assert not parse_constraints("antivirus for under 5 devices")
+
+    def test_remainder_drops_constraint_phrases(self):
+        assert parse_constraints("photo editor under $20", CATEGORIES).remainder == "photo editor"
+
+    def test_extract_attributes_types_catalog_fields(self):
+        entry = {"price": "$1,299.00", "average_rating": "4.3", "categories": ["Software"], "main_category": "Photography"}
+
+        assert extract_attributes(entry) == {"price": 1299.0, "rating": 4.3, "categories": ["Photography", "Software"]}
+
+
+class TestAttributeIndex:
+    def test_price_bound_inside_a_bucket_is_refined(self, attributes):
+        selection = attributes.select(parse_constraints("under $20"))
+
+        # 20.5 shares no bucket with the bound but 19.99 and 15.0 do; unknown prices never match
+        assert selected_rows(selection) == [0, 1, 6, 8]
+        assert selection.count == 4
+
+    def test_constraints_are_combined(self, attributes):
+        selection = attributes.select(parse_constraints("top-rated photography under $20", attributes.filterable_categories))
+
+        assert selected_rows(selection) == [0]
+
+    def test_catalog_wide_categories_are_not_filters(self, attributes):
+        assert "Software" not in attributes.filterable_categories
+        assert attributes.select(parse_constraints("software", attributes.filterable_categories)) is None
+
+    def test_selection_restricts_faiss_search(self, attributes):
+        index = faiss.IndexFlatL2(2)
+        index.add(np.random.RandomState(0).rand(len(ATTRIBUTES), 2).astype("float32"))
+        selection = attributes.select(parse_constraints("antivirus", attributes.filterable_categories))
+
+        _, ids = index.search(np.zeros((1, 2), dtype="float32"), 5, params=selection.params)
+
+        assert sorted(i for i in ids[0].tolist() if i >= 0) == [2, 3, 8]
+
+    def test_selector_stays_inside_the_bitmap(self):
+        selection = Selection(np.array([0xFF, 0x01], dtype="uint8"), 9)
+
+        assert selection.selector.n == 2
+        assert selection.selector.is_member(8) and not selection.selector.is_member(9)
+        assert not selection.selector.is_member(16) and not selection.selector.is_member(70)
+
+
+class TestFilteredRetrieval:
+    def make_snapshot(self, attributes):
+        from index_holder import IndexVersion
+
+        vectors = np.random.RandomState(1).rand(len(ATTRIBUTES), 3).astype("float32")
+        index = faiss.IndexFlatL2(3)
+        index.add(vectors)
+        metadata = [{"parent_asin": f"ASIN{i}", "title": f"T{i}", "chunk_text": f"Title: T{i}"} for i in range(len(ATTRIBUTES))]
+        return IndexVersion(index, metadata, "v1", "/tmp", attributes=attributes), vectors
+
+    def test_fetch_top_k_chunks_only_returns_matching_rows(self, attributes):
+        from rag_helper import fetch_top_k_chunks
+
+        snapshot, vectors = self.make_snapshot(attributes)
+        results = fetch_top_k_chunks("cheap antivirus", k=3, query_vector=vectors[4:5], snapshot=snapshot)
+
+        assert [r["parent_asin"] for r in results] == ["ASIN8"]
+
+    def test_unsatisfiable_constraints_fall_back_to_unfiltered_search(self, attributes):
+        from rag_helper import fetch_top_k_chunks
+
+        snapshot, vectors = self.make_snapshot(attributes)
+        results = fetch_top_k_chunks("antivirus under $1", k=2, query_vector=vectors[4:5], snapshot=snapshot)
+
+        assert results[0]["parent_asin"] == "ASIN4"
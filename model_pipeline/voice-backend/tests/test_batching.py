@@ -0,0 +1,108 @@
+"""
+Tests for micro-batching of embeddings and FAISS searches.
+"""
+import os
+import sys
+import threading
+import numpy as np
+import pytest
+from unittest.mock import patch, MagicMock
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from batching import MicroBatcher
+
+
+def run_concurrently(batcher, items):
+    results = [None] * len(items)
+    barrier = threading.Barrier(len(items))
+
+    def worker(i):
+        barrier.wait()
+        results[i] = batcher.submit(items[i])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(items))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=5)
+    return results
+
+
+class TestMicroBatcher:
+    def test_concurrent_callers_share_one_batch(self):
+        calls = []
+
+        def double(items):
+            calls.append(list(items))
+            return [item * 2 for item in items]
+
+        batcher = MicroBatcher(double, window_ms=200, max_batch_size=8)
+        results = run_concurrently(batcher, [1, 2, 3, 4])
+
+        assert results == [2, 4, 6, 8]
+        assert len(calls) == 1
+        assert sorted(calls[0]) == [1, 2, 3, 4]
+        assert batcher.stats()["max_batch_size"] == 4
+
+    def test_full_batch_runs_before_window_and_splits(self):
+        batcher = MicroBatcher(lambda items: list(items), window_ms=200, max_batch_size=2)
+        results = run_concurrently(batcher, [1, 2, 3, 4])
+
+        assert results == [1, 2, 3, 4]
+        assert batcher.stats()["max_batch_size"] == 2
+
+    def test_errors_reach_every_caller(self):
+        def fail(items):
+            raise ValueError("upstream down")
+
+        batcher = MicroBatcher(fail, window_ms=0)
+        with pytest.raises(ValueError):
+            batcher.submit(1)
+
+    def test_disabled_window_calls_through(self):
+        batcher = MicroBatcher(lambda items: [len(items)], window_ms=0)
+        assert batcher.submit("x") == 1
+        assert batcher.stats() == {
+            "batches": 1, "items": 1, "mean_batch_size": 1.0, "max_batch_size": 1, "batch_sizes": {1: 1}
+        }
+
+
+class TestRagBatchFunctions:
+    @patch('rag_helper.shared_client.embeddings')
+    def test_embed_batch_dedupes_and_normalizes(self, mock_openai):
+        from rag_helper import embed_batch
+
+        first, second = MagicMock(), MagicMock()
+        first.embedding = [3.0, 4.0]
+        second.embedding = [0.0, 2.0]
+        mock_openai.return_value = MagicMock(data=[first, second])
+
+        rows = embed_batch(["a", "b", "a"])
+
+        assert mock_openai.call_args.kwargs["input"] == ["a", "b"]
+        assert np.allclose(rows[0], [[0.6, 0.8]])
+        assert np.allclose(rows[1], [[0.0, 1.0]])
+        assert rows[2] is rows[0]
+
+    def test_search_batch_groups_by_index_version(self):
+        from rag_helper import search_batch
+        from index_holder import IndexVersion
+
+        old_index, new_index = MagicMock(), MagicMock()
+        old_index.search.return_value = (
+            np.array([[0.1, 0.2, 0.3], [0.4, 0.5, 0.6]]),
+            np.array([[0, 1, 2], [3, 4, 5]])
+        )
+        new_index.search.return_value = (np.array([[0.9]]), np.array([[7]]))
+        old = IndexVersion(old_index, [], "v1", "/tmp")
+        new = IndexVersion(new_index, [], "v2", "/tmp")
+
+        results = search_batch([(old, np.zeros((1, 3)), 2), (new, np.ones((1, 3)), 1), (old, np.ones((1, 3)), 3)])
+
+        stacked, k = old_index.search.call_args.args
+        assert stacked.shape == (2, 3)
+        assert k == 3
+        new_index.search.assert_called_once()
+        assert results[0][1].tolist() == [[0, 1]]
+        assert results[1][1].tolist() == [[7]]
+        assert results[2][1].tolist() == [[3, 4, 5]]
@@ -0,0 +1,50 @@
+"""
+Tests for the retrieval microbenchmarks.
+"""
+import os
+import sys
+import json
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmark_retrieval import INDEX_TYPES, factory_string, pq_layout, run
+
+
+def bench_args(tmp_path, **overrides):
+    args = dict(
+        sizes=[400], types=list(INDEX_TYPES), dim=16, k=5, queries=40, single_queries=10, batch_size=[8],
+        threads=None, spread=0.5, seed=0, work_dir=str(tmp_path), output=str(tmp_path / "bench.json"), baseline=None
+    )
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+
+class TestBenchmarkRetrieval:
+    def test_index_layouts_fit_the_data(self):
+        assert factory_string("ivf", 1000000, 1536) == "IVF4000,Flat"
+        assert factory_string("ivfpq", 1000000, 1536) == "IVF4000,PQ96x8"
+        assert factory_string("ivfpq_refine", 400, 16) == "IVF10,PQ1x3,RFlat"
+        assert pq_layout(100000, 24) == (1, 8)
+
+    def test_reports_every_setting_with_exact_search_as_ground_truth(self, tmp_path):
+        report = run(bench_args(tmp_path))
+
+        with open(tmp_path / "bench.json", "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        assert saved["results"] == report["results"]
+        flat = [r for r in report["results"] if r["index"] == "flat"]
+        assert len(flat) == 1 and flat[0]["recall_at_k"] == 1.0
+        hnsw = [r for r in report["results"] if r["index"] == "hnsw"]
+        assert [r["params"]["efSearch"] for r in hnsw] == [16, 32, 64, 128]
+        assert {r["index"] for r in report["results"]} == set(INDEX_TYPES)
+        for result in report["results"]:
+            assert 0.0 <= result["recall_at_k"] <= 1.0
+            assert result["single"]["latency_ms"]["p50"] > 0
+            assert result["batched"]["8"]["qps"] > 0
+            assert result["bytes_per_vector"] > 0
+
+    def test_compares_with_a_baseline_run(self, tmp_path, capsys):
+        run(bench_args(tmp_path, types=["flat"]))
+        run(bench_args(tmp_path, types=["flat"], output=None, baseline=str(tmp_path / "bench.json")))
+
+        assert "single p50 x" in capsys.readouterr().out
@@ -0,0 +1,138 @@
+"""
+Tests for batched, concurrent embedding in index builds and its on-disk cache.
+"""
+import os
+import sys
+import time
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bulk_embedding import AdaptiveRateLimiter, build_embedder, embed_corpus, token_batches
+from build_embedding_cache import BuildEmbeddingCache, cache_key
+from embedders import OpenAIEmbedder
+from mock_openai_server import MockOpenAI, deterministic_embedding, start_mock_server
+from openai_client import PooledOpenAI
+
+
+@pytest.fixture
+def mock_api():
+    mock = MockOpenAI(dim=8, embed_latency="uniform:0,0.02", retry_after=0.01, seed=1)
+    server, base_url = start_mock_server(mock)
+    embedder = OpenAIEmbedder("m", client=PooledOpenAI(base_url=base_url, api_key="mock", max_retries=0))
+    yield mock, embedder
+    server.shutdown()
+
+
+class TestBulkEmbedding:
+    def test_batches_are_bounded_by_tokens_and_inputs(self):
+        assert token_batches([3, 3, 3, 3, 3], max_tokens=6, max_items=10) == [(0, 2), (2, 4), (4, 5)]
+        assert token_batches([1] * 5, max_tokens=100, max_items=2) == [(0, 2), (2, 4), (4, 5)]
+        # An input over the limit still goes, alone
+        assert token_batches([1, 50, 1], max_tokens=10, max_items=10) == [(0, 1), (1, 2), (2, 3)]
+        assert token_batches([], max_tokens=10, max_items=10) == []
+
+    def test_concurrent_batches_keep_corpus_order(self, mock_api):
+        mock, embedder = mock_api
+        texts = [f"chunk {i}" for i in range(40)]
+
+        vectors, stats = embed_corpus(embedder, texts, [10] * 40, concurrency=4, max_batch_tokens=30,
+                                      limiter=AdaptiveRateLimiter(0, 0), show_progress=False)
+
+        assert vectors.shape == (40, 8)
+        assert np.allclose(vectors[17], deterministic_embedding("chunk 17", 8), atol=1e-6)
+        assert stats["batches"] == mock.counters["embeddings"] == 14
+        assert stats["tokens"] == 400
+        assert stats["chunks_per_second"] > 0 and stats["tokens_per_second"] > 0
+
+    def test_rate_limits_halve_the_rate_and_are_retried(self, mock_api):
+        mock, embedder = mock_api
+        mock.rate_limit_rate = 0.3
+        limiter = AdaptiveRateLimiter(0, 0)
+        texts = [f"chunk {i}" for i in range(30)]
+
+        vectors, stats = embed_corpus(embedder, texts, [1] * 30, concurrency=3, max_batch_tokens=2,
+                                      limiter=limiter, show_progress=False)
+
+        assert np.allclose(vectors[29], deterministic_embedding("chunk 29", 8), atol=1e-6)
+        assert stats["rate_limited"] == mock.counters["rate_limited"] > 0
+        assert stats["requests"] == 15 + stats["rate_limited"]
+
+    def test_limiter_paces_large_batches(self):
+        # 1000 tokens/s with 10 seconds of burst: the overdraft is paid back first
+        limiter = AdaptiveRateLimiter(tokens_per_minute=60000, requests_per_minute=0)
+        limiter.acquire(10100)
+
+        started = time.monotonic()
+        limiter.acquire(1)
+        assert time.monotonic() - started >= 0.08
+
+        limiter.on_rate_limited(retry_after=0.01)
+        limiter.on_rate_limited(retry_after=0.01)
+        assert limiter.fraction == 0.25
+        limiter.on_success()
+        assert limiter.fraction == pytest.approx(0.3)
+
+    def test_build_embedder_skips_client_retries(self):
+        embedder = build_embedder(OpenAIEmbedder("text-embedding-3-small"), concurrency=6)
+
+        assert embedder.name == "openai:text-embedding-3-small"
+        assert embedder.client.max_retries == 0
+        assert embedder.client.pool_size == 6
+
+
+class TestBuildEmbeddingCache:
+    def test_rebuild_only_embeds_changed_chunks(self, mock_api, tmp_path):
+        mock, embedder = mock_api
+        texts = [f"chunk {i}" for i in range(20)]
+        first, first_stats = embed_corpus(embedder, texts, [1] * 20, max_batch_tokens=5, limiter=AdaptiveRateLimiter(0, 0),
+                                          cache=BuildEmbeddingCache(str(tmp_path)), show_progress=False)
+
+        texts[3] = "chunk 3, updated"
+        texts.append("chunk 20")
+        cache = BuildEmbeddingCache(str(tmp_path))
+        second, stats = embed_corpus(embedder, texts, [1] * 21, max_batch_tokens=5, limiter=AdaptiveRateLimiter(0, 0),
+                                     cache=cache, show_progress=False)
+
+        assert first_stats["cache_hits"] == 0
+        assert stats["embedded"] == 2
+        assert stats["cache_hits"] == 19
+        assert stats["cache_hit_rate"] == pytest.approx(19 / 21, abs=1e-4)
+        assert np.array_equal(second[:3], first[:3])
+        assert np.allclose(second[3], deterministic_embedding("chunk 3, updated", 8), atol=1e-6)
+        assert mock.counters["embeddings"] == 4 + 1
+        assert cache.stats()["stored"] == 2
+
+    def test_vectors_are_keyed_by_embedder_and_survive_reopening(self, tmp_path):
+        cache = BuildEmbeddingCache(str(tmp_path), dtype="float16", shard_rows=2)
+        keys = [cache_key("local:a", t) for t in ("x", "y", "z")]
+        cache.add(keys, np.eye(3, dtype="float32"))
+        cache.close()
+
+        reopened = BuildEmbeddingCache(str(tmp_path))
+        vectors, found = reopened.get_many([keys[2], cache_key("local:b", "x"), keys[0]])
+
+        assert found.tolist() == [True, False, True]
+        assert vectors.dtype == np.float32
+        assert vectors[0].tolist() == [0, 0, 1] and vectors[2].tolist() == [1, 0, 0]
+        assert len([f for f in os.listdir(tmp_path) if f.endswith(".npy")]) == 2
+        assert reopened.stats() == {"hits": 2, "misses": 1, "stored": 0, "hit_rate": 0.6667}
+
+    def test_prune_keeps_only_what_the_build_used(self, tmp_path):
+        keys = [cache_key("local:a", str(i)) for i in range(8)]
+        cache = BuildEmbeddingCache(str(tmp_path), shard_rows=4)
+        cache.add(keys, np.arange(8 * 2, dtype="float32").reshape(8, 2))
+        cache.close()
+        open(tmp_path / "shard-stray.npy", "wb").close()
+
+        build = BuildEmbeddingCache(str(tmp_path))
+        build.get_many([keys[0], keys[1], keys[2], keys[6]])
+        assert build.prune() == {"keys": 4, "shards": 1, "files": 1}
+        build.close()
+
+        reopened = BuildEmbeddingCache(str(tmp_path))
+        vectors, found = reopened.get_many(keys)
+        assert found.tolist() == [True, True, True, False, False, False, True, False]
+        assert vectors[6].tolist() == [12, 13]
+        # The mostly dead second shard was rewritten with its one live row
+        assert len([f for f in os.listdir(tmp_path) if f.endswith(".npy")]) == 2
@@ -0,0 +1,112 @@
+"""
+Tests for the query embedding and answer caches.
+"""
+import os
+import sys
+import time
+import sqlite3
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embedding_cache import EmbeddingCache, make_cache_key
+from answer_cache import AnswerCache
+
+
+class TestEmbeddingCache:
+    def test_key_normalizes_query_and_includes_model(self):
+        assert make_cache_key("  Best  Antivirus ", "m1") == make_cache_key("best antivirus", "m1")
+        assert make_cache_key("best antivirus", "m1") != make_cache_key("best antivirus", "m2")
+
+    def test_lru_hit_miss_and_eviction(self):
+        cache = EmbeddingCache(max_entries=2, ttl_seconds=60, shared_path=None)
+        cache.put("a", "m", np.ones((1, 3), dtype="float32"))
+        cache.put("b", "m", np.ones((1, 3), dtype="float32"))
+        assert cache.get("a", "m") is not None  # "a" is now most recently used
+        cache.put("c", "m", np.ones((1, 3), dtype="float32"))
+
+        assert cache.get("b", "m") is None
+        assert cache.get("c", "m") is not None
+
+        stats = cache.stats()
+        assert stats["hits"] == 2
+        assert stats["misses"] == 1
+        assert stats["size"] == 2
+
+    def test_ttl_expiry(self):
+        cache = EmbeddingCache(max_entries=10, ttl_seconds=0.01, shared_path=None)
+        cache.put("a", "m", np.ones((1, 3), dtype="float32"))
+        time.sleep(0.02)
+        assert cache.get("a", "m") is None
+
+    def test_shared_tier_is_visible_to_other_workers(self, tmp_path):
+        shared = str(tmp_path / "embeddings.sqlite")
+        vector = np.array([[0.1, 0.2, 0.3]], dtype="float32")
+
+        worker_a = EmbeddingCache(max_entries=10, ttl_seconds=60, shared_path=shared)
+        worker_b = EmbeddingCache(max_entries=10, ttl_seconds=60, shared_path=shared)
+        worker_a.put("best antivirus", "m", vector)
+
+        cached = worker_b.get("Best antivirus", "m")
+        assert np.array_equal(cached, vector)
+        assert worker_b.stats()["shared_hits"] == 1
+
+        # Promoted into worker B's own LRU
+        worker_b.get("best antivirus", "m")
+        assert worker_b.stats()["hits"] == 1
+
+    def test_put_leaves_the_callers_array_writable(self):
+        cache = EmbeddingCache(max_entries=10, ttl_seconds=60, shared_path=None)
+        vector = np.ones((1, 3), dtype="float32")
+        cache.put("a", "m", vector)
+
+        vector[0, 0] = 5
+        assert cache.get("a", "m").tolist() == [[1, 1, 1]]
+        assert not cache.get("a", "m").flags.writeable
+
+    def test_shared_tier_is_pruned_when_the_lru_evicts(self, tmp_path):
+        shared = str(tmp_path / "embeddings.sqlite")
+        cache = EmbeddingCache(max_entries=2, ttl_seconds=60, shared_path=shared, shared_max_entries=3, prune_interval=0)
+        conn = sqlite3.connect(shared)
+        for i in range(5):
+            cache.put(f"q{i}", "m", np.ones((1, 3), dtype="float32"))
+        conn.execute("UPDATE embeddings SET created_at = 0 WHERE key = ?", (make_cache_key("q4", "m"),))
+        conn.commit()
+        cache.put("q5", "m", np.ones((1, 3), dtype="float32"))
+
+        keys = {key for key, in conn.execute("SELECT key FROM embeddings")}
+        # The expired row went first, then the oldest past three
+        assert keys == {make_cache_key(q, "m") for q in ("q2", "q3", "q5")}
+
+
+class TestAnswerCache:
+    @pytest.fixture
+    def result(self):
+        return {"response": "Answer", "product_name": "Test Software 1", "product_context": "Title: Test Software 1"}
+
+    def test_exact_tier_is_keyed_by_version(self, result):
+        cache = AnswerCache(semantic_radius=0.05)
+        cache.store("Best antivirus?", None, None, "v1", result)
+
+        assert cache.lookup("best  antivirus?", "v1") == result
+        # A new index version drops every entry
+        assert cache.lookup("best antivirus?", "v2") is None
+        assert cache.lookup("best antivirus?", "v1") is None
+        assert cache.stats()["invalidations"] == 2
+
+    def test_semantic_tier_needs_same_top_chunk_and_radius(self, result):
+        cache = AnswerCache(semantic_radius=0.05)
+        stored = np.array([1.0, 0.0, 0.0], dtype="float32")
+        cache.store("first question", stored, "ABC123", "v1", result)
+
+        close = np.array([0.99, 0.14, 0.0], dtype="float32")
+        close /= np.linalg.norm(close)
+        far = np.array([0.6, 0.8, 0.0], dtype="float32")
+
+        assert cache.lookup_similar(close, "ABC123", "v1") == result
+        assert cache.lookup_similar(close, "DEF456", "v1") is None
+        assert cache.lookup_similar(far, "ABC123", "v1") is None
+
+        stats = cache.stats()
+        assert stats["semantic_hits"] == 1
+        assert stats["misses"] == 2
@@ -0,0 +1,106 @@
+"""
+Tests for streaming catalog reads and the block-wise artifact writers of index builds.
+"""
+import os
+import sys
+import json
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from attribute_index import AttributeIndex, AttributeIndexWriter, build_attribute_index
+from bulk_embedding import combine_stats
+from catalog_stream import ReviewStore, blocks, iter_catalog, iter_jsonl
+from lexical_index import LexicalIndex, LexicalIndexWriter, build_lexical_index
+from metadata_store import MetadataJsonWriter, MetadataStore, MetadataStoreWriter
+
+
+@pytest.fixture
+def catalog_files(tmp_path):
+    meta = [
+        {"parent_asin": "A1", "title": "Office Suite", "price": "$49.99", "average_rating": 4.6, "categories": ["Office"]},
+        {"title": "No ASIN"},
+        {"parent_asin": "A2", "title": "Antivirus", "price": 19.99, "categories": ["Security"]},
+        {"parent_asin": "A3", "title": "Photo Editor"}
+    ]
+    reviews = [{"parent_asin": "A1", "text": f"review {i}", "verified_purchase": True} for i in range(7)]
+    reviews += [
+        {"parent_asin": "A2", "text": "unverified", "verified_purchase": False},
+        {"parent_asin": "A2", "text": "", "verified_purchase": True},
+        {"parent_asin": "A2", "text": "keeps me safe", "verified_purchase": True},
+        {"text": "no product", "verified_purchase": True}
+    ]
+    paths = []
+    for name, rows in (("meta.jsonl", meta), ("reviews.jsonl", reviews)):
+        path = tmp_path / name
+        path.write_text("\n".join(json.dumps(row) for row in rows) + "\n\n", encoding="utf-8")
+        paths.append(str(path))
+    return paths
+
+
+class TestCatalogStream:
+    def test_reviews_keep_the_first_verified_per_product(self, catalog_files, tmp_path):
+        store = ReviewStore(str(tmp_path / "reviews.db"))
+
+        assert store.load(iter_jsonl(catalog_files[1])) == 6
+        assert store.reviews_of("A1") == [f"review {i}" for i in range(5)]
+        assert store.reviews_of("A2") == ["keeps me safe"]
+        assert store.reviews_of("A3") == []
+        store.close()
+        assert not os.path.exists(tmp_path / "reviews.db")
+
+    def test_catalog_entries_are_built_as_the_file_is_read(self, catalog_files, tmp_path):
+        store = ReviewStore(str(tmp_path / "reviews.db"))
+        store.load(iter_jsonl(catalog_files[1]))
+
+        entries = list(iter_catalog(iter_jsonl(catalog_files[0]), store, limit=0))
+        limited = list(iter_catalog(iter_jsonl(catalog_files[0]), store, limit=3))
+
+        assert [e["parent_asin"] for e in entries] == ["A1", "A2", "A3"]
+        assert [e["parent_asin"] for e in limited] == ["A1", "A2"]
+        assert entries[1]["chunk_text"].startswith("Title: Antivirus\nRating: \nPrice: 19.99\n")
+        assert entries[1]["chunk_text"].endswith("Top Reviews:\nkeeps me safe\n")
+        assert entries[0]["attributes"] == {"price": 49.99, "rating": 4.6, "categories": ["Office"]}
+        assert set(entries[0]["token_counts"]) == {"core", "details", "reviews"}
+        assert [len(b) for b in blocks(iter(range(5)), 2)] == [2, 2, 1]
+
+    def test_block_writers_match_the_one_shot_builders(self, tmp_path):
+        entries = [
+            {"parent_asin": f"A{i}", "title": f"Product {i}", "chunk_text": f"Title: Product {i} office tool {i % 3}",
+             "attributes": {"price": 5.0 * i, "rating": None, "categories": ["Office" if i % 2 else "Games"]}}
+            for i in range(10)
+        ]
+        build_lexical_index(str(tmp_path / "lexical_one.bin"), [e["chunk_text"] for e in entries])
+        build_attribute_index(str(tmp_path / "attributes_one.bin"), [e["attributes"] for e in entries])
+
+        lexical = LexicalIndexWriter(str(tmp_path / "lexical_blocks.bin"))
+        attributes = AttributeIndexWriter(str(tmp_path / "attributes_blocks.bin"))
+        store = MetadataStoreWriter(str(tmp_path / "metadata.db"))
+        json_writer = MetadataJsonWriter(str(tmp_path / "metadata.json"))
+        for block in blocks(entries, 4):
+            lexical.add([e["chunk_text"] for e in block])
+            attributes.add([e["attributes"] for e in block])
+            store.add(block)
+            json_writer.add(block)
+        for writer in (lexical, attributes, store, json_writer):
+            writer.close()
+
+        for one, streamed in (("lexical_one.bin", "lexical_blocks.bin"), ("attributes_one.bin", "attributes_blocks.bin")):
+            assert (tmp_path / one).read_bytes() == (tmp_path / streamed).read_bytes()
+        assert LexicalIndex(str(tmp_path / "lexical_blocks.bin")).search("product 7", 1)[0].tolist() == [7]
+        assert len(AttributeIndex(str(tmp_path / "attributes_blocks.bin"))) == 10
+        assert list(MetadataStore(str(tmp_path / "metadata.db"))) == entries
+        assert json.loads((tmp_path / "metadata.json").read_text(encoding="utf-8")) == entries
+
+    def test_block_stats_are_combined(self):
+        limiter = {"requests": 3, "rate_limited": 1, "errors": 0, "waited_seconds": 0.5, "rate_fraction": 0.55}
+        runs = [
+            {"chunks": 4, "embedded": 3, "tokens": 30, "batches": 1, "seconds": 1.0, "cache_hits": 1, **limiter},
+            {"chunks": 4, "embedded": 1, "tokens": 10, "batches": 1, "seconds": 1.0, "cache_hits": 3, **limiter}
+        ]
+
+        stats = combine_stats(runs)
+
+        assert stats["embedded"] == 4 and stats["tokens"] == 40 and stats["batches"] == 2
+        assert stats["chunks_per_second"] == 2.0 and stats["tokens_per_second"] == 20.0
+        assert stats["cache_hit_rate"] == 0.5
+        assert stats["requests"] == 3 and stats["rate_fraction"] == 0.55
@@ -0,0 +1,118 @@
+"""
+Tests for token-budgeted context packing.
+"""
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from context_packer import count_tokens, split_sections, section_token_counts, fit_chunk, pack_context
+
+
+def make_chunk(asin, reviews=5, details=3, similarity=0.5):
+    details_str = "\n".join(f"Detail {i}: value number {i}" for i in range(details))
+    reviews_str = "\n".join(f"Review {i}: this product worked well for our whole team." for i in range(reviews))
+    chunk_text = f"""Title: Product {asin}
+Rating: 4.5
+Price: $49.99
+Categories: Software
+Features: Fast, Simple
+Description: A product for testing.
+Details:
+{details_str}
+
+Top Reviews:
+{reviews_str}
+"""
+    return {
+        "parent_asin": asin,
+        "title": f"Product {asin}",
+        "chunk_text": chunk_text,
+        "token_counts": section_token_counts(chunk_text),
+        "similarity": similarity
+    }
+
+
+class TestContextPacker:
+    def test_split_sections(self):
+        sections = split_sections(make_chunk("A")["chunk_text"])
+
+        assert sections["core"].startswith("Title: Product A")
+        assert sections["core"].endswith("Description: A product for testing.")
+        assert sections["details"].startswith("Details:\nDetail 0")
+        assert sections["reviews"].startswith("Top Reviews:\nReview 0")
+        assert split_sections("Title: Bare")["reviews"] == ""
+
+    def test_whole_chunks_fit_a_large_budget(self):
+        chunks = [make_chunk("A"), make_chunk("B")]
+
+        context, used, tokens = pack_context(chunks, budget=10000)
+
+        assert [chunk["parent_asin"] for chunk in used] == ["A", "B"]
+        assert "Review 4" in context and "Product B" in context
+        assert tokens >= count_tokens(context) - 5
+
+    def test_trims_reviews_before_details(self):
+        chunk = make_chunk("A")
+        full = sum(chunk["token_counts"].values())
+        reviews_only = chunk["token_counts"]["reviews"]
+
+        text, tokens = fit_chunk(chunk, full - reviews_only // 2)
+
+        assert "Detail 2" in text
+        assert "Review 0" in text
+        assert "Review 4" not in text
+        assert tokens <= full - reviews_only // 2
+
+    def test_drops_reviews_then_trims_details(self):
+        chunk = make_chunk("A", details=10)
+        counts = chunk["token_counts"]
+
+        text, tokens = fit_chunk(chunk, counts["core"] + counts["details"] // 2)
+
+        assert "Top Reviews" not in text
+        assert "Detail 0" in text
+        assert "Detail 9" not in text
+        assert tokens <= counts["core"] + counts["details"] // 2
+
+    def test_stays_within_budget_and_drops_lower_chunks(self):
+        chunks = [make_chunk("A"), make_chunk("B"), make_chunk("C")]
+        budget = sum(chunks[0]["token_counts"].values()) + 10
+
+        context, used, tokens = pack_context(chunks, budget=budget)
+
+        assert tokens <= budget
+        assert count_tokens(context) <= budget + 5
+        assert used[0]["parent_asin"] == "A"
+        assert "Product C" not in context
+
+    def test_skips_a_chunk_that_does_not_fit_for_a_shorter_one(self):
+        long_core = make_chunk("B")
+        long_core["chunk_text"] = long_core["chunk_text"].replace("A product for testing.", "A long description. " * 50)
+        long_core["token_counts"] = section_token_counts(long_core["chunk_text"])
+        chunks = [make_chunk("A", reviews=0, details=0), long_core, make_chunk("C", reviews=0, details=0)]
+        separator = count_tokens("\n---\n")
+        budget = 2 * sum(chunks[0]["token_counts"].values()) + 2 * separator + 20
+
+        context, used, tokens = pack_context(chunks, budget=budget)
+
+        assert [chunk["parent_asin"] for chunk in used] == ["A", "C"]
+        assert tokens <= budget
+
+    def test_score_cutoff_drops_distant_chunks(self):
+        chunks = [make_chunk("A", similarity=0.4), make_chunk("B", similarity=1.8)]
+
+        context, used, _ = pack_context(chunks, budget=10000, max_distance=1.5)
+        assert [chunk["parent_asin"] for chunk in used] == ["A"]
+
+        context, used, tokens = pack_context([make_chunk("B", similarity=1.8)], budget=10000, max_distance=1.5)
+        assert (context, used, tokens) == ("", [], 0)
+
+    def test_best_chunk_is_truncated_rather_than_dropped(self):
+        chunk = make_chunk("A")
+        chunk["token_counts"] = None  # metadata built before token counts were stored
+
+        context, used, tokens = pack_context([chunk], budget=8)
+
+        assert used == [chunk]
+        assert context.startswith("Title: Product A")
+        assert 0 < tokens <= 8
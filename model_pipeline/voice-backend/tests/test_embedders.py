@@ -0,0 +1,60 @@
+"""
+Tests for the pluggable embedders.
+"""
+import os
+import sys
+import numpy as np
+import pytest
+from unittest.mock import MagicMock
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import embedders
+from embedders import Embedder, OpenAIEmbedder, LocalEmbedder, get_embedder
+
+
+def embeddings_response(rows):
+    response = MagicMock()
+    response.data = [MagicMock(embedding=row) for row in rows]
+    response.usage.total_tokens = 3
+    return response
+
+
+class TestEmbedders:
+    def test_get_embedder_parses_spec_and_shares_instances(self):
+        openai_embedder = get_embedder("openai:text-embedding-3-small")
+        local_embedder = get_embedder("local:sentence-transformers/all-MiniLM-L6-v2")
+
+        assert isinstance(openai_embedder, OpenAIEmbedder)
+        assert openai_embedder.name == "openai:text-embedding-3-small"
+        assert isinstance(local_embedder, LocalEmbedder)
+        assert local_embedder.name == "local:sentence-transformers/all-MiniLM-L6-v2"
+        assert get_embedder("openai:text-embedding-3-small") is openai_embedder
+        with pytest.raises(ValueError):
+            get_embedder("bogus:model")
+
+    def test_backends_must_implement_embed(self):
+        class Incomplete(Embedder):
+            name = "test:incomplete"
+
+        with pytest.raises(TypeError):
+            Incomplete()
+
+    def test_openai_embedder_normalizes_and_splits_large_inputs(self, monkeypatch):
+        monkeypatch.setattr(embedders, "OPENAI_MAX_INPUTS", 2)
+        client = MagicMock()
+        client.embeddings.side_effect = lambda input, model: embeddings_response([[3.0, 4.0]] * len(input))
+
+        vectors = OpenAIEmbedder("m", client=client).embed(["a", "b", "c"])
+
+        assert client.embeddings.call_count == 2
+        assert vectors.dtype == np.float32
+        assert np.allclose(vectors, [[0.6, 0.8]] * 3)
+
+    def test_local_embedder_encodes_normalized_batches(self):
+        pytest.importorskip("sentence_transformers")
+        embedder = LocalEmbedder("sentence-transformers/all-MiniLM-L6-v2", accel="none", batch_size=2)
+
+        vectors = embedder.embed(["antivirus software", "photo editor", "tax software"])
+
+        assert vectors.shape == (3, embedder.dimension())
+        assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0, atol=1e-5)
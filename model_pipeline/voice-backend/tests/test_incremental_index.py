@@ -0,0 +1,135 @@
+"""
+Tests for incremental, ASIN-keyed index updates and tombstone compaction.
+"""
+import os
+import sys
+import json
+import datetime
+import gc
+import faiss
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from incremental_index import (
+    apply_diff, as_id_mapped, compact, diff_catalog, id_mapped_index, is_tombstone, needs_compaction, tombstone_count
+)
+
+
+def entry(asin, text, price=10.0):
+    return {"parent_asin": asin, "title": asin, "chunk_text": text, "token_counts": {"core": 2},
+            "attributes": {"price": price, "rating": 4.0, "categories": ["Software"]}}
+
+
+def unit(*values):
+    vector = np.array(values, dtype="float32")
+    return vector / np.linalg.norm(vector)
+
+
+@pytest.fixture
+def deployed():
+    metadata = [entry("A", "alpha"), entry("B", "bravo"), entry("C", "charlie"), entry("D", "delta")]
+    return id_mapped_index(np.eye(4, dtype="float32")), metadata
+
+
+class TestIncrementalIndex:
+    def test_diff_sorts_products_by_what_needs_embedding(self, deployed):
+        _, previous = deployed
+        catalog = [entry("B", "bravo", price=12.0), entry("A", "alpha v2"), entry("C", "charlie"), entry("E", "echo")]
+
+        diff = diff_catalog(previous, catalog)
+
+        assert diff.summary() == {"added": 1, "changed": 1, "updated": 1, "deleted": 1, "unchanged": 1}
+        assert [e["parent_asin"] for e in diff.to_embed()] == ["A", "E"]
+        assert diff.deleted == [3]
+
+    def test_update_keeps_row_ids_and_tombstones_deleted_products(self, deployed):
+        index, previous = deployed
+        catalog = [entry("B", "bravo", price=12.0), entry("A", "alpha v2"), entry("C", "charlie"), entry("E", "echo")]
+        diff = diff_catalog(previous, catalog)
+        new_vectors = np.vstack([unit(1, 1, 0, 0), unit(0, 0, 1, 1)])
+
+        index, metadata = apply_diff(index, previous, diff, new_vectors)
+
+        assert len(metadata) == 5 and index.ntotal == 4
+        assert is_tombstone(metadata[3]) and metadata[4]["parent_asin"] == "E"
+        assert metadata[1]["attributes"]["price"] == 12.0
+        assert np.allclose(index.reconstruct(0), new_vectors[0])
+        _, ids = index.search(np.eye(4, dtype="float32")[3:4], 2)
+        assert 3 not in ids[0].tolist() and 4 in ids[0].tolist()
+        assert previous[3]["parent_asin"] == "D"
+
+    def test_compaction_renumbers_without_re_embedding(self, deployed):
+        index, previous = deployed
+        index, metadata = apply_diff(index, previous, diff_catalog(previous, previous[1:]), np.zeros((0, 4)))
+
+        compacted, rows = compact(index, metadata)
+
+        assert [e["parent_asin"] for e in rows] == ["B", "C", "D"]
+        assert compacted.ntotal == 3
+        assert np.allclose(compacted.reconstruct(0), np.eye(4)[1])
+        assert tombstone_count(rows) == 0
+
+    def test_compaction_schedule(self, deployed):
+        _, metadata = deployed
+        metadata = metadata + [{"deleted": True}]
+        now = datetime.datetime(2026, 1, 2, tzinfo=datetime.timezone.utc)
+
+        assert needs_compaction(metadata, "2026-01-01T12:00:00+00:00", now=now, ratio=0.5, interval_hours=0) is False
+        assert needs_compaction(metadata, "2026-01-01T12:00:00+00:00", now=now, ratio=0.1, interval_hours=0) is True
+        assert needs_compaction(metadata, "2026-01-01T12:00:00+00:00", now=now, ratio=0.5, interval_hours=6) is True
+        assert needs_compaction(metadata, "2026-01-01T23:00:00+00:00", now=now, ratio=0.5, interval_hours=6) is False
+        assert needs_compaction(metadata[:4], None, now=now) is False
+
+    def test_plain_flat_indexes_are_converted(self):
+        legacy = faiss.IndexFlatL2(4)
+        legacy.add(np.eye(4, dtype="float32"))
+
+        index = as_id_mapped(legacy)
+
+        assert isinstance(index, faiss.IndexIDMap2)
+        assert index.search(np.eye(4, dtype="float32")[2:3], 1)[1][0, 0] == 2
+
+    def test_updated_artifacts_load_and_filter(self, deployed, tmp_path):
+        from attribute_index import ATTRIBUTES_FILE, build_attribute_index
+        from index_holder import INDEX_FILE, METADATA_FILE, IndexVersion, load_index_version, write_manifest
+        from metadata_store import write_metadata_store
+        from rag_helper import search_batch
+
+        index, previous = deployed
+        catalog = [entry("A", "alpha", price=5.0), entry("B", "bravo"), entry("C", "charlie", price=50.0)]
+        index, metadata = apply_diff(index, previous, diff_catalog(previous, catalog), np.zeros((0, 4)))
+        faiss.write_index(index, str(tmp_path / INDEX_FILE))
+        with open(tmp_path / METADATA_FILE, "w", encoding="utf-8") as f:
+            json.dump(metadata, f)
+        write_metadata_store(str(tmp_path / "index_metadata.db"), metadata)
+        build_attribute_index(str(tmp_path / ATTRIBUTES_FILE), [e.get("attributes", {}) for e in metadata])
+        write_manifest(str(tmp_path), len(metadata), live_rows=index.ntotal, tombstones=tombstone_count(metadata))
+
+        version = load_index_version(str(tmp_path))
+        selection = version.attributes.select(version.attributes.parse("something under $20"))
+        (_, ids), = search_batch([(version, np.eye(4, dtype="float32")[3:4], 4, selection)])
+
+        assert isinstance(version, IndexVersion) and len(version.metadata) == 4
+        assert set(ids[0].tolist()) - {-1} == {0, 1}
+
+    def test_warmup_touches_every_live_row_of_a_tombstoned_index(self, deployed):
+        from warmup import touch_index_pages
+
+        index, previous = deployed
+        index, metadata = apply_diff(index, previous, diff_catalog(previous, previous[1:]), np.zeros((0, 4)))
+
+        assert touch_index_pages(index) == 3
+
+    def test_loaded_indexes_outlive_their_version(self, tmp_path):
+        from index_holder import load_faiss_index
+
+        path = str(tmp_path / "index.faiss")
+        faiss.write_index(id_mapped_index(np.eye(4, dtype="float32")), path)
+        loaded = {"index": load_faiss_index(path, mmap=False)}
+        index = as_id_mapped(loaded.pop("index"))
+        gc.collect()
+
+        # Still valid once the loaded version is gone
+        assert index.ntotal == 4
+        assert index.search(np.eye(4, dtype="float32")[1:2], 1)[1][0, 0] == 1
@@ -0,0 +1,203 @@
+"""
+Tests for versioned index loading and hot reload.
+"""
+import os
+import sys
+import json
+import shutil
+import subprocess
+import faiss
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from index_holder import (
+    IndexHolder, IndexValidationError, EmbedderMismatchError, load_index_version, write_manifest, parse_gcs_uri,
+    publish_artifacts,
+    INDEX_FILE, METADATA_FILE, MANIFEST_FILE, LEGACY_EMBEDDER, INCOMING_PREFIX, LOADED_DIR
+)
+
+
+def write_artifacts(directory, titles, **manifest_extra):
+    os.makedirs(directory, exist_ok=True)
+    vectors = np.random.RandomState(len(titles)).rand(len(titles), 4).astype("float32")
+    index = faiss.IndexFlatL2(4)
+    index.add(vectors)
+    faiss.write_index(index, os.path.join(directory, INDEX_FILE))
+    metadata = [{"parent_asin": f"ASIN{i}", "title": title, "chunk_text": f"Title: {title}"} for i, title in enumerate(titles)]
+    with open(os.path.join(directory, METADATA_FILE), "w", encoding="utf-8") as f:
+        json.dump(metadata, f)
+    return write_manifest(str(directory), index.ntotal, **manifest_extra)
+
+
+class TestIndexHolder:
+    def test_load_uses_manifest_version(self, tmp_path):
+        manifest = write_artifacts(tmp_path, ["A", "B"])
+        version = load_index_version(str(tmp_path))
+
+        assert version.version == manifest["version"]
+        assert version.index.ntotal == 2
+        assert version.metadata[1]["title"] == "B"
+
+    def test_rejects_row_count_mismatch(self, tmp_path):
+        write_artifacts(tmp_path, ["A", "B"])
+        with open(tmp_path / METADATA_FILE, "w", encoding="utf-8") as f:
+            json.dump([{"parent_asin": "ASIN0", "title": "A", "chunk_text": ""}], f)
+
+        with pytest.raises(IndexValidationError):
+            load_index_version(str(tmp_path), verify_checksums=False)
+
+    def test_rejects_checksum_mismatch(self, tmp_path):
+        write_artifacts(tmp_path, ["A", "B"])
+        with open(tmp_path / METADATA_FILE, "a", encoding="utf-8") as f:
+            f.write(" ")
+
+        with pytest.raises(IndexValidationError):
+            load_index_version(str(tmp_path))
+
+    def test_publish_moves_a_build_over_the_deployed_artifacts(self, tmp_path):
+        deployed = tmp_path / "deployed"
+        write_artifacts(deployed, ["A", "B"])
+        build = tmp_path / "build"
+        manifest = write_artifacts(build, ["C", "D", "E"])
+
+        publish_artifacts(str(build), str(deployed))
+
+        version = load_index_version(str(deployed))
+        assert version.version == manifest["version"]
+        assert version.metadata[2]["title"] == "E"
+        assert not build.exists()
+
+    def test_publish_needs_a_manifest(self, tmp_path):
+        deployed = tmp_path / "deployed"
+        write_artifacts(deployed, ["A", "B"])
+        build = tmp_path / "build"
+        write_artifacts(build, ["C"])
+        os.remove(build / MANIFEST_FILE)
+
+        with pytest.raises(IndexValidationError):
+            publish_artifacts(str(build), str(deployed))
+        assert load_index_version(str(deployed)).index.ntotal == 2
+
+    def test_reload_swaps_while_old_snapshot_stays_usable(self, tmp_path):
+        source = tmp_path / "source"
+        write_artifacts(source, ["A", "B"])
+        holder = IndexHolder(source=str(source), staging_dir=str(tmp_path / "staging"))
+        holder.reload()
+
+        in_flight = holder.current()
+        write_artifacts(source, ["A", "B", "C"])
+        assert holder.check_for_update()
+
+        assert holder.current().index.ntotal == 3
+        assert holder.current().version != in_flight.version
+        # The request that started on the old version still searches it
+        _, ids = in_flight.index.search(np.zeros((1, 4), dtype="float32"), 2)
+        assert in_flight.index.ntotal == 2
+        assert set(ids[0]) <= {0, 1}
+
+    def test_failed_reload_keeps_current_version(self, tmp_path):
+        source = tmp_path / "source"
+        write_artifacts(source, ["A", "B"])
+        holder = IndexHolder(source=str(source), staging_dir=str(tmp_path / "staging"))
+        good = holder.reload()
+
+        os.remove(source / MANIFEST_FILE)
+        os.remove(source / METADATA_FILE)
+        with pytest.raises(IndexValidationError):
+            holder.reload()
+        assert holder.current() is good
+        assert holder.last_error
+
+    def test_first_poll_reloads_unless_the_startup_load_is_the_source_version(self, tmp_path):
+        source, bundled = tmp_path / "source", tmp_path / "bundled"
+        write_artifacts(source, ["A", "B"])
+        shutil.copytree(source, bundled)
+        holder = IndexHolder(initial_dir=str(bundled), source=str(source), staging_dir=str(tmp_path / "staging"))
+        holder.current()
+        assert not holder.check_for_update()
+
+        write_artifacts(bundled, ["A"])
+        holder = IndexHolder(initial_dir=str(bundled), source=str(source), staging_dir=str(tmp_path / "staging"))
+        holder.current()
+        assert holder.check_for_update()
+        assert holder.current().index.ntotal == 2
+
+    def test_workers_share_one_directory_per_version(self, tmp_path):
+        source = tmp_path / "source"
+        write_artifacts(source, ["A", "B"])
+        worker_a = IndexHolder(source=str(source), staging_dir=str(tmp_path / "staging"))
+        worker_b = IndexHolder(source=str(source), staging_dir=str(tmp_path / "staging"))
+
+        first, _ = worker_a.stage()
+        inode = os.stat(os.path.join(first, INDEX_FILE)).st_ino
+        shared, _ = worker_b.stage()
+        write_artifacts(source, ["A", "B", "C"])
+        updated, _ = worker_b.stage()
+
+        assert shared == first and updated != first
+        # Reused as published, never written to again
+        assert os.stat(os.path.join(first, INDEX_FILE)).st_ino == inode
+        assert not [name for name in os.listdir(tmp_path / "staging") if name.startswith(INCOMING_PREFIX)]
+
+    def test_cleanup_keeps_versions_a_live_worker_has_loaded(self, tmp_path):
+        source, staging = tmp_path / "source", tmp_path / "staging"
+        exited = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                                capture_output=True, text=True, check=True).stdout.strip()
+        loaded_elsewhere, abandoned = staging / "loaded-elsewhere", staging / "abandoned"
+        os.makedirs(staging / LOADED_DIR)
+        for path, pid in ((loaded_elsewhere, os.getppid()), (abandoned, exited)):
+            os.makedirs(path)
+            open(staging / LOADED_DIR / f"{path.name}.{pid}", "w").close()
+            os.utime(path, (0, 0))
+        os.makedirs(staging / f"{INCOMING_PREFIX}{exited}-x")
+
+        holder = IndexHolder(source=str(source), staging_dir=str(staging), keep_versions=1)
+        for titles in (["A"], ["A", "B"], ["A", "B", "C"]):
+            write_artifacts(source, titles)
+            holder.reload()
+
+        current = holder.current().directory
+        assert sorted(os.listdir(staging)) == sorted([LOADED_DIR, os.path.basename(current), "loaded-elsewhere"])
+        assert sorted(os.listdir(staging / LOADED_DIR)) == sorted(
+            [f"{os.path.basename(current)}.{os.getpid()}", f"loaded-elsewhere.{os.getppid()}"]
+        )
+
+    def test_refuses_index_built_by_another_embedder(self, tmp_path):
+        write_artifacts(tmp_path, ["A", "B"], embedder="local:all-MiniLM-L6-v2", embedding_dim=4)
+
+        version = load_index_version(str(tmp_path), embedder_name="local:all-MiniLM-L6-v2")
+        assert version.embedder == "local:all-MiniLM-L6-v2"
+
+        holder = IndexHolder(initial_dir=str(tmp_path), embedder_name=LEGACY_EMBEDDER)
+        with pytest.raises(EmbedderMismatchError):
+            holder.current()
+        assert holder.loaded() is None
+
+    def test_manifest_without_embedder_is_the_legacy_one(self, tmp_path):
+        write_artifacts(tmp_path, ["A", "B"])
+
+        assert load_index_version(str(tmp_path), embedder_name=LEGACY_EMBEDDER).embedder == LEGACY_EMBEDDER
+        with pytest.raises(EmbedderMismatchError):
+            load_index_version(str(tmp_path), embedder_name="local:all-MiniLM-L6-v2")
+
+    def test_rejects_dimension_mismatch(self, tmp_path):
+        write_artifacts(tmp_path, ["A", "B"], embedding_dim=384)
+
+        with pytest.raises(IndexValidationError):
+            load_index_version(str(tmp_path))
+
+    def test_loads_lexical_index_and_checks_its_size(self, tmp_path):
+        from lexical_index import LEXICAL_FILE, build_lexical_index
+
+        build_lexical_index(str(tmp_path / LEXICAL_FILE), ["Title: A", "Title: B"])
+        write_artifacts(tmp_path, ["A", "B"])
+        assert len(load_index_version(str(tmp_path)).lexical) == 2
+
+        build_lexical_index(str(tmp_path / LEXICAL_FILE), ["Title: A"])
+        with pytest.raises(IndexValidationError):
+            load_index_version(str(tmp_path), verify_checksums=False)
+
+    def test_parse_gcs_uri(self):
+        assert parse_gcs_uri("gs://speaking-chatbot-data/vectors") == ("speaking-chatbot-data", "vectors/")
+        assert parse_gcs_uri("gs://bucket/") == ("bucket", "")
@@ -0,0 +1,178 @@
+"""
+Tests for build-time ANN index selection and the search parameters serving applies.
+"""
+import os
+import sys
+import json
+import faiss
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from attribute_index import Selection
+from incremental_index import apply_diff, as_id_mapped, diff_catalog, flat_vectors, id_mapped_index
+from index_holder import INDEX_FILE, METADATA_FILE, load_index_version, write_manifest
+from index_tuning import build_ann_index, scaled_config, search_parameters, select_ann_index, tune_index
+
+
+def clustered(n, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, n // 50), dim))
+    vectors = centers[rng.integers(0, len(centers), n)] + 0.3 * rng.standard_normal((n, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype("float32")
+
+
+def selection_of(rows, n_rows):
+    mask = np.zeros(n_rows, dtype=bool)
+    mask[rows] = True
+    return Selection(np.packbits(mask, bitorder="little"), n_rows)
+
+
+IVF = {"type": "ivf", "factory": "IVF16,Flat", "params": {"nprobe": 2}}
+HNSW = {"type": "hnsw", "factory": "HNSW16", "params": {"efSearch": 24}}
+
+
+class TestIndexTuning:
+    def test_ranks_the_settings_that_meet_the_targets(self):
+        ranked, measurements = tune_index(clustered(3000), k=5, target_recall=0.9, target_p95_ms=1000, n_queries=100)
+
+        assert measurements[0]["type"] == "flat" and measurements[0]["recall_at_k"] == 1.0
+        assert {m["type"] for m in measurements} == {"flat", "ivf", "hnsw"}
+        qualifying = [m for m in measurements if m["recall_at_k"] >= 0.9]
+        assert len(ranked) == len(qualifying)
+        assert [r["latency_ms"]["mean"] for r in ranked] == sorted(m["latency_ms"]["mean"] for m in qualifying)
+        assert all(m["rows"] == 2900 for m in measurements)
+
+    def test_large_catalogs_are_tuned_on_a_sample(self):
+        ranked, measurements = tune_index(clustered(3000), k=5, target_recall=0.9, target_p95_ms=1000,
+                                          n_queries=100, max_rows=1000)
+
+        assert all(m["rows"] == 900 for m in measurements)
+        assert all(m.get("build_seconds") is not None for m in measurements[1:])
+
+    def test_ships_the_setting_that_meets_the_targets_at_full_size(self):
+        vectors = clustered(3000)
+        exact = id_mapped_index(vectors)
+
+        index, config, measurements = select_ann_index(exact, k=5, target_recall=0.9, target_p95_ms=1000,
+                                                      n_queries=100, min_rows=0, max_rows=1000)
+
+        assert config["rows"] == 3000 and config["sample"]["rows"] == 900
+        assert config["recall_at_k"] >= 0.9
+        assert config["targets"] == {"k": 5, "recall_at_k": 0.9, "p95_ms": 1000}
+        assert measurements[-1]["recall_at_k"] == config["recall_at_k"]
+        assert index.ntotal == 3000
+
+    def test_falls_back_when_the_full_size_index_misses(self, monkeypatch):
+        import index_tuning
+
+        # Both settings met the targets on the sample, but search too narrowly once scaled
+        tuned = [dict(config, rows=900, recall_at_k=1.0, latency_ms={"p95": 0.1, "mean": 0.1}) for config in (IVF, HNSW)]
+        narrow = {"ivf": dict(IVF, factory="IVF64,Flat", params={"nprobe": 1}),
+                  "hnsw": dict(HNSW, params={"efSearch": 1})}
+        monkeypatch.setattr(index_tuning, "tune_index", lambda *args: (tuned, []))
+        monkeypatch.setattr(index_tuning, "scaled_config", lambda config, scale, n: narrow[config["type"]])
+        exact = id_mapped_index(clustered(3000))
+
+        index, config, measurements = select_ann_index(exact, k=20, target_recall=0.99, target_p95_ms=1000,
+                                                      n_queries=50, min_rows=0)
+
+        assert index is exact
+        assert config["type"] == "flat" and config["recall_at_k"] == 1.0 and config["rows"] == 3000
+        assert [m["type"] for m in measurements] == ["ivf", "hnsw", "flat"]
+        assert all(m["recall_at_k"] < 0.99 for m in measurements[:2])
+        assert measurements[0]["sample"]["rows"] == 900
+
+    def test_stays_exact_when_no_setting_qualifies(self):
+        exact = id_mapped_index(clustered(1000))
+        index, config, measurements = select_ann_index(exact, k=5, target_recall=1.01, n_queries=50, min_rows=0)
+        assert index is exact and config["type"] == "flat" and measurements
+
+        index, config, measurements = select_ann_index(exact, min_rows=5000)
+        assert (index, config["factory"], measurements) == (exact, "Flat", [])
+
+    def test_ivf_settings_scale_with_the_catalog(self):
+        config = scaled_config(dict(IVF, params={"nprobe": 2}), 10, 100000)
+
+        assert (config["factory"], config["params"]) == ("IVF160,Flat", {"nprobe": 20})
+        assert scaled_config(HNSW, 10, 100000) is HNSW
+
+    def test_scaled_ivf_keeps_enough_training_points_per_list(self):
+        from index_tuning import MAX_TRAIN_SIZE, MIN_POINTS_PER_LIST
+
+        config = scaled_config(dict(IVF, params={"nprobe": 2}), 1000, 10 ** 7)
+        nlist = MAX_TRAIN_SIZE // MIN_POINTS_PER_LIST
+
+        assert config["factory"] == f"IVF{nlist},Flat"
+        assert config["params"]["nprobe"] == round(2 * nlist / 16)
+
+    def test_ann_builds_read_the_exact_index_in_place(self):
+        vectors = clustered(500)
+        exact = id_mapped_index(vectors, np.arange(500) * 3)
+
+        ids, stored = flat_vectors(exact)
+        index = build_ann_index(stored, ids, HNSW)
+
+        assert not stored.flags.owndata and np.array_equal(stored, vectors)
+        assert index.search(vectors[4:5], 1)[1][0, 0] == 12
+
+    def test_ann_indexes_keep_row_ids_and_their_search_settings(self):
+        vectors = clustered(2000)
+        ids = np.arange(2000) * 2
+
+        for config in (IVF, HNSW):
+            index = build_ann_index(vectors, ids, config)
+            _, found = index.search(vectors[10:11], 3)
+            assert found[0, 0] == 20
+            assert np.allclose(index.reconstruct(20), vectors[10])
+
+        assert faiss.extract_index_ivf(build_ann_index(vectors, ids, IVF)).nprobe == 2
+        assert faiss.downcast_index(build_ann_index(vectors, ids, HNSW).index).hnsw.efSearch == 24
+
+    def test_serving_applies_the_manifest_settings(self, tmp_path):
+        vectors = clustered(1000)
+        index = build_ann_index(vectors, np.arange(1000), IVF)
+        faiss.write_index(index, str(tmp_path / INDEX_FILE))
+        with open(tmp_path / METADATA_FILE, "w", encoding="utf-8") as f:
+            json.dump([{"parent_asin": f"A{i}", "title": "", "chunk_text": ""} for i in range(1000)], f)
+        write_manifest(str(tmp_path), 1000, ann=dict(IVF, params={"nprobe": 6}))
+
+        version = load_index_version(str(tmp_path))
+
+        assert faiss.extract_index_ivf(version.index).nprobe == 6
+
+    @pytest.mark.parametrize("config", [IVF, HNSW])
+    def test_filtered_searches_keep_the_index_type_and_widen(self, config):
+        vectors = clustered(2000)
+        index = build_ann_index(vectors, np.arange(2000), config)
+        allowed = np.arange(0, 2000, 100)
+        selection = selection_of(allowed, 2000)
+
+        params = search_parameters(index, selection)
+        _, found = index.search(vectors[:1], 5, params=params)
+
+        assert set(found[0].tolist()) <= set(allowed.tolist())
+        assert (found[0] >= 0).all()
+        if config is IVF:
+            assert isinstance(params, faiss.SearchParametersIVF) and params.nprobe == 16
+        else:
+            assert isinstance(params, faiss.SearchParametersHNSW) and params.efSearch > 24
+        assert search_parameters(index, None) is None
+
+    def test_plain_indexes_use_the_selection_params(self):
+        index = build_ann_index(clustered(10), np.arange(10), {"type": "flat", "factory": "Flat", "params": {}})
+        selection = selection_of([1, 2], 10)
+
+        assert search_parameters(index, selection) is selection.params
+
+    def test_incremental_updates_flatten_ann_indexes(self):
+        vectors = clustered(500)
+        metadata = [{"parent_asin": f"A{i}", "chunk_text": f"text {i}"} for i in range(500)]
+        index = build_ann_index(vectors, np.arange(500), HNSW)
+
+        flat = as_id_mapped(index)
+        updated, rows = apply_diff(index, metadata, diff_catalog(metadata, metadata[1:]), np.zeros((0, 32)))
+
+        assert isinstance(faiss.downcast_index(flat.index), faiss.IndexFlat)
+        assert np.allclose(flat.reconstruct(7), vectors[7])
+        assert updated.ntotal == 499 and rows[0].get("deleted")
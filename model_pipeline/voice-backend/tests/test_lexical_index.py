@@ -0,0 +1,76 @@
+"""
+Tests for the BM25 index and hybrid retrieval.
+"""
+import os
+import sys
+import faiss
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lexical_index import LexicalIndex, build_lexical_index, open_lexical_index, reciprocal_rank_fusion, tokenize
+
+TEXTS = [
+    "Title: Microsoft Office 2019 Home\nDetails:\nVersion: 2019",
+    "Title: Norton 360 Deluxe antivirus\nDetails:\nDevices: 5",
+    "Title: Photo editor for beginners\nDetails:\nVersion: 2.1",
+    "Title: Microsoft Office 2021 Professional\nDetails:\nVersion: 2021"
+]
+
+
+@pytest.fixture
+def lexical(tmp_path):
+    path = str(tmp_path / "lexical_index.bin")
+    build_lexical_index(path, TEXTS)
+    return LexicalIndex(path)
+
+
+class TestLexicalIndex:
+    def test_tokenize_keeps_versions_and_drops_stopwords(self):
+        assert tokenize("What is the Photo-Editor v2.1 for?") == ["photo-editor", "v2.1"]
+
+    def test_exact_version_ranks_first(self, lexical):
+        doc_ids, scores = lexical.search("office 2019", 2)
+
+        assert doc_ids.tolist() == [0, 3]
+        assert scores[0] > scores[1] > 0
+
+    def test_unknown_terms_return_nothing(self, lexical):
+        doc_ids, scores = lexical.search("spreadsheet", 3)
+
+        assert len(doc_ids) == 0 and len(scores) == 0
+
+    def test_file_is_memory_mapped(self, lexical):
+        assert len(lexical) == len(TEXTS)
+        assert isinstance(lexical.weights.base, np.memmap)
+
+    def test_missing_file_means_no_lexical_index(self, tmp_path):
+        assert open_lexical_index(str(tmp_path / "lexical_index.bin")) is None
+
+    def test_reciprocal_rank_fusion_rewards_agreement(self):
+        fused = reciprocal_rank_fusion([[1, 2, 3], [3, 1]], k=60)
+
+        assert [doc_id for doc_id, _ in fused] == [1, 3, 2]
+
+
+class TestHybridRetrieval:
+    def test_lexical_match_is_fused_into_vector_results(self, lexical):
+        from index_holder import IndexVersion
+        from rag_helper import fetch_top_k_chunks
+
+        # The query vector sits on doc 2, but the question names doc 1 exactly
+        vectors = np.eye(4, dtype="float32")
+        index = faiss.IndexFlatL2(4)
+        index.add(vectors)
+        metadata = [{"parent_asin": f"ASIN{i}", "title": f"T{i}", "chunk_text": text} for i, text in enumerate(TEXTS)]
+        snapshot = IndexVersion(index, metadata, "v1", "/tmp", lexical=lexical)
+
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr("rag_helper.HYBRID_VECTOR_CANDIDATES", 1)
+            results = fetch_top_k_chunks("norton 360", k=2, query_vector=vectors[2:3], snapshot=snapshot)
+
+        assert {r["parent_asin"] for r in results} == {"ASIN1", "ASIN2"}
+        norton = next(r for r in results if r["parent_asin"] == "ASIN1")
+        assert norton["bm25"] > 0
+        # Lexical-only hits still get their vector distance for the context cutoff
+        assert norton["similarity"] == pytest.approx(2.0)
@@ -0,0 +1,110 @@
+"""
+Tests for the mock OpenAI server and the load-test harness.
+"""
+import os
+import sys
+import itertools
+import random
+import numpy as np
+import pytest
+from openai import OpenAI
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mock_openai_server import MockOpenAI, deterministic_embedding, parse_latency, start_mock_server
+from load_test import RequestLog, question_stream, stage_breakdown, summarize
+
+
+@pytest.fixture
+def mock_client():
+    mock = MockOpenAI(dim=8, answer="One two. Three four.")
+    server, base_url = start_mock_server(mock)
+    yield mock, OpenAI(api_key="mock", base_url=base_url, max_retries=0)
+    server.shutdown()
+
+
+class TestMockOpenAI:
+    def test_embeddings_are_deterministic_unit_vectors(self, mock_client):
+        mock, client = mock_client
+
+        first = client.embeddings.create(model="m", input=["a", "b"])
+        second = client.embeddings.create(model="m", input="a")
+
+        assert first.data[0].embedding == second.data[0].embedding
+        assert first.data[0].embedding != first.data[1].embedding
+        assert np.linalg.norm(first.data[1].embedding) == pytest.approx(1.0, abs=1e-5)
+        assert len(first.data[0].embedding) == 8
+        assert mock.counters["embeddings"] == 2
+
+    def test_chat_completion_and_stream_return_the_same_answer(self, mock_client):
+        _, client = mock_client
+        messages = [{"role": "user", "content": "hello"}]
+
+        answer = client.chat.completions.create(model="m", messages=messages)
+        stream = client.chat.completions.create(model="m", messages=messages, stream=True,
+                                                stream_options={"include_usage": True})
+        chunks = list(stream)
+
+        streamed = "".join(c.choices[0].delta.content or "" for c in chunks if c.choices)
+        assert answer.choices[0].message.content == "One two. Three four."
+        assert streamed.strip() == "One two. Three four."
+        assert chunks[-1].usage.completion_tokens == answer.usage.completion_tokens
+
+    def test_injected_errors_are_server_errors(self):
+        server, base_url = start_mock_server(MockOpenAI(dim=4, error_rate=1.0))
+        client = OpenAI(api_key="mock", base_url=base_url, max_retries=0)
+        try:
+            with pytest.raises(Exception) as e:
+                client.embeddings.create(model="m", input="a")
+        finally:
+            server.shutdown()
+        assert getattr(e.value, "status_code", None) == 500
+
+    def test_latency_specs(self):
+        rng = random.Random(0)
+
+        assert parse_latency("const:0.25")(rng) == 0.25
+        assert 1 <= parse_latency("uniform:1,2")(rng) <= 2
+        assert parse_latency("normal:0,0")(rng) == 0.0
+        assert parse_latency("lognormal:0.5,0")(rng) == pytest.approx(0.5)
+        with pytest.raises(ValueError):
+            parse_latency("pareto:1")
+
+    def test_embedding_does_not_depend_on_the_process(self):
+        assert deterministic_embedding("same text", 4) == deterministic_embedding("same text", 4)
+
+
+class TestLoadHarness:
+    def test_question_stream_mixes_repeats_and_unique_questions(self):
+        questions = list(itertools.islice(question_stream("s", 0.5, ["q1", "q2"]), 200))
+
+        again = list(itertools.islice(question_stream("s", 0.5, ["q1", "q2"]), 200))
+        repeated = sum(q in ("q1", "q2") for q in questions)
+        assert questions == again
+        assert 60 < repeated < 140
+        assert len({q for q in questions if q not in ("q1", "q2")}) == 200 - repeated
+
+    def test_summary_counts_errors_but_not_their_latency(self):
+        log = RequestLog()
+        for latency in (0.1, 0.2, 0.3):
+            log.record(200, latency, first_sentence=latency / 2)
+        log.record(503, 0.01, error=True)
+
+        summary = summarize(log, 2.0)
+
+        assert summary["requests"] == 4
+        assert summary["throughput_rps"] == 1.5
+        assert summary["error_rate"] == 0.25
+        assert summary["statuses"] == {"200": 3, "503": 1}
+        assert summary["latency_seconds"]["p50"] == pytest.approx(0.2)
+        assert summary["first_sentence_seconds"]["p50"] == pytest.approx(0.1)
+
+    def test_stage_breakdown_is_the_difference_between_scrapes(self):
+        before = {"embed": (10.0, 1.0, {0.1: 10.0, 0.5: 10.0, float("inf"): 10.0})}
+        after = {
+            "embed": (30.0, 5.0, {0.1: 11.0, 0.5: 30.0, float("inf"): 30.0}),
+            "rerank": (0.0, 0.0, {float("inf"): 0.0})
+        }
+
+        breakdown = stage_breakdown(before, after)
+
+        assert breakdown == {"embed": {"count": 20, "mean_seconds": 0.2, "p95_le_seconds": 0.5}}
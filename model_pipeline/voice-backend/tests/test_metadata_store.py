@@ -0,0 +1,57 @@
+"""
+Tests for the SQLite-backed index metadata store.
+"""
+import os
+import sys
+import json
+import threading
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from metadata_store import MetadataStore, write_metadata_store, open_metadata
+
+
+@pytest.fixture
+def metadata():
+    return [
+        {"parent_asin": "ABC123", "title": "Test Software 1", "chunk_text": "Title: Test Software 1", "price": "$49.99"},
+        {"parent_asin": "DEF456", "title": "Test Software 2", "chunk_text": "Title: Test Software 2"}
+    ]
+
+
+class TestMetadataStore:
+    def test_round_trip_by_row_id(self, tmp_path, metadata):
+        path = str(tmp_path / "index_metadata.db")
+        write_metadata_store(path, metadata)
+
+        store = MetadataStore(path)
+        assert len(store) == 2
+        assert store[0] == metadata[0]
+        assert store[1]["parent_asin"] == "DEF456"
+        assert store[-1]["parent_asin"] == "DEF456"
+        assert list(store) == metadata
+        with pytest.raises(IndexError):
+            store[2]
+
+    def test_reads_from_many_threads(self, tmp_path, metadata):
+        path = str(tmp_path / "index_metadata.db")
+        write_metadata_store(path, metadata)
+        store = MetadataStore(path)
+
+        seen = []
+        threads = [threading.Thread(target=lambda i=i: seen.append(store[i % 2]["parent_asin"])) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert sorted(seen) == ["ABC123"] * 4 + ["DEF456"] * 4
+
+    def test_open_metadata_falls_back_to_json(self, tmp_path, metadata):
+        json_path = tmp_path / "index_metadata.json"
+        json_path.write_text(json.dumps(metadata))
+        store_path = str(tmp_path / "index_metadata.db")
+
+        assert open_metadata(store_path, str(json_path)) == metadata
+
+        write_metadata_store(store_path, metadata)
+        assert isinstance(open_metadata(store_path, str(json_path)), MetadataStore)
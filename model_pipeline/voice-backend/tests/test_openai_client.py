@@ -0,0 +1,142 @@
+"""
+Tests for the shared OpenAI client against a local stand-in HTTP server.
+"""
+import os
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import openai
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from openai_client import (PooledOpenAI, CircuitBreaker, RetryBudget, CircuitOpenError, DeadlineExceeded, RetriesExhausted,
+                           UpstreamUnavailable, deadline)
+
+
+class StandIn:
+    """Plays back a script of (status, delay_seconds) per request, then succeeds."""
+
+    def __init__(self):
+        self.script = []
+        self.requests = 0
+        self.retry_after = None
+
+
+@pytest.fixture
+def stand_in():
+    state = StandIn()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            state.requests += 1
+            status, delay = state.script.pop(0) if state.script else (200, 0)
+            time.sleep(delay)
+            if status == 200:
+                body = {"object": "list", "model": "m", "data": [{"object": "embedding", "index": 0, "embedding": [0.1, 0.2]}],
+                        "usage": {"prompt_tokens": 1, "total_tokens": 1}}
+            else:
+                body = {"error": {"message": "upstream trouble", "type": "server_error"}}
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            if status != 200 and state.retry_after is not None:
+                self.send_header("Retry-After", state.retry_after)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    state.base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    yield state
+    server.shutdown()
+
+
+def make_client(stand_in, **kwargs):
+    kwargs.setdefault("breaker", CircuitBreaker(failure_threshold=3, reset_seconds=60))
+    return PooledOpenAI(base_url=stand_in.base_url, api_key="test", timeout=2, **kwargs)
+
+
+class TestPooledOpenAI:
+    def test_retries_server_errors_then_succeeds(self, stand_in):
+        stand_in.script = [(500, 0), (503, 0)]
+        client = make_client(stand_in, max_retries=2)
+
+        response = client.embeddings(input=["hi"], model="m")
+
+        assert response.data[0].embedding == [0.1, 0.2]
+        assert stand_in.requests == 3
+        assert client.stats()["retries"] == 2
+        assert client.breaker.state == "closed"
+
+    def test_gives_up_after_max_retries(self, stand_in):
+        stand_in.script = [(500, 0)] * 5
+        client = make_client(stand_in, max_retries=1)
+
+        with pytest.raises(RetriesExhausted) as raised:
+            client.embeddings(input=["hi"], model="m")
+        assert isinstance(raised.value.__cause__, openai.InternalServerError)
+        assert stand_in.requests == 2
+
+    def test_exhausted_rate_limit_carries_retry_after(self, stand_in):
+        stand_in.script = [(429, 0)]
+        stand_in.retry_after = "7"
+        client = make_client(stand_in, max_retries=0)
+
+        with pytest.raises(RetriesExhausted) as raised:
+            client.embeddings(input=["hi"], model="m")
+        assert isinstance(raised.value.__cause__, openai.RateLimitError)
+        assert raised.value.retry_after == 7
+
+    def test_retry_budget_limits_retries(self, stand_in):
+        stand_in.script = [(500, 0)] * 5
+        client = make_client(stand_in, max_retries=3, budget=RetryBudget(ratio=0.1, max_tokens=1.0))
+
+        with pytest.raises(RetriesExhausted):
+            client.embeddings(input=["hi"], model="m")
+        # One token in the budget: the first attempt plus a single retry
+        assert stand_in.requests == 2
+
+    def test_breaker_opens_and_fails_fast(self, stand_in):
+        stand_in.script = [(500, 0)] * 3
+        client = make_client(stand_in, max_retries=0)
+
+        for _ in range(3):
+            with pytest.raises(RetriesExhausted):
+                client.embeddings(input=["hi"], model="m")
+        assert client.breaker.state == "open"
+
+        with pytest.raises(CircuitOpenError):
+            client.embeddings(input=["hi"], model="m")
+        assert stand_in.requests == 3
+        assert client.stats()["short_circuited"] == 1
+
+    def test_deadline_caps_attempt_timeout(self, stand_in):
+        stand_in.script = [(200, 1.0)]
+        client = make_client(stand_in, max_retries=2)
+
+        started = time.monotonic()
+        with deadline(0.3):
+            with pytest.raises(UpstreamUnavailable):
+                client.embeddings(input=["hi"], model="m")
+        assert time.monotonic() - started < 0.9
+
+    def test_half_open_probe_closes_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.01)
+        breaker.record_failure()
+        with pytest.raises(CircuitOpenError):
+            breaker.allow()
+
+        time.sleep(0.02)
+        breaker.allow()  # the probe
+        with pytest.raises(CircuitOpenError):
+            breaker.allow()  # only one probe at a time
+        breaker.record_success()
+        assert breaker.state == "closed"
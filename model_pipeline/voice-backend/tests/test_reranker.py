@@ -0,0 +1,62 @@
+"""
+Tests for cross-encoder re-ranking and its pair-score cache.
+"""
+import os
+import sys
+import faiss
+import numpy as np
+import pytest
+from unittest.mock import MagicMock, patch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from reranker import CrossEncoderReranker, rerank_text
+
+
+def fake_reranker(scores_by_text):
+    """A reranker whose model scores a pair by looking up the chunk's title line."""
+    reranker = CrossEncoderReranker("test-cross-encoder", cache_size=100)
+    model = MagicMock()
+    model.predict.side_effect = lambda pairs, **kwargs: np.array(
+        [scores_by_text[text.splitlines()[0]] for _, text in pairs], dtype="float32"
+    )
+    reranker._model = model
+    return reranker
+
+
+class TestReranker:
+    def test_rerank_text_leaves_out_reviews(self):
+        chunk = "Title: A\nPrice: 10\nDetails:\nVersion: 2\n\nTop Reviews:\nGreat"
+
+        assert rerank_text(chunk) == "Title: A\nPrice: 10\nDetails:\nVersion: 2"
+
+    def test_scores_all_pairs_in_one_batch_and_caches_them(self):
+        reranker = fake_reranker({"Title: A": 0.1, "Title: B": 2.0})
+
+        first = reranker.score("Which one?", ["v1:0", "v1:1"], ["Title: A", "Title: B"])
+        second = reranker.score("which  one?", ["v1:1", "v1:0"], ["Title: B", "Title: A"])
+
+        assert first.tolist() == pytest.approx([0.1, 2.0])
+        assert second.tolist() == pytest.approx([2.0, 0.1])
+        reranker.model.predict.assert_called_once()
+        stats = reranker.stats()
+        assert stats["pairs_scored"] == 2
+        assert stats["pairs_cached"] == 2
+
+    def test_fetch_top_k_chunks_keeps_the_best_reranked_candidates(self):
+        from index_holder import IndexVersion
+        from rag_helper import fetch_top_k_chunks
+
+        vectors = np.eye(4, dtype="float32")
+        index = faiss.IndexFlatL2(4)
+        index.add(vectors)
+        metadata = [{"parent_asin": f"ASIN{i}", "title": f"T{i}", "chunk_text": f"Title: T{i}"} for i in range(4)]
+        snapshot = IndexVersion(index, metadata, "v1", "/tmp")
+        # Row 0 is the nearest vector, but the cross-encoder prefers row 3
+        reranker = fake_reranker({"Title: T0": 0.5, "Title: T1": -1.0, "Title: T2": -2.0, "Title: T3": 3.0})
+
+        with patch("rag_helper.reranker", reranker), patch("rag_helper.RERANK_CANDIDATES", 4):
+            results = fetch_top_k_chunks("question", k=2, query_vector=vectors[0:1], snapshot=snapshot)
+
+        assert [r["parent_asin"] for r in results] == ["ASIN3", "ASIN0"]
+        assert results[0]["rerank_score"] == pytest.approx(3.0)
+        assert "similarity" in results[0]
@@ -0,0 +1,109 @@
+"""
+Tests for single-flight request coalescing.
+"""
+import os
+import sys
+import time
+import threading
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from single_flight import SingleFlight
+
+
+def run_concurrently(fns):
+    results = [None] * len(fns)
+
+    def run(i):
+        results[i] = fns[i]()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(fns))]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.01)  # the first thread becomes the leader
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class TestSingleFlight:
+    def test_concurrent_callers_share_one_call(self):
+        flight = SingleFlight(timeout=5)
+        calls = []
+
+        def work():
+            calls.append(1)
+            time.sleep(0.2)
+            return {"answer": 42}
+
+        results = run_concurrently([lambda: flight.do("q", work) for _ in range(5)])
+
+        assert len(calls) == 1
+        assert [value for value, _ in results] == [{"answer": 42}] * 5
+        assert sorted(shared for _, shared in results) == [False] + [True] * 4
+        stats = flight.stats()
+        assert stats["leaders"] == 1
+        assert stats["followers"] == 4
+        assert stats["in_flight"] == 0
+
+    def test_different_keys_do_not_wait_on_each_other(self):
+        flight = SingleFlight(timeout=5)
+
+        results = run_concurrently([lambda k=k: flight.do(k, lambda: k) for k in ("a", "b")])
+
+        assert results == [("a", False), ("b", False)]
+
+    def test_follower_falls_back_after_timeout(self):
+        flight = SingleFlight(timeout=0.05)
+        release = threading.Event()
+
+        def slow():
+            release.wait(2)
+            return "leader"
+
+        leader = threading.Thread(target=flight.do, args=("q", slow))
+        leader.start()
+        time.sleep(0.01)
+
+        assert flight.do("q", lambda: "fallback") == ("fallback", False)
+        release.set()
+        leader.join()
+        assert flight.stats()["fallbacks"] == 1
+
+    def test_follower_falls_back_when_leader_fails(self):
+        flight = SingleFlight(timeout=5)
+
+        def failing():
+            time.sleep(0.1)
+            raise RuntimeError("upstream down")
+
+        def lead():
+            with pytest.raises(RuntimeError):
+                flight.do("q", failing)
+
+        leader = threading.Thread(target=lead)
+        leader.start()
+        time.sleep(0.01)
+
+        assert flight.do("q", lambda: "fallback") == ("fallback", False)
+        leader.join()
+
+    def test_coalesces_across_workers_through_shared_dir(self, tmp_path):
+        # Two instances stand in for two gunicorn workers on one machine
+        worker_a = SingleFlight(timeout=5, shared_dir=str(tmp_path))
+        worker_b = SingleFlight(timeout=5, shared_dir=str(tmp_path))
+        calls = []
+
+        def work():
+            calls.append(1)
+            time.sleep(0.2)
+            return {"response": "shared answer"}
+
+        results = run_concurrently([
+            lambda: worker_a.do("v1\x00question", work),
+            lambda: worker_b.do("v1\x00question", work)
+        ])
+
+        assert len(calls) == 1
+        assert results == [({"response": "shared answer"}, False), ({"response": "shared answer"}, True)]
+        assert worker_b.stats()["shared_followers"] == 1
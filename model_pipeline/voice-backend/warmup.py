@@ -0,0 +1,156 @@
+"""
+Warmup for the voice backend.
+
+Importing app.py only builds the Flask app. Warmup then loads the index,
+touches its pages, runs a few synthetic searches and opens the OpenAI
+connection pool, so the first user request does not pay for any of it.
+/readyz reports the state recorded here.
+"""
+import os
+import threading
+import time
+
+import faiss
+import numpy as np
+
+from memory_stats import process_memory
+
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "true").lower() == "true"
+WARMUP_SEARCHES = int(os.getenv("WARMUP_SEARCHES", 8))
+WARMUP_QUERIES = [q for q in os.getenv("WARMUP_QUERIES", "best antivirus software").split("|") if q.strip()]
+TOUCH_BLOCK_ROWS = 10000
+
+
+class WarmupState:
+    def __init__(self):
+        self.status = "cold"  # cold -> warming -> ready | failed
+        self.started_at = None
+        self.finished_at = None
+        self.steps = {}  # step name -> seconds
+        self.warnings = []
+        self.error = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self.status == "ready"
+
+    def to_dict(self):
+        return {
+            "status": self.status,
+            "duration_seconds": round(self.finished_at - self.started_at, 3) if self.finished_at else None,
+            "steps": {name: round(seconds, 3) for name, seconds in self.steps.items()},
+            "warnings": list(self.warnings),
+            "error": self.error
+        }
+
+
+state = WarmupState()
+
+
+def touch_index_pages(index):
+    """Read every stored vector once so mmapped/preloaded pages are resident."""
+    if isinstance(index, faiss.IndexIDMap):
+        # By position in the wrapped index: reconstructing through the ID map
+        # looks up each row id and fails at the first tombstoned one
+        index = faiss.downcast_index(index.index)
+    if not hasattr(index, "reconstruct_n"):
+        return 0
+    touched = 0
+    try:
+        for start in range(0, index.ntotal, TOUCH_BLOCK_ROWS):
+            count = min(TOUCH_BLOCK_ROWS, index.ntotal - start)
+            index.reconstruct_n(start, count)
+            touched += count
+    except RuntimeError:
+        # Index types without reconstruct support (or a direct map) only get the searches
+        pass
+    return touched
+
+
+def touch_metadata_pages(metadata):
+    """Scan the metadata store once so its pages are in the page cache."""
+    warm = getattr(metadata, "warm", None)  # in-memory JSON metadata has nothing to warm
+    if warm is not None:
+        warm()
+
+
+def run_synthetic_searches(index, count=WARMUP_SEARCHES, k=3):
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((count, index.d)).astype("float32")
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    for query in queries:
+        index.search(query.reshape(1, -1), k)
+
+
+def run_warmup(index_holder, embed_query=None, warm_state=None, reranker=None):
+    """
+    Run every warmup step and record timings in warm_state. Failing to reach
+    OpenAI is only a warning: the instance can still serve cached answers.
+    A re-ranker is loaded here so the first request does not pay for it.
+    """
+    warm_state = warm_state or state
+    with warm_state._lock:
+        if warm_state.status in ("warming", "ready"):
+            return warm_state
+        warm_state.status = "warming"
+        warm_state.started_at = time.time()
+
+    def step(name, fn):
+        started = time.perf_counter()
+        result = fn()
+        warm_state.steps[name] = time.perf_counter() - started
+        return result
+
+    try:
+        snapshot = step("load_index", index_holder.current)
+        step("touch_index", lambda: touch_index_pages(snapshot.index))
+        step("touch_metadata", lambda: touch_metadata_pages(snapshot.metadata))
+        step("synthetic_search", lambda: run_synthetic_searches(snapshot.index))
+        if reranker is not None:
+            step("load_reranker", reranker.warm)
+
+        if embed_query is not None:
+            try:
+                # Opens the pooled HTTPS connection and fills the embedding cache
+                step("openai_connect", lambda: [embed_query(query) for query in WARMUP_QUERIES])
+            except Exception as e:
+                warm_state.warnings.append(f"openai warmup failed: {e}")
+
+        warm_state.status = "ready"
+    except Exception as e:
+        warm_state.status = "failed"
+        warm_state.error = str(e)
+        print("Warmup failed:", e)
+    finally:
+        warm_state.finished_at = time.time()
+
+    print(f"Warmup {warm_state.status} in {warm_state.finished_at - warm_state.started_at:.2f}s: {warm_state.to_dict()['steps']}")
+    return warm_state
+
+
+def start_warmup(index_holder, embed_query=None, warm_state=None, reranker=None):
+    """Run warmup in a daemon thread (one per worker, after fork)."""
+    warm_state = warm_state or state
+    if warm_state._thread is not None:
+        return warm_state._thread
+    warm_state._thread = threading.Thread(
+        target=run_warmup, args=(index_holder, embed_query, warm_state, reranker), name="warmup", daemon=True
+    )
+    warm_state._thread.start()
+    return warm_state._thread
+
+
+def readiness(index_holder, warm_state=None):
+    """Body for /readyz. Never triggers an index load."""
+    warm_state = warm_state or state
+    loaded = index_holder.loaded()
+    return {
+        "ready": warm_state.ready,
+        "warmup": warm_state.to_dict(),
+        "index_version": loaded.version if loaded else None,
+        "index_rows": loaded.index.ntotal if loaded else None,
+        "index_reload_error": index_holder.last_error,
+        "memory": process_memory()
+    }